@@ -0,0 +1,290 @@
+"""
+Computations shared by the /user and /analysis routes, the /analysis/wrap
+endpoint and ingest-time materialization.
+
+Each function works on already loaded dataset steps (the `data` of a
+{"step", "data"} entry), so a caller can load a dataset once and compute any
+number of results from it.
+"""
+from collections import Counter
+from utils import classify_mood, classify_moods, mood_feature_array, predict_personality, predict_personality_batch
+from audio_features import audio_feature_store
+from metrics import timed
+from models import (
+    Decoder, project_tracks, project_artists,
+    DEFAULT_TRACK_FIELDS, DEFAULT_ARTIST_FIELDS, DEFAULT_RECENTLY_PLAYED_FIELDS
+)
+
+TIME_RANGES = ['short_term', 'medium_term', 'long_term']
+
+def time_range_step(kind, time_range):
+    """Return the dataset step holding top `kind` ('artists' or 'tracks') for a time range"""
+    return f"top_{kind}_{time_range.split('_')[0]}" if time_range != 'long_term' else f"top_{kind}_long"
+
+def _first(result, limit):
+    # Only the first `limit` items of a raw step are decoded
+    return dict(result, items=result.get('items', [])[:limit])
+
+@timed('filter_recently_played')
+def filter_recently_played(result, limit, fields=None):
+    """Keep only the track fields the slides use (or `fields`) from a recently_played step"""
+    fields = fields or DEFAULT_RECENTLY_PLAYED_FIELDS
+    return project_tracks(Decoder().tracks(_first(result, limit), nested=True), limit, fields)
+
+@timed('filter_top_artists')
+def filter_top_artists(result, limit, fields=None):
+    """Keep only the artist fields the slides use (or `fields`) from a top_artists step"""
+    fields = fields or DEFAULT_ARTIST_FIELDS
+    return project_artists(Decoder().artists(_first(result, limit)), limit, fields)
+
+@timed('filter_top_tracks')
+def filter_top_tracks(result, limit, fields=None):
+    """Keep only the track fields the slides use (or `fields`) from a top_tracks step"""
+    fields = fields or DEFAULT_TRACK_FIELDS
+    return project_tracks(Decoder().tracks(_first(result, limit), nested=False), limit, fields)
+
+@timed('filter_saved_tracks')
+def filter_saved_tracks(result, limit, fields=None):
+    """Keep only the track fields the slides use (or `fields`) from a saved_tracks step"""
+    fields = fields or DEFAULT_TRACK_FIELDS
+    return project_tracks(Decoder().tracks(_first(result, limit), nested=True), limit, fields)
+
+@timed('mood_distribution')
+def mood_distribution(recently_played, features=None, vectorized=False):
+    """
+    Mood distribution (pie chart data) of recently played tracks.
+
+    Audio features are read through the audio feature store unless a
+    {track_id: features} dict is passed in; errors while fetching them from
+    Spotify are raised to the caller. Requests label tracks one by one with
+    classify_mood; batch scoring (materialize.compute_results) passes
+    vectorized=True to label them with one classify_moods call instead, which
+    gives the same labels.
+    """
+    # Process all recently played tracks
+    filtered_tracks = []
+
+    for item in recently_played.get('items', []):
+        track = item.get('track', {})
+        played_at = item.get('played_at')
+
+        if not played_at:
+            continue
+
+        track_id = track.get('id')
+        if track_id:
+            filtered_tracks.append({
+                'id': track_id,
+                'name': track.get('name'),
+                'played_at': played_at
+            })
+
+    # Get audio features for the tracks; only ids not in the feature store
+    # are requested from Spotify (in batches of 50)
+    track_ids = [track['id'] for track in filtered_tracks]
+    if features is None:
+        features_list = audio_feature_store.get_features(track_ids)
+    else:
+        features_list = [features.get(track_id) for track_id in track_ids]
+    features_list = [track_features for track_features in features_list if track_features]
+
+    if vectorized:
+        all_moods, mood_counts = classify_moods(mood_feature_array(features_list))
+    else:
+        all_moods = [classify_mood(track_features) for track_features in features_list]
+        mood_counts = Counter(all_moods)
+    mood_counts = dict(mood_counts)
+
+    # Calculate percentages
+    total_tracks = len(all_moods)
+    mood_percentages = {
+        mood: (count / total_tracks) * 100
+        for mood, count in mood_counts.items()
+    }
+
+    # Format for pie chart data
+    return {
+        'labels': list(mood_counts.keys()),
+        'data': list(mood_counts.values()),
+        'percentages': mood_percentages,
+        'total_tracks': total_tracks
+    }
+
+async def mood_distribution_async(recently_played):
+    """mood_distribution for the event loop: missing audio features are fetched without blocking it"""
+    track_ids = [item.get('track', {}).get('id') for item in recently_played.get('items', [])
+                 if item.get('played_at') and item.get('track', {}).get('id')]
+    features = await audio_feature_store.get_many_async(track_ids)
+    return mood_distribution(recently_played, features)
+
+@timed('popularity_score')
+def popularity_score(top_tracks, username, time_range):
+    """Simple and position-weighted popularity of a user's top tracks"""
+    # Calculate average popularity
+    total_popularity = 0
+    track_count = 0
+    weighted_popularity = 0
+
+    track_items = top_tracks.get('items', [])
+
+    # Calculate both simple average and weighted average
+    for i, item in enumerate(track_items):
+        popularity = item.get('popularity', 0)
+
+        # Simple average
+        total_popularity += popularity
+
+        # Weighted average (top tracks have higher weight)
+        position_weight = 1 - (i / len(track_items)) if track_items else 0
+        weighted_popularity += popularity * position_weight
+
+        track_count += 1
+
+    # Calculate results
+    if track_count > 0:
+        average_popularity = total_popularity / track_count
+        weighted_average = weighted_popularity / track_count
+    else:
+        average_popularity = 0
+        weighted_average = 0
+
+    # Get additional stats
+    popularity_values = [item.get('popularity', 0) for item in track_items]
+    min_popularity = min(popularity_values) if popularity_values else 0
+    max_popularity = max(popularity_values) if popularity_values else 0
+
+    return {
+        'username': username,
+        'time_range': time_range,
+        'average_popularity': round(average_popularity, 2),
+        'weighted_average': round(weighted_average, 2),
+        'min_popularity': min_popularity,
+        'max_popularity': max_popularity,
+        'track_count': track_count
+    }
+
+@timed('weighted_genre_counts')
+def weighted_genre_counts(top_artists):
+    """
+    Count artist genres, weighting each artist by rank.
+
+    Higher ranked artists' genres count multiple times: the position weight is
+    converted to an integer multiplier between 1 and 5.
+    """
+    genre_counts = Counter()
+    artist_items = top_artists.get('items', [])
+
+    for i, artist in enumerate(artist_items):
+        position_weight = 1 - (i / len(artist_items)) if artist_items else 0
+        weight_multiplier = max(1, int(position_weight * 5))
+
+        for genre in artist.get('genres', []):
+            genre_counts[genre] += weight_multiplier
+
+    return genre_counts
+
+@timed('genre_distribution')
+def genre_distribution(top_artists, time_range, top_n=10, genre_counts=None):
+    """Top N genres (pie chart data) of a user's top artists"""
+    if genre_counts is None:
+        genre_counts = weighted_genre_counts(top_artists)
+
+    # Get top N genres
+    top_genres = genre_counts.most_common(top_n)
+
+    # Calculate percentages
+    total_count = sum(count for _, count in top_genres)
+
+    # Create result in pie chart format
+    labels = [genre for genre, _ in top_genres]
+    data = [count for _, count in top_genres]
+    percentages = {genre: (count / total_count) * 100 for genre, count in top_genres}
+
+    return {
+        'labels': labels,
+        'data': data,
+        'percentages': {k: round(v, 2) for k, v in percentages.items()},
+        'total_genres': sum(genre_counts.values()),
+        'unique_genres': len(genre_counts),
+        'time_range': time_range
+    }
+
+@timed('personality_inputs')
+def personality_inputs(top_artists, top_tracks, genre_counts=None):
+    """
+    Gather the (top_genres, audio_features, track_popularity_data) that
+    predict_personality takes from a user's top artists and top tracks.
+    """
+    if genre_counts is None:
+        genre_counts = weighted_genre_counts(top_artists)
+
+    # Get top genres with their counts
+    top_genres = genre_counts.most_common(15)  # Use top 15 genres for prediction
+
+    # Fetch audio features for top tracks
+    audio_features = None
+    track_popularity_data = None
+
+    if top_tracks and 'items' in top_tracks:
+        track_items = top_tracks['items'][:20]  # Analyze top 20 tracks max
+        track_ids = [track['id'] for track in track_items if track.get('id')]
+
+        # Extract track popularity data for additional analysis
+        track_popularity_data = []
+        for track in track_items:
+            if track.get('id'):
+                track_info = {
+                    'id': track['id'],
+                    'popularity': track.get('popularity', 0),
+                    'duration_ms': track.get('duration_ms', 0),
+                    'explicit': track.get('explicit', False),
+                    'release_date': track.get('album', {}).get('release_date', ''),
+                    'artist_followers': track.get('artists', [{}])[0].get('followers', {}).get('total', 0) if track.get('artists') else 0
+                }
+                track_popularity_data.append(track_info)
+
+        if track_ids:
+            try:
+                # Filter out None values (tracks without features)
+                audio_features = [f for f in audio_feature_store.get_features(track_ids) if f is not None]
+            except Exception as e:
+                print(f"Error fetching audio features: {e}")
+                audio_features = None
+
+    return top_genres, audio_features, track_popularity_data
+
+def personality_response(inputs, personality, username, time_range):
+    """Build the personality prediction response from personality_inputs and the prediction"""
+    top_genres, audio_features, _ = inputs
+    # Add the top genres to the response for reference
+    return {
+        'username': username,
+        'time_range': time_range,
+        'top_genres': [genre for genre, _ in top_genres[:10]],  # Just include names of top 10
+        'audio_features_count': len(audio_features) if audio_features else 0,
+        'personality': personality
+    }
+
+def features_unavailable(inputs):
+    """True if personality_inputs had top tracks but could not fetch their audio features"""
+    _, audio_features, track_popularity_data = inputs
+    return audio_features is None and bool(track_popularity_data)
+
+def personality_prediction(top_artists, top_tracks, username, time_range, genre_counts=None):
+    """Personality prediction from a user's top artists' genres and top tracks"""
+    inputs = personality_inputs(top_artists, top_tracks, genre_counts)
+    # Predict personality based on genres, audio features, and additional data
+    return personality_response(inputs, predict_personality(*inputs), username, time_range)
+
+def personality_predictions(requests):
+    """
+    Personality predictions for many (top_artists, top_tracks, username,
+    time_range, genre_counts) requests, scored together in one batch.
+    """
+    inputs = [personality_inputs(top_artists, top_tracks, genre_counts)
+              for top_artists, top_tracks, _, _, genre_counts in requests]
+    personalities = predict_personality_batch(inputs)
+    return [
+        personality_response(user_inputs, personality, username, time_range)
+        for user_inputs, personality, (_, _, username, time_range, _) in zip(inputs, personalities, requests)
+    ]
@@ -0,0 +1,196 @@
+"""
+Async serving mode (aiohttp) for the routes that wait on Spotify.
+
+Under a threaded WSGI server every request holds a worker thread for as long
+as it runs, so a few slow audio-features calls to Spotify can occupy all of
+them. This server runs /analysis/mood_distribution and
+/analysis/track_features as coroutines on one event loop instead: their
+Spotify calls go through AsyncSpotifyClient (aiohttp), and only the dataset
+and SQLite reads and writes are handed to the worker threads. Every other
+route is passed to the Flask app on the same bounded pool of worker threads.
+Response bodies, ETags, 304s and CORS headers are the same as the Flask app's.
+
+    python async_server.py --port 5000 --workers 8
+"""
+import os
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from multidict import CIMultiDict
+from werkzeug.http import parse_etags, quote_etag
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Response as WSGIResponse
+
+from main import app
+import conditional
+import metrics
+import warmup
+from singleflight import flights, request_key
+from utils import get_from_file
+from audio_features import audio_feature_store
+from spotify_client import async_spotify_client, upstream_error
+from analytics import mood_distribution_async
+from materialize import load_materialized, materialized_section
+
+# Worker threads for dataset I/O and for the routes served by the Flask app
+ASYNC_WORKERS = int(os.getenv('ASYNC_WORKERS', 8))
+
+def json_response(data, status=200):
+    # Flask's JSON provider gives the same body as jsonify in the Flask routes
+    return web.Response(body=app.json.response(data).get_data(), status=status,
+                        content_type='application/json')
+
+def conditional_get(endpoint):
+    """Give a handler the ETag / 304 handling conditional.py gives the Flask route `endpoint`"""
+    def decorator(handler):
+        async def wrapper(request):
+            etag = conditional.dataset_etag(endpoint, list(request.query.items())) if request.method == 'GET' else None
+            if etag is not None and parse_etags(request.headers.get('If-None-Match')).contains_weak(etag):
+                conditional.count("not_modified")
+                return web.Response(status=304, headers={
+                    'ETag': quote_etag(etag), 'Cache-Control': conditional.cache_control()
+                })
+            response = await handler(request)
+            if etag is not None and response.status == 200:
+                conditional.count("tagged")
+                response.headers['ETag'] = quote_etag(etag)
+                response.headers['Cache-Control'] = conditional.cache_control()
+            return response
+        return wrapper
+    return decorator
+
+def single_flight(endpoint):
+    """Collapse identical concurrent requests to a handler into one call, as singleflight.py does for Flask"""
+    def decorator(handler):
+        async def wrapper(request):
+            async def respond():
+                response = await handler(request)
+                return response.body, response.status, response.content_type
+            # Each caller gets its own response: the middleware and conditional_get add headers to it
+            body, status, content_type = await flights.do_async(
+                request_key(endpoint, request.query.items()), respond, endpoint)
+            return web.Response(body=body, status=status, content_type=content_type)
+        return wrapper
+    return decorator
+
+@conditional_get('analysis.get_mood_distribution')
+@single_flight('analysis.get_mood_distribution')
+async def get_mood_distribution(request):
+    username = request.query.get('username')
+    filename = request.query.get('filename')
+
+    if not username or not filename:
+        return json_response({"error": "Missing username, filename or token"}, 400)
+
+    # Serve the ingest-time result while it matches the dataset
+    materialized = await asyncio.to_thread(
+        lambda: materialized_section(load_materialized(f"data/{filename}"), 'mood', username))
+    if materialized is not None:
+        return json_response(materialized)
+
+    recently_played = await asyncio.to_thread(get_from_file, f"data/{filename}", "recently_played")
+
+    if recently_played is None:
+        return json_response({"error": "Recently played data not found or file missing"}, 404)
+
+    try:
+        result = await mood_distribution_async(recently_played)
+    except Exception as e:
+        return json_response({"error": f"Failed to get audio features: {str(e)}"}, 500)
+
+    return json_response(result)
+
+@single_flight('analysis.get_track_features')
+async def get_track_features(request):
+    ids_param = request.query.get('ids')
+    if not ids_param:
+        return json_response({"error": "No track IDs provided"}, 400)
+
+    try:
+        track_ids = ids_param.split(',')
+        features = await audio_feature_store.get_many_async(track_ids)
+        return json_response({"audio_features": [features.get(track_id) for track_id in track_ids]})
+    except Exception as e:
+        # Spotify's error (e.g. an expired token) is passed on with its status
+        return json_response(*(upstream_error(e) or ({"error": str(e)}, 500)))
+
+def _call_flask(method, path, query_string, headers, body, base_url, remote_addr):
+    environ = EnvironBuilder(path=path, base_url=base_url, method=method, query_string=query_string,
+                             headers=headers, data=body,
+                             environ_overrides={'REMOTE_ADDR': remote_addr or ''}).get_environ()
+    return WSGIResponse.from_app(app, environ, buffered=True)
+
+async def flask_fallback(request):
+    """Serve a request with the Flask app on a worker thread"""
+    body = await request.read()
+    response = await asyncio.get_running_loop().run_in_executor(
+        None, _call_flask, request.method, request.path, request.query_string, list(request.headers.items()),
+        body, f"{request.scheme}://{request.host}", request.remote)
+    headers = CIMultiDict((name, value) for name, value in response.headers.items() if name != 'Content-Length')
+    return web.Response(body=response.get_data(), status=response.status_code, headers=headers)
+
+@web.middleware
+async def cors(request, handler):
+    # flask_cors does this for the routes served by the Flask app
+    response = await handler(request)
+    if 'Access-Control-Allow-Origin' not in response.headers:
+        origin = request.headers.get('Origin')
+        response.headers['Access-Control-Allow-Origin'] = origin or '*'
+        if origin:
+            response.headers.add('Vary', 'Origin')
+    return response
+
+@web.middleware
+async def record_metrics(request, handler):
+    # Requests passed to Flask are recorded by its own hooks (metrics.install)
+    if request.match_info.handler is flask_fallback:
+        return await handler(request)
+    started = time.perf_counter()
+    metrics.IN_FLIGHT.inc()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except asyncio.CancelledError:
+        # The client went away (nginx's 499)
+        status = 499
+        raise
+    finally:
+        metrics.IN_FLIGHT.dec()
+        metrics.observe_request(request.match_info.route.resource.canonical, request.method, status,
+                                time.perf_counter() - started)
+
+def create_app(workers=ASYNC_WORKERS):
+    """Return the aiohttp application, with `workers` threads for blocking work"""
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='async-server')
+
+    async def on_startup(aio_app):
+        # asyncio.to_thread and run_in_executor(None, ...) use this pool
+        asyncio.get_running_loop().set_default_executor(executor)
+
+    async def on_cleanup(aio_app):
+        await async_spotify_client.close()
+        executor.shutdown(wait=False)
+
+    aio_app = web.Application(middlewares=[cors, record_metrics])
+    aio_app.router.add_get('/analysis/mood_distribution', get_mood_distribution)
+    aio_app.router.add_get('/analysis/track_features', get_track_features)
+    # Everything else (including OPTIONS preflights of the routes above) goes to Flask
+    aio_app.router.add_route('*', '/{tail:.*}', flask_fallback)
+    aio_app.on_startup.append(on_startup)
+    aio_app.on_cleanup.append(on_cleanup)
+    # Preload the datasets in data/ in the background; /ready reports when it is done
+    warmup.start()
+    return aio_app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the API on an aiohttp event loop")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=ASYNC_WORKERS,
+                        help="threads for dataset I/O and the routes served by Flask")
+    args = parser.parse_args()
+    web.run_app(create_app(args.workers), host=args.host, port=args.port)
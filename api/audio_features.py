@@ -0,0 +1,238 @@
+"""
+Persistent cache of Spotify audio features keyed by track id.
+
+A track's audio features never change, so they are stored in a SQLite file
+(data/audio_features.sqlite3 by default) with an in-memory LRU in front of it.
+Only ids that are in neither layer (nor in the shared Redis tier, when
+REDIS_URL is set) are requested from Spotify, in batches of 50 (the
+audio-features endpoint limit).
+"""
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+
+from cache import LRUCache
+from metrics import timed
+from shared_cache import shared_cache, MISSING
+from outbound import BatchCoalescer
+from spotify_client import spotify_client, async_spotify_client
+
+BATCH_SIZE = 50
+
+AUDIO_FEATURES_DB = os.getenv('AUDIO_FEATURES_DB', 'data/audio_features.sqlite3')
+# Seconds before a stored entry is fetched again (0 keeps entries forever)
+AUDIO_FEATURES_TTL = int(os.getenv('AUDIO_FEATURES_TTL', 30 * 24 * 3600))
+AUDIO_FEATURES_MEMORY_SIZE = int(os.getenv('AUDIO_FEATURES_MEMORY_SIZE', 5000))
+# Oldest rows beyond this count are evicted from the SQLite store
+AUDIO_FEATURES_MAX_ROWS = int(os.getenv('AUDIO_FEATURES_MAX_ROWS', 200000))
+
+def fetch_audio_features_batch(track_ids):
+    """Request audio features for up to 50 track ids from Spotify, aligned with the input"""
+    data = spotify_client.get('audio-features', params={"ids": ','.join(track_ids)})
+    return data.get('audio_features', [])
+
+async def fetch_audio_features_batch_async(track_ids):
+    """Async fetch_audio_features_batch, for the event loop"""
+    data = await async_spotify_client.get('audio-features', params={"ids": ','.join(track_ids)})
+    return data.get('audio_features', [])
+
+class AudioFeatureStore:
+    """
+    Two-level (memory LRU + SQLite) store of audio features by track id,
+    with the shared Redis tier (shared_cache.py), when enabled, consulted
+    before Spotify.
+
+    Tracks Spotify reports no features for are stored as None, so they are
+    not requested again either.
+    """
+
+    def __init__(self, path=AUDIO_FEATURES_DB, ttl=AUDIO_FEATURES_TTL,
+                 memory_size=AUDIO_FEATURES_MEMORY_SIZE, max_rows=AUDIO_FEATURES_MAX_ROWS,
+                 fetch_batch=fetch_audio_features_batch, fetch_batch_async=fetch_audio_features_batch_async,
+                 shared=shared_cache):
+        self.path = path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.fetch_batch = fetch_batch
+        self.fetch_batch_async = fetch_batch_async
+        self.shared = shared
+        # Concurrent lookups share their outbound batches
+        self.coalescer = BatchCoalescer(self._fetch_and_store, self._fetch_and_store_async, BATCH_SIZE)
+        self.memory = LRUCache(maxsize=memory_size)
+        self._lock = threading.Lock()
+        self._db = None
+        self.db_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.outbound_calls = 0
+        self.fetched_ids = 0
+
+    def _connection(self):
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS audio_features ("
+                "track_id TEXT PRIMARY KEY, features TEXT, fetched_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS audio_features_fetched_at ON audio_features (fetched_at)"
+            )
+        return self._db
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def _fresh(self, fetched_at):
+        return not self.ttl or time.time() - fetched_at < self.ttl
+
+    def _load_from_db(self, track_ids):
+        found = {}
+        with self._lock:
+            db = self._connection()
+            for i in range(0, len(track_ids), 500):
+                chunk = track_ids[i:i+500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = db.execute(
+                    f"SELECT track_id, features, fetched_at FROM audio_features WHERE track_id IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                for track_id, features, fetched_at in rows:
+                    if self._fresh(fetched_at):
+                        found[track_id] = (json.loads(features) if features else None, fetched_at)
+        return found
+
+    def _save(self, entries):
+        with self._lock:
+            db = self._connection()
+            db.executemany(
+                "INSERT OR REPLACE INTO audio_features (track_id, features, fetched_at) VALUES (?, ?, ?)",
+                [(track_id, json.dumps(features) if features else None, fetched_at)
+                 for track_id, (features, fetched_at) in entries.items()]
+            )
+            (count,) = db.execute("SELECT COUNT(*) FROM audio_features").fetchone()
+            if self.max_rows and count > self.max_rows:
+                db.execute(
+                    "DELETE FROM audio_features WHERE track_id IN ("
+                    "SELECT track_id FROM audio_features ORDER BY fetched_at LIMIT ?)",
+                    (count - self.max_rows,)
+                )
+            db.commit()
+
+    def _lookup(self, track_ids):
+        # Returns ({track_id: features} found in memory or SQLite, ids to fetch)
+        result = {}
+        missing = []
+        for track_id in dict.fromkeys(track_ids):
+            entry = self.memory.get(track_id, validate=lambda entry: self._fresh(entry[1]))
+            if entry is not None:
+                result[track_id] = entry[0]
+            else:
+                missing.append(track_id)
+
+        if missing:
+            stored = self._load_from_db(missing)
+            self._count('db_hits', len(stored))
+            for track_id, entry in stored.items():
+                self.memory.set(track_id, entry)
+                result[track_id] = entry[0]
+            missing = [track_id for track_id in missing if track_id not in stored]
+
+        if missing and self.shared.enabled:
+            # Features another worker has fetched; saved locally like fetched ones
+            entries = {}
+            keys = [self._shared_key(track_id) for track_id in missing]
+            for track_id, entry in zip(missing, self.shared.get_many(keys)):
+                if entry is not MISSING and self._fresh(entry[1]):
+                    entries[track_id] = tuple(entry)
+            if entries:
+                self._count('shared_hits', len(entries))
+                self._save(entries)
+                for track_id, entry in entries.items():
+                    self.memory.set(track_id, entry)
+                    result[track_id] = entry[0]
+                missing = [track_id for track_id in missing if track_id not in entries]
+        self._count('misses', len(missing))
+        return result, missing
+
+    def _shared_key(self, track_id):
+        return self.shared.key('audio_features', track_id)
+
+    def _store_batch(self, batch, features_list):
+        # Save one fetched batch in every layer
+        self._count('fetched_ids', len(batch))
+        fetched_at = time.time()
+        entries = {}
+        for track_id, features in zip(batch, features_list):
+            entries[track_id] = (features, fetched_at)
+        self._save(entries)
+        self.shared.set_many({self._shared_key(track_id): entry for track_id, entry in entries.items()}, self.ttl)
+        for track_id, entry in entries.items():
+            self.memory.set(track_id, entry)
+
+    def _fetch_and_store(self, batch):
+        self._count('outbound_calls')
+        features_list = self.fetch_batch(batch)
+        self._store_batch(batch, features_list)
+        return features_list
+
+    async def _fetch_and_store_async(self, batch):
+        self._count('outbound_calls')
+        features_list = await self.fetch_batch_async(batch)
+        await asyncio.to_thread(self._store_batch, batch, features_list)
+        return features_list
+
+    @timed('audio_features')
+    def get_many(self, track_ids):
+        """
+        Return a {track_id: features} dict for the given ids.
+
+        Ids missing from every cache layer are fetched from Spotify in
+        batches of 50, shared with concurrent lookups (see outbound.py);
+        errors from Spotify are raised to the caller.
+        """
+        result, missing = self._lookup(track_ids)
+        result.update(zip(missing, self.coalescer.fetch(missing)))
+        return result
+
+    @timed('audio_features')
+    async def get_many_async(self, track_ids):
+        """
+        Async get_many for the event loop: the cache layers are read and
+        written on worker threads and the missing batches are fetched
+        concurrently with fetch_batch_async.
+        """
+        result, missing = await asyncio.to_thread(self._lookup, track_ids)
+        result.update(zip(missing, await self.coalescer.fetch_async(missing)))
+        return result
+
+    def get_features(self, track_ids):
+        """Return a list of audio features aligned with track_ids (None where unavailable)"""
+        features = self.get_many(track_ids)
+        return [features.get(track_id) for track_id in track_ids]
+
+    def stats(self):
+        """Return hit rates and outbound call counts for the store"""
+        memory = self.memory.stats()
+        with self._lock:
+            db_hits, shared_hits, misses = self.db_hits, self.shared_hits, self.misses
+            outbound_calls, fetched_ids = self.outbound_calls, self.fetched_ids
+        lookups = memory["hits"] + db_hits + shared_hits + misses
+        return {
+            "memory": memory,
+            "db_hits": db_hits,
+            "shared_hits": shared_hits,
+            "misses": misses,
+            "hit_rate": round((memory["hits"] + db_hits + shared_hits) / lookups, 4) if lookups else 0.0,
+            "outbound_calls": outbound_calls,
+            "coalescing": self.coalescer.stats(),
+            "fetched_ids": fetched_ids
+        }
+
+audio_feature_store = AudioFeatureStore()
@@ -0,0 +1,116 @@
+"""
+Batch scoring of every dataset in a directory.
+
+Recomputes the analysis results of each *_spotify.json file (mood,
+popularity, genres, personality and the filtered top artists/tracks, see
+materialize.compute_results) with the same functions the routes use. Files
+are fanned out over a process pool and one JSON line per dataset is streamed
+to the output as soon as it is done:
+
+    python batch_score.py data/ -o scores.ndjson --workers 4
+
+Progress goes to stderr, followed by a per-file timing summary. A dataset
+fails if it cannot be scored ("error") or if sections were left out because
+their audio features could not be fetched ("missing"); the exit status is 1
+if any dataset failed.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils import load_dataset
+from materialize import compute_results
+
+def dataset_files(targets):
+    """Expand directories into their *_spotify.json datasets"""
+    files = []
+    for target in targets:
+        if os.path.isdir(target):
+            files.extend(sorted(glob.glob(os.path.join(target, '*_spotify.json'))))
+        else:
+            files.append(target)
+    return files
+
+def score_file(filename):
+    """Compute the analysis results of one dataset (runs in a worker process)"""
+    started = time.perf_counter()
+    # Diagnostics printed by the analyses must not end up in the NDJSON output
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            steps = load_dataset(filename)
+            if steps is None:
+                record = {"filename": filename, "error": "Data not found"}
+            else:
+                username = (steps.get('current_user') or {}).get('id')
+                results = compute_results(steps, username)
+                record = {"filename": filename, "username": username, "results": results}
+                if "missing" in results:
+                    record["missing"] = results.pop("missing")
+        except Exception as e:
+            record = {"filename": filename, "error": str(e)}
+    record["seconds"] = round(time.perf_counter() - started, 4)
+    return record
+
+def failed(record):
+    """True if a dataset could not be scored or has sections missing"""
+    return "error" in record or "missing" in record
+
+def record_status(record):
+    """"ok", or the error or missing sections of a record"""
+    if "error" in record:
+        return f"error: {record['error']}"
+    if "missing" in record:
+        return f"missing: {', '.join(record['missing'])}"
+    return "ok"
+
+def print_summary(records, wall_seconds, out=sys.stderr):
+    """Print per-file timings (slowest first) and totals"""
+    busy_seconds = sum(record["seconds"] for record in records)
+    failures = [record for record in records if failed(record)]
+    print("\nPer-file timings:", file=out)
+    for record in sorted(records, key=lambda record: record["seconds"], reverse=True):
+        status = record_status(record)
+        print(f"  {record['seconds']:8.3f}s  {record['filename']}  {status}", file=out)
+    print(f"{len(records)} files, {len(failures)} failed, {wall_seconds:.2f}s wall, "
+          f"{busy_seconds:.2f}s in workers ({busy_seconds / wall_seconds if wall_seconds else 0:.1f}x parallel)",
+          file=out)
+
+def run(files, output, workers=None):
+    """Score files over a process pool, writing one JSON line per file to output"""
+    started = time.perf_counter()
+    records = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(score_file, filename): filename for filename in files}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                record = future.result()
+            except Exception as e:
+                # The worker process itself died
+                record = {"filename": futures[future], "error": str(e), "seconds": 0.0}
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            records.append(record)
+            print(f"[{done}/{len(files)}] {record['filename']}: {record_status(record)} in {record['seconds']:.2f}s",
+                  file=sys.stderr)
+    print_summary(records, time.perf_counter() - started)
+    return records
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute analysis results for every dataset")
+    parser.add_argument('targets', nargs='*', default=['data'], help="dataset files or directories (default: data)")
+    parser.add_argument('-o', '--output', default='-', help="NDJSON output file (default: stdout)")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    files = dataset_files(args.targets)
+    if args.output == '-':
+        records = run(files, sys.stdout, args.workers)
+    else:
+        with open(args.output, 'w') as output:
+            records = run(files, output, args.workers)
+    sys.exit(1 if any(failed(record) for record in records) else 0)
@@ -0,0 +1,11 @@
+"""
+Micro-benchmarks for the analysis hot paths.
+
+Run from the api/ directory:
+
+    python -m benchmarks.run                                # sample data plus 10x and 100x copies
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json
+
+See benchmarks/run.py for the options.
+"""
@@ -0,0 +1,68 @@
+"""
+Datasets for the benchmarks: the sample files in data/ and synthetic copies
+of them with every item list scaled up, plus deterministic audio features.
+"""
+import os
+import glob
+import random
+import hashlib
+import tempfile
+
+from utils import load_dataset
+from dataset_store import StepWriter
+
+SAMPLE_DIRECTORY = 'data'
+DEFAULT_SCALED_DIRECTORY = os.path.join(tempfile.gettempdir(), 'spotify-wrap-benchmarks')
+
+def sample_datasets(directory=SAMPLE_DIRECTORY):
+    """Return the sample *_spotify.json datasets"""
+    return sorted(glob.glob(os.path.join(directory, '*_spotify.json')))
+
+def _scaled_items(items, factor):
+    # Repeat the items, giving each copy its own track/artist ids
+    scaled = []
+    for copy in range(factor):
+        for item in items:
+            if copy == 0:
+                scaled.append(item)
+            elif isinstance(item.get('track'), dict):
+                track = item['track']
+                scaled.append(dict(item, track=dict(track, id=f"{track.get('id')}-{copy}")))
+            else:
+                scaled.append(dict(item, id=f"{item.get('id')}-{copy}"))
+    return scaled
+
+def scaled_dataset(filename, factor, directory=DEFAULT_SCALED_DIRECTORY):
+    """
+    Write (once) a copy of a dataset with every item list `factor` times
+    longer and return its path. The copy is written with StepWriter, so it
+    has a sidecar index like freshly ingested datasets do.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"x{factor}_{os.path.basename(filename)}")
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(filename):
+        return path
+    with StepWriter(path) as writer:
+        for step, data in load_dataset(filename).items():
+            if isinstance(data, dict) and isinstance(data.get('items'), list):
+                data = dict(data, items=_scaled_items(data['items'], factor))
+            writer.append(step, data)
+    return path
+
+def synthetic_features(track_id):
+    """Deterministic, realistic-looking audio features for a track id"""
+    rng = random.Random(int(hashlib.md5(track_id.encode()).hexdigest(), 16))
+    return {
+        'id': track_id,
+        'valence': rng.random(),
+        'energy': rng.random(),
+        'acousticness': rng.random(),
+        'danceability': rng.random(),
+        'tempo': rng.uniform(60, 180),
+        'instrumentalness': rng.random() ** 3,
+        'mode': rng.randint(0, 1),
+        'loudness': rng.uniform(-20, -2),
+        'speechiness': rng.random() * 0.5,
+        'duration_ms': rng.randint(120000, 400000),
+        'time_signature': rng.choice([3, 4, 4, 5])
+    }
@@ -0,0 +1,154 @@
+"""
+Load test of the async serving mode (async_server.py) against the Flask app
+on a threaded WSGI server with the same number of worker threads.
+
+A mock Spotify API (mock_spotify.py) answers audio-features requests after
+--latency. Each server is started in a subprocess pointed at the mock, with
+an empty audio feature store, and --concurrency clients then request
+/analysis/track_features with random track ids for --duration seconds, so
+every request waits on Spotify. Throughput and latency percentiles are
+printed per server.
+
+    python -m benchmarks.loadtest --workers 4 --concurrency 64 --latency fixed:200
+"""
+import os
+import sys
+import time
+import random
+import string
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+from mock_spotify import MockSpotify, start_in_thread
+from benchmarks.datasets import sample_datasets
+from benchmarks.run import _percentile
+
+API_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def serve_wsgi(port, workers):
+    """Serve the Flask app with at most `workers` requests handled at a time (like gunicorn --threads)"""
+    from werkzeug.serving import BaseWSGIServer
+    from main import app
+
+    class BoundedWSGIServer(BaseWSGIServer):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(max_workers=workers)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    BoundedWSGIServer('127.0.0.1', port, app).serve_forever()
+
+def _start_server(kind, port, workers, env):
+    if kind == 'async':
+        command = [sys.executable, 'async_server.py', '--port', str(port), '--workers', str(workers)]
+    else:
+        command = [sys.executable, '-m', 'benchmarks.loadtest', '--serve-wsgi', str(port), '--workers', str(workers)]
+    process = subprocess.Popen(command, cwd=API_DIRECTORY, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+def _random_ids(count, rng):
+    return ','.join(''.join(rng.choices(string.ascii_letters + string.digits, k=22)) for _ in range(count))
+
+async def _load(url, concurrency, duration, ids_per_request):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client(session, rng):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                async with session.get(url, params={"ids": _random_ids(ids_per_request, rng)}) as response:
+                    await response.read()
+                    ok = response.status == 200
+            except aiohttp.ClientError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    timeout = aiohttp.ClientTimeout(total=None)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency), timeout=timeout) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session, random.Random(i)) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": _percentile(latencies, 0.5) * 1000 if latencies else 0.0,
+        "p95_ms": _percentile(latencies, 0.95) * 1000 if latencies else 0.0
+    }
+
+def run(args):
+    mock = MockSpotify(sample_datasets()[0], latency=[f"audio-features={args.latency}"], seed=0)
+    mock_server, base_url = start_in_thread(mock)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for offset, kind in enumerate(['wsgi', 'async']):
+            env = dict(os.environ, SPOTIFY_API_BASE=base_url, token='mock',
+                       AUDIO_FEATURES_DB=os.path.join(directory, f"{kind}.sqlite3"),
+                       # Let the outbound pool hold every in-flight request
+                       SPOTIFY_POOL_SIZE=str(args.concurrency),
+                       # The mock does not throttle; measure the serving mode, not the rate limit
+                       SPOTIFY_RATE_LIMIT='0')
+            port = args.port + offset
+            process = _start_server(kind, port, args.workers, env)
+            try:
+                results[kind] = asyncio.run(_load(f"http://127.0.0.1:{port}/analysis/track_features",
+                                                  args.concurrency, args.duration, args.ids))
+            finally:
+                process.terminate()
+                process.wait()
+    mock_server.shutdown()
+
+    print(f"workers={args.workers} concurrency={args.concurrency} audio-features latency={args.latency} "
+          f"duration={args.duration}s")
+    print(f"{'server':<8}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for kind, result in results.items():
+        print(f"{kind:<8}{result['requests']:>10}{result['errors']:>8}{result['rps']:>10.1f}"
+              f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the async and threaded WSGI serving modes")
+    parser.add_argument('--workers', type=int, default=4, help="worker threads of each server")
+    parser.add_argument('--concurrency', type=int, default=64, help="concurrent clients")
+    parser.add_argument('--duration', type=float, default=10, help="seconds of load per server")
+    parser.add_argument('--latency', default='fixed:200', help="audio-features latency of the mock (mock_spotify.py)")
+    parser.add_argument('--ids', type=int, default=5, help="track ids per request")
+    parser.add_argument('--port', type=int, default=5100, help="port of the first server (the second uses port+1)")
+    parser.add_argument('--serve-wsgi', type=int, default=None, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve_wsgi is not None:
+        serve_wsgi(args.serve_wsgi, args.workers)
+    else:
+        run(args)
@@ -0,0 +1,245 @@
+"""
+Benchmark runner.
+
+Every benchmark is run against each sample dataset and its scaled copies:
+after one warm-up call it is repeated for --duration seconds (at least
+--min-runs times), and then run once more under tracemalloc for its peak
+memory. Results are printed as a table of ops/sec, latency percentiles and
+peak memory; --save-baseline stores them and --baseline compares a run
+against stored results, exiting with status 1 when a benchmark's median
+latency grew by more than the --threshold allows (the median is much less
+noisy than the mean, which single GC pauses can move).
+
+Audio features come from a local store filled with synthetic features, so
+no Spotify calls are made.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+
+import numpy as np
+
+import analytics
+from utils import (
+    get_from_file, load_dataset, dataset_cache, classify_mood, classify_moods, mood_feature_array,
+    predict_personality, predict_personality_batch
+)
+from analytics import (
+    TIME_RANGES, time_range_step, personality_inputs,
+    filter_recently_played, filter_top_artists, filter_top_tracks, filter_saved_tracks
+)
+from audio_features import AudioFeatureStore
+import models
+from benchmarks.datasets import sample_datasets, scaled_dataset, synthetic_features, DEFAULT_SCALED_DIRECTORY
+
+BASELINE_FORMAT = 1
+
+def _percentile(sorted_values, fraction):
+    # Nearest-rank percentile
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def measure(fn, duration, min_runs, setup=None):
+    """Time fn repeatedly and return its ops/sec, latency percentiles (us) and peak memory (KiB)"""
+    if setup:
+        setup()
+    fn()
+    timings = []
+    deadline = time.perf_counter() + duration
+    while len(timings) < min_runs or time.perf_counter() < deadline:
+        if setup:
+            setup()
+        started = time.perf_counter_ns()
+        fn()
+        timings.append(time.perf_counter_ns() - started)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    total = sum(timings)
+    return {
+        "runs": len(timings),
+        "ops_per_sec": round(len(timings) / (total / 1e9), 2) if total else 0.0,
+        "mean_us": round(total / len(timings) / 1e3, 2),
+        "p50_us": round(_percentile(timings, 0.50) / 1e3, 2),
+        "p95_us": round(_percentile(timings, 0.95) / 1e3, 2),
+        "p99_us": round(_percentile(timings, 0.99) / 1e3, 2),
+        "peak_kib": round(peak / 1024, 1)
+    }
+
+def dataset_benchmarks(filename):
+    """Return the (name, fn, setup) benchmarks for one dataset file"""
+    steps = load_dataset(filename)
+    recently_played = steps.get('recently_played') or {'items': []}
+    # The sample datasets have no saved tracks; recently played items have the same shape
+    saved_tracks = steps.get('saved_tracks') or recently_played
+    top_artists = steps.get(time_range_step('artists', 'medium_term')) or {'items': []}
+    top_tracks = steps.get(time_range_step('tracks', 'medium_term')) or {'items': []}
+
+    features = [synthetic_features(item['track']['id']) for item in recently_played.get('items', [])
+                if item.get('track', {}).get('id')]
+    personality_requests = [
+        personality_inputs(steps.get(time_range_step('artists', time_range)) or {'items': []},
+                           steps.get(time_range_step('tracks', time_range)))
+        for time_range in TIME_RANGES
+    ]
+    medium_term = personality_requests[1]
+
+    model = models.decode_steps(steps)
+    model_top_tracks = model.get(time_range_step('tracks', 'medium_term'))
+    model_top_artists = model.get(time_range_step('artists', 'medium_term'))
+
+    def clear_dataset_cache():
+        dataset_cache.clear()
+
+    def clear_model_cache():
+        models.model_cache.clear()
+
+    return [
+        ("get_from_file[cold]", lambda: get_from_file(filename, 'top_tracks_long'), clear_dataset_cache),
+        ("get_from_file[warm]", lambda: get_from_file(filename, 'top_tracks_long'), None),
+        (f"classify_mood x{len(features)}", lambda: [classify_mood(f) for f in features], None),
+        (f"classify_moods x{len(features)}", lambda: classify_moods(mood_feature_array(features)), None),
+        ("predict_personality", lambda: predict_personality(*medium_term), None),
+        ("predict_personality_batch x3", lambda: predict_personality_batch(personality_requests), None),
+        (f"filter_recently_played x{len(recently_played.get('items', []))}",
+         lambda: filter_recently_played(recently_played, 50), None),
+        (f"filter_top_artists x{len(top_artists.get('items', []))}",
+         lambda: filter_top_artists(top_artists, 50), None),
+        (f"filter_top_tracks x{len(top_tracks.get('items', []))}",
+         lambda: filter_top_tracks(top_tracks, 50), None),
+        (f"filter_saved_tracks x{len(saved_tracks.get('items', []))}",
+         lambda: filter_saved_tracks(saved_tracks, 50), None),
+        ("load_model[cold]", lambda: models.load_model(filename), clear_model_cache),
+        ("project_tracks[model]", lambda: models.project_tracks(model_top_tracks, 50, models.DEFAULT_TRACK_FIELDS), None),
+        ("project_artists[model]",
+         lambda: models.project_artists(model_top_artists, 50, models.DEFAULT_ARTIST_FIELDS), None)
+    ]
+
+def run_benchmarks(scales, duration, min_runs, name_filter=None, scaled_directory=DEFAULT_SCALED_DIRECTORY):
+    """Run every benchmark on every dataset and scale; returns {name: result}"""
+    # Serve audio features from a local store filled with synthetic features
+    os.makedirs(scaled_directory, exist_ok=True)
+    analytics.audio_feature_store = AudioFeatureStore(
+        path=os.path.join(scaled_directory, 'audio_features.sqlite3'),
+        fetch_batch=lambda track_ids: [synthetic_features(track_id) for track_id in track_ids]
+    )
+    results = {}
+    for sample in sample_datasets():
+        label = os.path.basename(sample).split('_')[0][:8]
+        for scale in scales:
+            filename = sample if scale == 1 else scaled_dataset(sample, scale, scaled_directory)
+            for name, fn, setup in dataset_benchmarks(filename):
+                full_name = f"{scale}x/{label}/{name}"
+                if name_filter and name_filter not in full_name:
+                    continue
+                results[full_name] = measure(fn, duration, min_runs, setup)
+                print_result(full_name, results[full_name])
+            dataset_cache.clear()
+    return results
+
+def print_result(name, result, baseline=None, threshold=None):
+    """Print one result row, with the change against the baseline when there is one"""
+    row = (f"{name:<58} {result['ops_per_sec']:>12,.1f} {result['p50_us']:>11,.1f} "
+           f"{result['p95_us']:>11,.1f} {result['p99_us']:>11,.1f} {result['peak_kib']:>11,.1f}")
+    if baseline is not None:
+        change = result['p50_us'] / baseline['p50_us'] - 1 if baseline['p50_us'] else 0.0
+        row += f" {change:>+11.1%}"
+        if change > threshold:
+            row += "  REGRESSION"
+    print(row)
+
+def print_header(with_baseline=False):
+    header = f"{'benchmark':<58} {'ops/sec':>12} {'p50 us':>11} {'p95 us':>11} {'p99 us':>11} {'peak KiB':>11}"
+    print(header + (f" {'p50 vs base':>11}" if with_baseline else ""))
+
+def compare(results, baseline, threshold):
+    """Print results against a baseline; returns the names of regressed benchmarks"""
+    print(f"\nCompared with baseline (regression: median latency up by more than {threshold:.0%}):")
+    print_header(with_baseline=True)
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print_result(name, result)
+            continue
+        print_result(name, result, baseline[name], threshold)
+        if baseline[name]['p50_us'] and result['p50_us'] > baseline[name]['p50_us'] * (1 + threshold):
+            regressions.append(name)
+    return regressions
+
+def load_baseline(path):
+    """Return the baseline document stored at path"""
+    with open(path, 'r') as f:
+        document = json.load(f)
+    if document.get('format') != BASELINE_FORMAT:
+        raise ValueError(f"{path} is not a benchmark baseline")
+    return document
+
+def _cpu_model():
+    # platform.processor() is empty on most Linux builds
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+def describe(document):
+    """One line naming where and on what a baseline was recorded"""
+    return (f"recorded {document.get('created')} on {document.get('cpu', document.get('machine'))} "
+            f"({document.get('cpus', '?')} CPUs, {document.get('platform', document.get('machine'))}), "
+            f"Python {document.get('python')}, NumPy {document.get('numpy', '?')}")
+
+def save_baseline(path, results):
+    document = {
+        "format": BASELINE_FORMAT,
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "cpu": _cpu_model(),
+        "cpus": os.cpu_count(),
+        "results": results
+    }
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the analysis hot paths")
+    parser.add_argument('--scales', default='1,10,100',
+                        help="comma-separated dataset scale factors (default: 1,10,100)")
+    parser.add_argument('--duration', type=float, default=0.5, help="seconds to run each benchmark (default: 0.5)")
+    parser.add_argument('--min-runs', type=int, default=5, help="minimum runs per benchmark (default: 5)")
+    parser.add_argument('--filter', default=None, help="only run benchmarks whose name contains this")
+    parser.add_argument('--data-dir', default=DEFAULT_SCALED_DIRECTORY, help="where scaled datasets are kept")
+    parser.add_argument('--baseline', default=None, help="baseline file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="median latency increase that counts as a regression (default: 0.2)")
+    parser.add_argument('--save-baseline', default=None, help="write the results to this baseline file")
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(',')]
+    print_header()
+    results = run_benchmarks(scales, args.duration, args.min_runs, args.filter, args.data_dir)
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+        print(f"\nBaseline written to {args.save_baseline}")
+    if args.baseline:
+        baseline = load_baseline(args.baseline)
+        print(f"\nBaseline {args.baseline}: {describe(baseline)}")
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s)")
+            sys.exit(1)
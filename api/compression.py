@@ -0,0 +1,35 @@
+"""
+gzip response encoding for blueprint routes, negotiated via Accept-Encoding.
+
+The encoding is chosen in a before_request hook and kept in g.content_encoding,
+so conditional.py can give the gzip and identity representations different
+ETags; install compression on a blueprint before conditional GET.
+"""
+import os
+import gzip
+from flask import g, request
+
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 6))
+# Bodies smaller than this are sent uncompressed
+GZIP_MIN_SIZE = int(os.getenv('GZIP_MIN_SIZE', 500))
+
+def _negotiate():
+    g.content_encoding = 'gzip' if request.accept_encodings['gzip'] else None
+
+def _compress(response):
+    response.vary.add('Accept-Encoding')
+    if (g.get('content_encoding') != 'gzip' or response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or not response.is_json):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+    # mtime=0 keeps the output byte-identical for identical bodies
+    response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def install(blueprint):
+    """gzip the JSON responses of every route of a blueprint for clients that accept it"""
+    blueprint.before_request(_negotiate)
+    blueprint.after_request(_compress)
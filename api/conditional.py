@@ -0,0 +1,89 @@
+"""
+Conditional GET (ETag / If-None-Match) for the blueprint routes.
+
+Every /user and /analysis response is a function of the route, its query
+parameters and the dataset file, so a strong ETag can be derived from those
+alone: the dataset's (mtime_ns, size) version costs one stat call. A request
+whose If-None-Match matches is answered with 304 by a before_request hook,
+before the view runs, so the dataset is never read or parsed. Successful
+responses are tagged with the ETag and a Cache-Control header, except those
+a view marked uncacheable(): their body also depends on audio features that
+Spotify failed to return, which a later request may get.
+"""
+import os
+import hashlib
+import threading
+from flask import Response, g, request
+
+from dataset_store import file_version
+
+# Seconds clients may reuse a response without revalidating (0: always revalidate)
+HTTP_CACHE_MAX_AGE = int(os.getenv('HTTP_CACHE_MAX_AGE', 0))
+# Part of every ETag; change it when a deploy alters responses for unchanged datasets
+ETAG_SALT = os.getenv('ETAG_SALT', '1')
+
+_lock = threading.Lock()
+_stats = {"not_modified": 0, "tagged": 0}
+
+def cache_control():
+    if HTTP_CACHE_MAX_AGE > 0:
+        return f"private, max-age={HTTP_CACHE_MAX_AGE}"
+    return "private, no-cache"
+
+def dataset_etag(endpoint, query_items, encoding=None):
+    """
+    Return the ETag for a route (its endpoint name), its (name, value) query
+    parameters and the response encoding, or None if the query names no
+    existing dataset.
+    """
+    filename = dict(query_items).get('filename')
+    if not filename:
+        return None
+    version = file_version(f"data/{filename}")
+    if version is None:
+        return None
+    key = repr((ETAG_SALT, endpoint, sorted(query_items), version, encoding))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+def request_etag():
+    """Return the ETag of the current Flask request, or None if it has no dataset"""
+    # content_encoding is set by compression.py; gzip and identity bodies are different representations
+    return dataset_etag(request.endpoint, list(request.args.items(multi=True)), g.get('content_encoding'))
+
+def count(name):
+    with _lock:
+        _stats[name] += 1
+
+def uncacheable(response):
+    """Send a response without an ETag and with Cache-Control: no-store"""
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def _check_not_modified():
+    g.etag = request_etag() if request.method == 'GET' else None
+    if g.etag is not None and request.if_none_match.contains_weak(g.etag):
+        count("not_modified")
+        response = Response(status=304)
+        response.set_etag(g.etag)
+        response.headers['Cache-Control'] = cache_control()
+        return response
+
+def _tag_response(response):
+    etag = g.get('etag')
+    # Responses marked uncacheable() keep no-store and get no ETag
+    if (etag is not None and response.status_code == 200
+            and 'no-store' not in response.headers.get('Cache-Control', '')):
+        count("tagged")
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control()
+    return response
+
+def install(blueprint):
+    """Add conditional GET handling to every route of a blueprint"""
+    blueprint.before_request(_check_not_modified)
+    blueprint.after_request(_tag_response)
+
+def stats():
+    """Return the number of 304s served and of responses tagged with an ETag"""
+    with _lock:
+        return dict(_stats)
@@ -5,143 +5,235 @@ from datetime import datetime, timedelta
 from collections import deque
 from spotipy.oauth2 import SpotifyOAuth
 import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
+import dataset_store
+from dataset_store import StepWriter
+from spotify_client import SPOTIFY_API_BASE
+from history import RECENTLY_PLAYED_HISTORY, fetch_recently_played
 
 load_dotenv()
 client_id = os.getenv('SPOTIPY_CLIENT_ID')
 client_secret = os.getenv('SPOTIPY_CLIENT_SECRET')
 redirect_uri = os.getenv('SPOTIPY_REDIRECT_URI')
+# A fixed access token skips the OAuth flow (e.g. against the local mock API)
+access_token = os.getenv('SPOTIFY_ACCESS_TOKEN')
 
-def fetch_spotify_data_sequence():
+# Steps fetched after current_user, in the order they are written to the dataset
+DATA_STEPS = [
+    # Recently played tracks (latest 50)
+    ("recently_played", lambda sp: sp.current_user_recently_played(limit=50, before=int(time.time() * 1000))),
+    ("top_artists_short", lambda sp: sp.current_user_top_artists(limit=50, offset=0, time_range='short_term')),
+    ("top_artists_medium", lambda sp: sp.current_user_top_artists(limit=50, offset=0, time_range='medium_term')),
+    ("top_artists_long", lambda sp: sp.current_user_top_artists(limit=50, offset=0, time_range='long_term')),
+    ("top_tracks_short", lambda sp: sp.current_user_top_tracks(limit=50, offset=0, time_range='short_term')),
+    ("top_tracks_medium", lambda sp: sp.current_user_top_tracks(limit=50, offset=0, time_range='medium_term')),
+    ("top_tracks_long", lambda sp: sp.current_user_top_tracks(limit=50, offset=0, time_range='long_term')),
+    ("saved_tracks", lambda sp: sp.current_user_saved_tracks(limit=50, offset=0, market=None)),
+]
+
+# Seconds a fetched step stays fresh; override with STEP_TTL_<STEP>, e.g. STEP_TTL_TOP_TRACKS_LONG=86400
+DEFAULT_STEP_TTLS = {
+    "recently_played": 5 * 60,
+    "top_artists_short": 6 * 3600,
+    "top_artists_medium": 24 * 3600,
+    "top_artists_long": 7 * 24 * 3600,
+    "top_tracks_short": 6 * 3600,
+    "top_tracks_medium": 24 * 3600,
+    "top_tracks_long": 7 * 24 * 3600,
+    "saved_tracks": 3600,
+}
+
+def step_ttl(step):
+    """Return how many seconds a fetched step stays fresh"""
+    return float(os.getenv(f"STEP_TTL_{step.upper()}", DEFAULT_STEP_TTLS[step]))
+
+def stale_steps(meta, now, force=False):
+    """Return the DATA_STEPS that have to be fetched again, given the stored step metadata"""
+    return [step for step, _ in DATA_STEPS
+            if force or step not in meta or now - meta[step].get('fetched_at', 0) >= step_ttl(step)]
+
+def _previous_entries(filename):
+    """Return the serialized entries and metadata of the current dataset, if it has an up-to-date index"""
+    version = dataset_store.file_version(filename)
+    index = dataset_store.load_index(filename, version) if version is not None else None
+    if index is None:
+        return {}, {}
+    meta = dataset_store.load_metadata(filename, version)
+    try:
+        raw = {step: dataset_store.read_raw(filename, *span) for step, span in index.items()}
+    except OSError:
+        return {}, {}
+    return raw, {step: meta[step] for step in raw if step in meta}
+
+def _run_step(fetch, sp, started, step):
+    """Run one fetch in a worker thread and return (data, wall time in seconds)"""
+    started[step] = time.monotonic()
+    data = fetch(sp)
+    return data, time.monotonic() - started[step]
+
+def fetch_spotify_data_sequence(concurrency=None, step_timeout=None, force=False):
     """
     Authenticate and fetch a sequence of Spotify API data.
     For a new user, create {username}_spotify.json and append each API result as soon as it is fetched.
     Each entry in the JSON file is a dict: {"step": ..., "data": ...}
+
+    current_user is fetched first, since it names the dataset. Of the other
+    steps only the stale ones are fetched again: every step's fetch time is
+    kept in the dataset's index and it stays fresh for step_ttl(step)
+    seconds. Fresh steps, and stale ones whose refresh fails, are copied from
+    the previous dataset. When every step's content hash is unchanged the
+    dataset is not rewritten at all (only its fetch times are updated), so
+    its version, and with it ETags and materialized results, stay valid.
+    `force` fetches every step.
+
+    The fetched steps are independent, so they run on a thread pool of
+    `concurrency` workers (SPOTIFY_INGEST_CONCURRENCY, default: all steps at
+    once). A step that has been running for longer than `step_timeout`
+    seconds (SPOTIFY_STEP_TIMEOUT, default: 15) is reported as failed and its
+    result discarded. Set the concurrency to 1 for one-after-another fetching.
+
+    Steps are streamed through a StepWriter as they complete, so each result is
+    serialized once and the finished file (plus its step index) replaces the
+    old one with a single rename. The wall time of every fetched step is
+    returned in "step_timings", along with the "refreshed" and "kept" steps
+    and whether the dataset was "rewritten".
+
+    With RECENTLY_PLAYED_HISTORY on (the default), recently_played only asks
+    for plays newer than the user's stored history and holds the whole
+    accumulated history (see history.py).
     """
-    sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
-        scope="user-read-recently-played user-top-read user-read-private user-library-read",
-        client_id=client_id,
-        client_secret=client_secret,
-        redirect_uri=redirect_uri
-    ))
+    if concurrency is None:
+        concurrency = int(os.getenv('SPOTIFY_INGEST_CONCURRENCY', len(DATA_STEPS) + 1))
+    if step_timeout is None:
+        step_timeout = float(os.getenv('SPOTIFY_STEP_TIMEOUT', 15))
+    if access_token:
+        sp = spotipy.Spotify(auth=access_token, requests_timeout=step_timeout)
+    else:
+        sp = spotipy.Spotify(auth_manager=SpotifyOAuth(
+            scope="user-read-recently-played user-top-read user-read-private user-library-read",
+            client_id=client_id,
+            client_secret=client_secret,
+            redirect_uri=redirect_uri
+        ), requests_timeout=step_timeout)
+    sp.prefix = SPOTIFY_API_BASE.rstrip('/') + '/'
     username = None
     json_filename = None
+    step_timings = {}
+    refreshed = []
+    kept = []
+    rewritten = False
+    writer = None
+    previous_raw, previous_meta = {}, {}
+    executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
     try:
-        # 1. Get current user profile
-        user_data = None
-        try:
-            user_data = sp.current_user()
-            username = user_data.get('id', 'unknown_user')
-            json_filename = f"{username}_spotify.json"
-            with open(f"data/{json_filename}", 'w') as f:
-                json.dump([], f)  # Start with empty list
-            with open(f"data/{json_filename}", 'r+') as f:
-                data = json.load(f)
-                data.append({"step": "current_user", "data": user_data})
-                f.seek(0)
-                json.dump(data, f, indent=2)
-                f.truncate()
-            print("current_user: success")
-        except Exception as e:
-            print("current_user: fail", str(e))
-        # 2. Get recently played tracks (latest 50)
-        try:
-            now_ms = int(time.time() * 1000)
-            recently_played = sp.current_user_recently_played(limit=50, before=now_ms)
-            with open(f"data/{json_filename}", 'r+') as f:
-                data = json.load(f)
-                data.append({"step": "recently_played", "data": recently_played})
-                f.seek(0)
-                json.dump(data, f, indent=2)
-                f.truncate()
-            print("recently_played: success")
-        except Exception as e:
-            print("recently_played: fail", str(e))
-        # 3. Top artists short term
-        try:
-            top_artists_short = sp.current_user_top_artists(limit=50, offset=0, time_range='short_term')
-            with open(f"data/{json_filename}", 'r+') as f:
-                data = json.load(f)
-                data.append({"step": "top_artists_short", "data": top_artists_short})
-                f.seek(0)
-                json.dump(data, f, indent=2)
-                f.truncate()
-            print("top_artists_short: success")
-        except Exception as e:
-            print("top_artists_short: fail", str(e))
-        # 4. Top artists medium term
-        try:
-            top_artists_medium = sp.current_user_top_artists(limit=50, offset=0, time_range='medium_term')
-            with open(f"data/{json_filename}", 'r+') as f:
-                data = json.load(f)
-                data.append({"step": "top_artists_medium", "data": top_artists_medium})
-                f.seek(0)
-                json.dump(data, f, indent=2)
-                f.truncate()
-            print("top_artists_medium: success")
-        except Exception as e:
-            print("top_artists_medium: fail", str(e))
-        # 5. Top artists long term
-        try:
-            top_artists_long = sp.current_user_top_artists(limit=50, offset=0, time_range='long_term')
-            with open(f"data/{json_filename}", 'r+') as f:
-                data = json.load(f)
-                data.append({"step": "top_artists_long", "data": top_artists_long})
-                f.seek(0)
-                json.dump(data, f, indent=2)
-                f.truncate()
-            print("top_artists_long: success")
-        except Exception as e:
-            print("top_artists_long: fail", str(e))
-        # 6. Top tracks short term
-        try:
-            top_tracks_short = sp.current_user_top_tracks(limit=50, offset=0, time_range='short_term')
-            with open(f"data/{json_filename}", 'r+') as f:
-                data = json.load(f)
-                data.append({"step": "top_tracks_short", "data": top_tracks_short})
-                f.seek(0)
-                json.dump(data, f, indent=2)
-                f.truncate()
-            print("top_tracks_short: success")
-        except Exception as e:
-            print("top_tracks_short: fail", str(e))
-        # 7. Top tracks medium term
-        try:
-            top_tracks_medium = sp.current_user_top_tracks(limit=50, offset=0, time_range='medium_term')
-            with open(f"data/{json_filename}", 'r+') as f:
-                data = json.load(f)
-                data.append({"step": "top_tracks_medium", "data": top_tracks_medium})
-                f.seek(0)
-                json.dump(data, f, indent=2)
-                f.truncate()
-            print("top_tracks_medium: success")
-        except Exception as e:
-            print("top_tracks_medium: fail", str(e))
-        # 8. Top tracks long term
-        try:
-            top_tracks_long = sp.current_user_top_tracks(limit=50, offset=0, time_range='long_term')
-            with open(f"data/{json_filename}", 'r+') as f:
-                data = json.load(f)
-                data.append({"step": "top_tracks_long", "data": top_tracks_long})
-                f.seek(0)
-                json.dump(data, f, indent=2)
-                f.truncate()
-            print("top_tracks_long: success")
-        except Exception as e:
-            print("top_tracks_long: fail", str(e))
-        # 9. Saved tracks
-        try:
-            saved_tracks = sp.current_user_saved_tracks(limit=50, offset=0, market=None)
-            with open(f"data/{json_filename}", 'r+') as f:
-                data = json.load(f)
-                data.append({"step": "saved_tracks", "data": saved_tracks})
-                f.seek(0)
-                json.dump(data, f, indent=2)
-                f.truncate()
-            print("saved_tracks: success")
-        except Exception as e:
-            print("saved_tracks: fail", str(e))
+        # Authenticate once up front so the workers share a cached token
+        if sp.auth_manager is not None:
+            sp.auth_manager.get_access_token(as_dict=False)
+
+        started = {}
+        pending = {executor.submit(_run_step, lambda sp: sp.current_user(), sp, started, "current_user"): "current_user"}
+        completed = []
+        while pending:
+            # Wake up for the next completion or the earliest per-step deadline
+            now = time.monotonic()
+            running = [started[step] for step in pending.values() if step in started]
+            timeout = max(0, min(running) + step_timeout - now) if running else step_timeout
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                step = pending.pop(future)
+                try:
+                    data, elapsed = future.result()
+                    step_timings[step] = round(elapsed, 3)
+                    completed.append((step, data))
+                except Exception as e:
+                    step_timings[step] = round(time.monotonic() - started.get(step, now), 3)
+                    print(f"{step}: fail", str(e))
+            now = time.monotonic()
+            for future, step in list(pending.items()):
+                if step in started and now - started[step] >= step_timeout:
+                    del pending[future]
+                    step_timings[step] = round(now - started[step], 3)
+                    print(f"{step}: fail", f"timed out after {step_timeout}s")
+
+            # The file name comes from current_user, so nothing is written before it
+            if writer is None:
+                user_data = next((data for step, data in completed if step == "current_user"), None)
+                if user_data is None:
+                    if "current_user" not in pending.values():
+                        break
+                    continue
+                username = user_data.get('id', 'unknown_user')
+                json_filename = f"{username}_spotify.json"
+                # Steps completed by a login that was killed before committing them
+                recovered = dataset_store.recover_partial(f"data/{json_filename}")
+                if recovered:
+                    print(f"Recovered steps from an interrupted login: {', '.join(recovered)}")
+                previous_raw, previous_meta = _previous_entries(f"data/{json_filename}")
+                writer = StepWriter(f"data/{json_filename}")
+                fetches = dict(DATA_STEPS)
+                if RECENTLY_PLAYED_HISTORY:
+                    fetches["recently_played"] = lambda sp, username=username: fetch_recently_played(sp, username)
+                stale = stale_steps(previous_meta, time.time(), force)
+                for step in stale:
+                    pending[executor.submit(_run_step, fetches[step], sp, started, step)] = step
+                # Fresh steps are served from the previous dataset as they are
+                for step, _ in DATA_STEPS:
+                    if step not in stale and step in previous_raw:
+                        writer.append_raw(step, previous_raw[step], previous_meta[step]['fetched_at'])
+                        kept.append(step)
+            for step, data in completed:
+                writer.append(step, data)
+                if step != "current_user":
+                    refreshed.append(step)
+                print(f"{step}: success")
+            completed = []
+        if writer is not None:
+            _keep_previous(writer, previous_raw, previous_meta, kept)
+            rewritten = _commit(writer, previous_meta)
     except Exception as e:
         print("General error in fetch_spotify_data_sequence:", str(e))
-    return {"username": username, "json_file": json_filename}
+        if writer is not None:
+            # The steps not fetched yet must not drop out of the dataset either
+            try:
+                _keep_previous(writer, previous_raw, previous_meta, kept)
+            except Exception as e:
+                print("Keeping previous data failed:", str(e))
+            writer.close()
+            rewritten = True
+    finally:
+        # Don't hold the login request on steps that already timed out
+        executor.shutdown(wait=False, cancel_futures=True)
+    return {
+        "username": username,
+        "json_file": json_filename,
+        "step_timings": step_timings,
+        "refreshed": refreshed,
+        "kept": kept,
+        "rewritten": rewritten
+    }
+
+def _keep_previous(writer, previous_raw, previous_meta, kept):
+    """Copy the previous contents of the steps the writer has not got into it"""
+    for step, _ in DATA_STEPS:
+        if step not in writer.steps and step in previous_raw:
+            # Without metadata the copy counts as stale on the next login
+            writer.append_raw(step, previous_raw[step], previous_meta.get(step, {}).get('fetched_at', 0))
+            kept.append(step)
+            print(f"{step}: kept previous data")
 
+def _commit(writer, previous_meta):
+    """
+    Move a finished dataset into place, unless every step has the same
+    content as the previous dataset; then only its fetch times are updated.
+    Returns whether the dataset was rewritten.
+    """
+    unchanged = set(writer.meta) == set(previous_meta) and all(
+        meta['sha256'] == previous_meta[step].get('sha256') for step, meta in writer.meta.items())
+    if unchanged:
+        writer.discard()
+        # Fails only if another login replaced the dataset meanwhile, which is then newer
+        dataset_store.update_metadata(writer.filename, writer.meta)
+        return False
+    writer.close()
+    return True
@@ -0,0 +1,333 @@
+"""
+Step-indexed storage for the {username}_spotify.json datasets.
+
+A dataset file stays a JSON array of {"step": ..., "data": ...} entries so
+every existing reader (including the Shiny app) keeps working. Next to it we
+keep a small sidecar index ({filename}.idx) holding the byte offset and length
+of each entry, which lets a single step be decoded without parsing the rest
+of the file. The index records the (mtime_ns, size) version of the dataset it
+was built from and is ignored as soon as the dataset changes, in which case
+readers fall back to parsing the whole file.
+
+Existing datasets can be indexed in place with:
+
+    python dataset_store.py data/
+"""
+import os
+import sys
+import json
+import glob
+import time
+import hashlib
+
+INDEX_FORMAT = 1
+
+def index_path(filename):
+    """Return the path of the sidecar index for a dataset file"""
+    return f"{filename}.idx"
+
+def file_version(filename):
+    """Return the (mtime_ns, size) version of a file, or None if it is missing"""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def scan_entries(filename):
+    """
+    Yield (step, offset, length) for every entry of a JSON array dataset.
+
+    Offsets and lengths are in bytes, so each entry can later be read back
+    with a single seek() and decoded on its own.
+    """
+    with open(filename, 'rb') as f:
+        text = f.read().decode('utf-8')
+    decoder = json.JSONDecoder()
+    pos = 0
+    byte_pos = 0
+    last = 0
+
+    def to_bytes(index):
+        # Convert a character index into a byte offset, walking forward only
+        nonlocal byte_pos, last
+        byte_pos += len(text[last:index].encode('utf-8'))
+        last = index
+        return byte_pos
+
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+    if pos >= len(text) or text[pos] != '[':
+        raise ValueError(f"{filename} is not a JSON array dataset")
+    pos += 1
+    while True:
+        while pos < len(text) and (text[pos].isspace() or text[pos] == ','):
+            pos += 1
+        if pos >= len(text):
+            raise ValueError(f"{filename} ends before the dataset array is closed")
+        if text[pos] == ']':
+            break
+        entry, end = decoder.raw_decode(text, pos)
+        start = to_bytes(pos)
+        yield entry.get('step'), start, to_bytes(end) - start
+        pos = end
+
+def write_index(filename, steps, version, meta=None):
+    """
+    Atomically write the sidecar index for a dataset file.
+
+    meta optionally holds per-step freshness metadata, {step: {"fetched_at":
+    epoch seconds, "sha256": hash of the serialized entry}}.
+    """
+    index = {
+        "format": INDEX_FORMAT,
+        "version": list(version),
+        "steps": {step: [offset, length] for step, (offset, length) in steps.items()}
+    }
+    if meta:
+        index["meta"] = meta
+    tmp_path = f"{index_path(filename)}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path(filename))
+
+def build_index(filename):
+    """
+    Scan a dataset file and write its sidecar index.
+
+    Returns the {step: (offset, length)} mapping, or None if the file changed
+    while it was being scanned.
+    """
+    version = file_version(filename)
+    if version is None:
+        return None
+    steps = {}
+    for step, offset, length in scan_entries(filename):
+        # Keep the first entry for a step, like get_from_file does
+        steps.setdefault(step, (offset, length))
+    if file_version(filename) != version:
+        return None
+    write_index(filename, steps, version)
+    return steps
+
+def load_index(filename, version=None):
+    """
+    Load the sidecar index for a dataset file.
+
+    Returns the {step: (offset, length)} mapping, or None when there is no
+    index or it was built from a different version of the file.
+    """
+    if version is None:
+        version = file_version(filename)
+    if version is None:
+        return None
+    try:
+        with open(index_path(filename), 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get('format') != INDEX_FORMAT or tuple(index.get('version', ())) != tuple(version):
+        return None
+    return {step: tuple(span) for step, span in index.get('steps', {}).items()}
+
+def load_metadata(filename, version=None):
+    """
+    Return the per-step freshness metadata of a dataset ({step: {"fetched_at",
+    "sha256"}}), or {} when its index is missing, stale or has none.
+    """
+    if version is None:
+        version = file_version(filename)
+    if version is None:
+        return {}
+    try:
+        with open(index_path(filename), 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if index.get('format') != INDEX_FORMAT or tuple(index.get('version', ())) != tuple(version):
+        return {}
+    return index.get('meta', {})
+
+def update_metadata(filename, meta):
+    """
+    Replace the freshness metadata of an unchanged dataset without rewriting
+    it. Returns False if the dataset has no up-to-date index.
+    """
+    version = file_version(filename)
+    steps = load_index(filename, version)
+    if steps is None:
+        return False
+    write_index(filename, steps, version, meta)
+    return True
+
+def read_raw(filename, offset, length):
+    """Read the serialized dataset entry stored at offset"""
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+def read_entry(filename, offset, length):
+    """Read and decode the single dataset entry stored at offset"""
+    return json.loads(read_raw(filename, offset, length))
+
+class StepWriter:
+    """
+    Append-only writer that produces a step-indexed dataset file.
+
+    Entries are written once, one JSON document per line, into
+    {filename}.part. After every append the closing bracket is rewritten so the
+    partial file is always a valid JSON array of the completed steps, and it is
+    flushed to disk, so finished steps survive a failure later in the sequence.
+    The partial file's own index (with the steps' metadata) is rewritten too,
+    so if the process is killed before close(), recover_partial() can commit
+    the completed steps on the next login. close() moves the file into place
+    with a single atomic rename and writes the sidecar index from the offsets
+    recorded while appending.
+
+    Use it as a context manager; the file is committed even if the block
+    raises, since every step written so far is complete.
+
+    Every step's fetch time and content hash are kept in `meta` and stored
+    in the index, so a later refresh can tell stale and unchanged steps apart.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.tmp_path = f"{filename}.part"
+        self.steps = {}
+        self.meta = {}
+        self._file = open(self.tmp_path, 'w+b')
+        self._file.write(b'[')
+        self._end = self._file.tell()
+        self._close_array()
+
+    def _close_array(self):
+        # Terminate the array after the last entry and push it to disk
+        self._file.seek(self._end)
+        self._file.write(b'\n]\n')
+        self._file.truncate()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, step, data, fetched_at=None):
+        """Serialize one step and append it to the dataset"""
+        self.append_raw(step, json.dumps({"step": step, "data": data}).encode('utf-8'), fetched_at)
+
+    def append_raw(self, step, raw, fetched_at=None):
+        """Append an already serialized {"step", "data"} entry (fetched now unless fetched_at is given)"""
+        separator = b',\n' if self._end > 1 else b'\n'
+        self._file.seek(self._end)
+        self._file.write(separator)
+        offset = self._end + len(separator)
+        self._file.write(raw)
+        self._end = offset + len(raw)
+        if step not in self.steps:
+            self.steps[step] = (offset, len(raw))
+            self.meta[step] = {
+                "fetched_at": fetched_at if fetched_at is not None else time.time(),
+                "sha256": hashlib.sha256(raw).hexdigest()
+            }
+        self._close_array()
+        write_index(self.tmp_path, self.steps, file_version(self.tmp_path), self.meta)
+
+    def _remove_part_index(self):
+        try:
+            os.remove(index_path(self.tmp_path))
+        except OSError:
+            pass
+
+    def close(self):
+        """Atomically move the dataset into place and write its index"""
+        if self._file.closed:
+            return
+        self._file.close()
+        os.replace(self.tmp_path, self.filename)
+        self._remove_part_index()
+        version = file_version(self.filename)
+        if version is not None:
+            write_index(self.filename, self.steps, version, self.meta)
+
+    def discard(self):
+        """Drop the partial file and leave any existing dataset untouched"""
+        if self._file.closed:
+            return
+        self._file.close()
+        os.remove(self.tmp_path)
+        self._remove_part_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+def _complete_entries(filename):
+    # {step: (offset, length)} of the entries before any torn last one
+    steps = {}
+    try:
+        for step, offset, length in scan_entries(filename):
+            steps.setdefault(step, (offset, length))
+    except ValueError:
+        # Killed while appending: every entry before the torn one is complete
+        pass
+    return steps
+
+def recover_partial(filename):
+    """
+    Commit the steps a StepWriter left in {filename}.part when its process
+    was killed before close(). Steps of the current dataset that the partial
+    file does not hold are kept. Steps whose metadata was not written count
+    as fetched at 0, so the next refresh treats them as stale. Returns the
+    recovered steps ([] when there is no partial file).
+    """
+    part_path = f"{filename}.part"
+    version = file_version(part_path)
+    if version is None:
+        return []
+    steps = load_index(part_path, version)
+    meta = load_metadata(part_path, version)
+    if steps is None:
+        steps = _complete_entries(part_path)
+    if not steps:
+        os.remove(part_path)
+        try:
+            os.remove(index_path(part_path))
+        except OSError:
+            pass
+        return []
+    entries = [(step, read_raw(part_path, *span), meta.get(step, {}).get('fetched_at', 0))
+               for step, span in steps.items()]
+    current = load_index(filename) or (_complete_entries(filename) if file_version(filename) else {})
+    current_meta = load_metadata(filename)
+    entries += [(step, read_raw(filename, *span), current_meta.get(step, {}).get('fetched_at', 0))
+                for step, span in current.items() if step not in steps]
+    # The writer reuses {filename}.part; everything was read above
+    with StepWriter(filename) as writer:
+        for step, raw, fetched_at in entries:
+            writer.append_raw(step, raw, fetched_at)
+    return list(steps)
+
+def convert_file(filename):
+    """Build the sidecar index for an existing dataset file and report what was done"""
+    steps = build_index(filename)
+    if steps is None:
+        print(f"{filename}: changed while indexing, skipped")
+    else:
+        print(f"{filename}: indexed {len(steps)} steps")
+    return steps
+
+def convert_directory(directory):
+    """Build sidecar indexes for every *_spotify.json dataset in a directory"""
+    results = {}
+    for filename in sorted(glob.glob(os.path.join(directory, '*_spotify.json'))):
+        results[filename] = convert_file(filename)
+    return results
+
+if __name__ == "__main__":
+    targets = sys.argv[1:] or ['data']
+    for target in targets:
+        if os.path.isdir(target):
+            convert_directory(target)
+        else:
+            convert_file(target)
@@ -0,0 +1,106 @@
+"""
+Incremental listening history for the recently_played step.
+
+Spotify only exposes a user's latest 50 plays, and every login used to
+replace the dataset's recently_played step with them. Instead, each user's
+plays are kept in data/{username}_history.ndjson, one play item per line in
+the order they were added. A login asks Spotify only for plays after the
+newest one in the history (the `after` cursor), appends the new ones and
+stores the whole history, newest first, as the recently_played step, so
+analyses such as the mood distribution cover every play seen so far.
+
+Plays are identified by (played_at, track id); duplicates, including those
+left by two concurrent logins, are dropped when the history is read.
+"""
+import os
+import re
+import json
+import time
+from datetime import datetime
+
+# Set RECENTLY_PLAYED_HISTORY=0 to store only the latest 50 plays, as before
+RECENTLY_PLAYED_HISTORY = os.getenv('RECENTLY_PLAYED_HISTORY', '1') == '1'
+
+def history_path(username, directory='data'):
+    """Return the path of a user's listening history"""
+    return os.path.join(directory, f"{username}_history.ndjson")
+
+def played_at_ms(item):
+    """Return the played_at of a play item in milliseconds since the epoch"""
+    played_at = item['played_at'].replace('Z', '+00:00')
+    # Spotify sends 0 to 6 fraction digits; strptime's %f wants 1 to 6, and
+    # fromisoformat before Python 3.11 only takes 3 or 6
+    fraction = re.search(r'\.(\d+)', played_at)
+    if not fraction:
+        return int(datetime.strptime(played_at, '%Y-%m-%dT%H:%M:%S%z').timestamp() * 1000)
+    played_at = played_at[:fraction.start(1)] + fraction.group(1)[:6] + played_at[fraction.end(1):]
+    return int(datetime.strptime(played_at, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp() * 1000)
+
+def play_key(item):
+    return (item.get('played_at'), (item.get('track') or {}).get('id'))
+
+def load_history(path):
+    """Return the plays of a history file in the order they were added, without duplicates"""
+    plays = []
+    seen = set()
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    # A line cut short by an interrupted append
+                    continue
+                key = play_key(item)
+                if item.get('played_at') and key not in seen:
+                    seen.add(key)
+                    plays.append(item)
+    except FileNotFoundError:
+        pass
+    return plays
+
+def append_plays(path, plays):
+    """Append play items to a history file, oldest first"""
+    if not plays:
+        return
+    with open(path, 'a') as f:
+        for item in sorted(plays, key=played_at_ms):
+            f.write(json.dumps(item) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+def merge_plays(history, page):
+    """
+    Merge a fetched recently played page into the history.
+
+    Returns (new plays, recently_played step data holding every play, newest first).
+    """
+    seen = {play_key(item) for item in history}
+    new_plays = []
+    for item in page.get('items', []):
+        key = play_key(item)
+        if item.get('played_at') and key not in seen:
+            seen.add(key)
+            new_plays.append(item)
+    plays = sorted(history + new_plays, key=played_at_ms, reverse=True)
+    step = dict(page, items=plays)
+    if plays:
+        step['cursors'] = {"after": str(played_at_ms(plays[0])), "before": str(played_at_ms(plays[-1]))}
+    return new_plays, step
+
+def fetch_recently_played(sp, username, directory='data'):
+    """
+    Fetch the plays since the newest one in a user's history, add them to
+    the history and return the recently_played step data for every play.
+    Without a history this is a plain fetch of the latest 50 plays.
+    """
+    path = history_path(username, directory)
+    history = load_history(path)
+    if history:
+        cursor = max(played_at_ms(item) for item in history)
+        page = sp.current_user_recently_played(limit=50, after=cursor)
+    else:
+        page = sp.current_user_recently_played(limit=50, before=int(time.time() * 1000))
+    new_plays, step = merge_plays(history, page or {"items": []})
+    append_plays(path, new_plays)
+    return step
@@ -1,12 +1,25 @@
-from flask import Flask, jsonify, request as flask_request
+from flask import Flask, Response, jsonify, request as flask_request
 import time
 from data.get_data import fetch_spotify_data_sequence
 from flask_cors import CORS
 
 from routes import register_routes
+from utils import dataset_cache
+from models import model_cache
+from audio_features import audio_feature_store
+from spotify_client import spotify_client
+from outbound import spotify_scheduler
+from shared_cache import shared_cache, step_cache
+from singleflight import flights
+from materialize import MATERIALIZE_ON_INGEST, materialize, load_materialized, materialized_cache
+import conditional
+import warmup
+import metrics
 
 app = Flask(__name__)
 CORS(app)
+# Latency, status and in-flight count of every request, served by /metrics
+metrics.install(app)
 
 @app.route("/")
 def hello_world():
@@ -14,12 +27,96 @@ def hello_world():
 
 @app.route("/login", methods=["POST", "GET"])
 def login_and_fetch_data():
-    results = fetch_spotify_data_sequence()
+    # refresh=all re-fetches every step, fresh or not
+    results = fetch_spotify_data_sequence(force=flask_request.args.get('refresh') == 'all')
+    json_file = results.get("json_file")
+    # An unchanged dataset keeps its materialized results
+    if MATERIALIZE_ON_INGEST and json_file and (results.get("rewritten") or load_materialized(f"data/{json_file}") is None):
+        # Precompute every analysis result so the wrap is served from one file
+        try:
+            materialize(f"data/{json_file}")
+        except Exception as e:
+            print("Materialize failed:", str(e))
     return jsonify(results)
 
+@app.route("/ready", methods=["GET"])
+def get_ready():
+    # 503 until the startup warm-up has loaded the datasets
+    status = warmup.status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route("/cache_stats", methods=["GET"])
+def get_cache_stats():
+    return jsonify({
+        "datasets": dataset_cache.stats(),
+        "models": model_cache.stats(),
+        "audio_features": audio_feature_store.stats(),
+        "spotify": spotify_client.stats(),
+        "spotify_scheduler": spotify_scheduler.stats(),
+        "conditional_get": conditional.stats(),
+        "single_flight": flights.stats(),
+        "shared": shared_cache.stats(),
+        "shared_steps": step_cache.stats(),
+        "warmup": warmup.status()
+    })
+
+def _cache_counts():
+    # (hits, misses) of every cache /cache_stats reports
+    features = audio_feature_store.stats()
+    counts = {name: (stats["hits"], stats["misses"]) for name, stats in (
+        ("datasets", dataset_cache.stats()), ("models", model_cache.stats()),
+        ("materialized", materialized_cache.stats()), ("shared", shared_cache.stats()),
+        ("shared_steps", step_cache.stats())
+    )}
+    counts["audio_features"] = (features["memory"]["hits"] + features["db_hits"] + features["shared_hits"],
+                                features["misses"])
+    return counts
+
+metrics.Counter('wrapped_cache_hits_total', 'Cache lookups answered, per cache', ['cache'],
+                collect=lambda: {(name,): hits for name, (hits, _) in _cache_counts().items()})
+metrics.Counter('wrapped_cache_misses_total', 'Cache lookups not answered, per cache', ['cache'],
+                collect=lambda: {(name,): misses for name, (_, misses) in _cache_counts().items()})
+metrics.Gauge('wrapped_cache_hit_ratio', 'Share of lookups answered since startup, per cache', ['cache'],
+              collect=lambda: {(name,): hits / (hits + misses) if hits + misses else 0.0
+                               for name, (hits, misses) in _cache_counts().items()})
+metrics.Gauge('wrapped_cache_entries', 'Entries held by an in-process cache', ['cache'],
+              collect=lambda: {(name,): len(cache) for name, cache in (
+                  ("datasets", dataset_cache), ("models", model_cache),
+                  ("materialized", materialized_cache), ("audio_features", audio_feature_store.memory))})
+metrics.Counter('wrapped_audio_features_outbound_calls_total', 'Spotify batches fetched by the audio feature store',
+                collect=lambda: {(): audio_feature_store.outbound_calls})
+metrics.Gauge('wrapped_spotify_waiting', 'Spotify calls waiting for a scheduler token, per lane', ['lane'],
+              collect=lambda: {(lane,): entry["waiting"] for lane, entry in spotify_scheduler.stats()["lanes"].items()})
+metrics.Counter('wrapped_spotify_wait_seconds_total', 'Time Spotify calls spent waiting for a token, per lane', ['lane'],
+                collect=lambda: {(lane,): entry["wait_seconds"] for lane, entry in spotify_scheduler.stats()["lanes"].items()})
+metrics.Counter('wrapped_single_flight_requests_total', 'Requests computed or collapsed into another, per endpoint',
+                ['endpoint', 'outcome'],
+                collect=lambda: {(endpoint, outcome): count
+                                 for endpoint, entry in flights.stats()["endpoints"].items()
+                                 for outcome, count in entry.items()})
+metrics.Gauge('wrapped_single_flight_in_flight', 'Computations other identical requests can join',
+              collect=lambda: {(): flights.stats()["in_flight"]})
+metrics.Counter('wrapped_not_modified_total', 'Requests answered 304 Not Modified',
+                collect=lambda: {(): conditional.stats()["not_modified"]})
+metrics.Gauge('wrapped_ready', '1 once the startup warm-up has finished',
+              collect=lambda: {(): warmup.ready()})
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    # Prometheus text format
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 register_routes(app)
 
+@app.before_request
+def start_warmup():
+    # WSGI servers (gunicorn main:app) only import the app, so warm-up starts with
+    # the first request, usually the load balancer's /ready probe
+    warmup.start()
+
 if __name__ == "__main__":
+    # Preload the datasets in data/ in the background; /ready reports when it is done
+    warmup.start()
     print("Starting Flask server...")
     print("Visit http://127.0.0.1:5000 to access the API")
     print("Press CTRL+C to quit")
@@ -0,0 +1,195 @@
+"""
+Ingest-time materialized analysis results.
+
+Every analysis result is a pure function of a dataset file (plus audio
+features), so after ingest we compute all of them for all three time ranges
+and store them next to the dataset in {filename}.analysis.json, together with
+a SHA-256 hash of the dataset they were computed from. The routes serve from
+this file while the hash still matches the dataset, and fall back to computing
+live results once it changes.
+
+Existing datasets can be materialized with:
+
+    python materialize.py data/
+"""
+import os
+import sys
+import json
+import glob
+import hashlib
+
+from cache import LRUCache
+from metrics import STAGE_SECONDS
+from shared_cache import shared_cache, MISSING
+from dataset_store import file_version
+from utils import load_dataset
+from audio_features import audio_feature_store
+from analytics import (
+    TIME_RANGES, time_range_step, mood_distribution, popularity_score,
+    weighted_genre_counts, genre_distribution, personality_predictions,
+    filter_top_artists, filter_top_tracks
+)
+
+MATERIALIZE_FORMAT = 1
+MATERIALIZE_ON_INGEST = os.getenv('MATERIALIZE_ON_INGEST', '1') == '1'
+# top_n used for the stored genre distributions (the routes' default)
+MATERIALIZED_TOP_N = 10
+
+# Validated materialized results by dataset path, keyed on both file versions
+materialized_cache = LRUCache(maxsize=int(os.getenv('DATASET_CACHE_SIZE', 8)))
+
+def results_path(filename):
+    """Return the path of the materialized results for a dataset file"""
+    return f"{filename}.analysis.json"
+
+def source_hash(filename):
+    """SHA-256 of a dataset file's contents"""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def compute_results(steps, username):
+    """
+    Compute every materialized section from a dataset's {step: data}
+    dictionary. When the audio features cannot be fetched, the sections that
+    need them are left out and named in results["missing"].
+    """
+    results = {"profile": steps.get('current_user')}
+    for section in ('top_artists', 'top_tracks', 'popularity', 'genres', 'personality'):
+        results[section] = {}
+
+    # Fetch every audio feature up front so a Spotify failure leaves the
+    # feature-dependent sections out instead of storing degraded results
+    track_ids = []
+    for time_range in TIME_RANGES:
+        top_tracks = steps.get(time_range_step('tracks', time_range))
+        if top_tracks:
+            track_ids.extend(track['id'] for track in top_tracks.get('items', [])[:20] if track.get('id'))
+    recently_played = steps.get('recently_played')
+    if recently_played:
+        track_ids.extend(item.get('track', {}).get('id') for item in recently_played.get('items', [])
+                         if item.get('track', {}).get('id'))
+    try:
+        audio_feature_store.get_many(track_ids)
+        features_available = True
+    except Exception as e:
+        print(f"Materialize: audio features unavailable, skipping mood and personality: {e}")
+        features_available = False
+
+    missing = []
+    if recently_played is not None:
+        if features_available:
+            # Batch scoring labels the history with the array classifier
+            results["mood"] = mood_distribution(recently_played, vectorized=True)
+        else:
+            missing.append("mood")
+
+    personality_requests = []
+    for time_range in TIME_RANGES:
+        top_artists = steps.get(time_range_step('artists', time_range))
+        top_tracks = steps.get(time_range_step('tracks', time_range))
+        if top_tracks is not None:
+            results["top_tracks"][time_range] = filter_top_tracks(top_tracks, 50)
+            results["popularity"][time_range] = popularity_score(top_tracks, username, time_range)
+        if top_artists is not None:
+            genre_counts = weighted_genre_counts(top_artists)
+            results["top_artists"][time_range] = filter_top_artists(top_artists, 50)
+            results["genres"][time_range] = genre_distribution(
+                top_artists, time_range, MATERIALIZED_TOP_N, genre_counts)
+            if features_available:
+                personality_requests.append((top_artists, top_tracks, username, time_range, genre_counts))
+            elif "personality" not in missing:
+                missing.append("personality")
+
+    # Score the personality of every time range in one batch
+    for personality in personality_predictions(personality_requests):
+        results["personality"][personality['time_range']] = personality
+    if missing:
+        results["missing"] = missing
+    return results
+
+def materialize(filename):
+    """Compute and store the analysis results for a dataset file; returns the results path"""
+    version = file_version(filename)
+    steps = load_dataset(filename)
+    if version is None or steps is None:
+        return None
+    username = (steps.get('current_user') or {}).get('id')
+    document = {
+        "format": MATERIALIZE_FORMAT,
+        "source_hash": source_hash(filename),
+        "source_version": list(version),
+        "results": compute_results(steps, username)
+    }
+    path = results_path(filename)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(document, f)
+    os.replace(tmp_path, path)
+    return path
+
+def load_materialized(filename):
+    """
+    Return the materialized results for a dataset, or None if there are none
+    or they were computed from different dataset contents.
+    """
+    version = file_version(filename)
+    stored_version = file_version(results_path(filename))
+    if version is None or stored_version is None:
+        return None
+    key = os.path.abspath(filename)
+    versions = (version, stored_version)
+    cached = materialized_cache.get(key, validate=lambda entry: entry[0] == versions)
+    if cached is not None:
+        return cached[1]
+    shared_key = shared_cache.dataset_key('results', filename, version, *stored_version, MATERIALIZE_FORMAT)
+    results = shared_cache.get(shared_key)
+    if results is MISSING:
+        try:
+            with STAGE_SECONDS.time('materialized_read'), open(results_path(filename), 'r') as f:
+                document = json.load(f)
+        except (OSError, ValueError):
+            return None
+        results = None
+        if document.get('format') == MATERIALIZE_FORMAT:
+            # An unchanged mtime/size means unchanged contents; otherwise compare hashes
+            if tuple(document.get('source_version', ())) == version or document.get('source_hash') == source_hash(filename):
+                results = document.get('results')
+        shared_cache.set(shared_key, results)
+    materialized_cache.set(key, (versions, results))
+    return results
+
+def materialized_section(results, section, username, time_range=None, limit=50, top_n=MATERIALIZED_TOP_N):
+    """
+    Return a route-ready section from materialized results, or None when it
+    has to be computed live (no results, section missing or non-default top_n).
+    """
+    if results is None or results.get(section) is None:
+        return None
+    if section == 'profile' or section == 'mood':
+        return results[section]
+    if section == 'genres' and top_n != MATERIALIZED_TOP_N:
+        return None
+    data = results[section].get(time_range)
+    if data is None:
+        return None
+    if section in ('top_artists', 'top_tracks'):
+        return dict(data, items=data['items'][:limit])
+    if section in ('popularity', 'personality'):
+        return dict(data, username=username)
+    return data
+
+def materialize_directory(directory):
+    """Materialize every *_spotify.json dataset in a directory"""
+    for filename in sorted(glob.glob(os.path.join(directory, '*_spotify.json'))):
+        path = materialize(filename)
+        print(f"{filename}: {'materialized to ' + path if path else 'skipped'}")
+
+if __name__ == "__main__":
+    for target in sys.argv[1:] or ['data']:
+        if os.path.isdir(target):
+            materialize_directory(target)
+        else:
+            print(f"{target}: materialized to {materialize(target)}")
@@ -0,0 +1,209 @@
+"""
+Prometheus metrics, served by /metrics in the text exposition format.
+
+Counters, gauges and histograms are kept in process, one series per label
+values, and rendered on each scrape; recording a value is a lock and a
+bisect, cheap enough to leave on in production. Modules define the metrics
+they own next to the code they measure:
+
+- request latency and counts per route and in-flight requests (install()
+  for the Flask app, the async server records its own handlers),
+- stage timings (timed() / STAGE_SECONDS): dataset parse, model decode,
+  per-route filtering, each analysis step and audio-feature lookups,
+- outbound Spotify latency and status per endpoint (spotify_client.py).
+
+Metrics whose value already lives in a stats() dict (cache hits, scheduler
+queues, collapsed requests) take a `collect` function that reads it at
+scrape time instead of being updated on the hot path.
+"""
+import time
+import bisect
+import inspect
+import threading
+from functools import wraps
+from flask import g, request
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, float) and value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # collect() returns {label values tuple: value}, read at scrape time
+        self.collect = collect
+        self._lock = threading.Lock()
+        self._series = {}
+        REGISTRY.append(self)
+
+    def _samples(self):
+        if self.collect is not None:
+            return sorted(self.collect().items())
+        with self._lock:
+            return sorted(self._series.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self._samples():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+class Counter(_Metric):
+    """Monotonic count per label values"""
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+class Gauge(_Metric):
+    """Value per label values that can go up and down"""
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._series[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+class Histogram(_Metric):
+    """Bucketed distribution of observed values (seconds) per label values"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        # Bucket i counts values in (buckets[i-1], buckets[i]]; the last one is +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *labels):
+        """Context manager observing the seconds its block takes"""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+def render():
+    """Every registered metric in the Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+STAGE_SECONDS = Histogram('wrapped_stage_duration_seconds',
+                          'Time spent in a stage of loading or analysing a dataset', ['stage'])
+
+def timed(stage):
+    """Observe every call of the decorated function (or coroutine function) under STAGE_SECONDS"""
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    STAGE_SECONDS.observe(time.perf_counter() - started, stage)
+            return async_wrapper
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage)
+        return wrapper
+    return decorator
+
+REQUEST_SECONDS = Histogram('wrapped_http_request_duration_seconds',
+                            'Time to serve a request, per route', ['route', 'method'])
+REQUESTS = Counter('wrapped_http_requests_total', 'Requests served, per route and status', ['route', 'method', 'status'])
+IN_FLIGHT = Gauge('wrapped_http_requests_in_flight', 'Requests being served')
+
+def observe_request(route, method, status, seconds):
+    REQUEST_SECONDS.observe(seconds, route, method)
+    REQUESTS.inc(route, method, str(status))
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    IN_FLIGHT.inc()
+
+def _record_request(response):
+    started = g.get('metrics_started')
+    if started is not None:
+        rule = request.url_rule
+        # Unmatched paths share one series so scans cannot add series without bound
+        observe_request(rule.rule if rule is not None else 'unmatched', request.method, response.status_code,
+                        time.perf_counter() - started)
+    return response
+
+def _finish_request(error=None):
+    if g.pop('metrics_started', None) is not None:
+        IN_FLIGHT.dec()
+
+def install(app):
+    """Record the latency, status and in-flight count of every request to a Flask app"""
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+    app.teardown_request(_finish_request)
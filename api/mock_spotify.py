@@ -0,0 +1,268 @@
+"""
+Local stand-in for the Spotify Web API, for offline load and latency testing.
+
+Serves the endpoints the app uses, with payloads taken from a sample dataset
+(and deterministic synthetic audio features):
+
+    GET /v1/me
+    GET /v1/me/top/artists, /v1/me/top/tracks     (time_range, limit, offset)
+    GET /v1/me/player/recently-played             (limit, before, after)
+    GET /v1/me/tracks                             (limit, offset)
+    GET /v1/audio-features                        (ids)
+
+Latency is drawn from a configurable distribution, globally or per endpoint,
+and a share of requests, or those beyond --rate-limit per second, can be
+answered with 429 and a Retry-After header.
+Per-endpoint call counts and statuses are served at GET /__stats and reset
+with POST /__reset.
+
+    python mock_spotify.py --port 8765 --latency normal:80,20 \\
+        --latency audio-features=uniform:50,300 --rate-429 audio-features=0.05
+
+Point the app at it with:
+
+    SPOTIFY_API_BASE=http://127.0.0.1:8765/v1 SPOTIFY_ACCESS_TOKEN=mock token=mock python main.py
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import collections
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from utils import load_dataset
+from history import played_at_ms
+from benchmarks.datasets import sample_datasets, synthetic_features
+
+DEFAULT_PORT = 8765
+
+def parse_latency(spec):
+    """
+    Parse a latency distribution (milliseconds) into a function returning seconds.
+
+    Accepted forms: fixed:MS, uniform:LOW,HIGH, normal:MEAN,STDDEV,
+    lognormal:MEDIAN,SIGMA and exp:MEAN.
+    """
+    kind, _, args = spec.partition(':')
+    values = [float(value) for value in args.split(',')] if args else []
+    if kind == 'fixed' and len(values) == 1:
+        return lambda rng: values[0] / 1000
+    if kind == 'uniform' and len(values) == 2:
+        return lambda rng: rng.uniform(*values) / 1000
+    if kind == 'normal' and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(*values)) / 1000
+    if kind == 'lognormal' and len(values) == 2:
+        median, sigma = values
+        return lambda rng: median * rng.lognormvariate(0, sigma) / 1000
+    if kind == 'exp' and len(values) == 1:
+        return lambda rng: rng.expovariate(1 / values[0]) / 1000 if values[0] else 0.0
+    raise ValueError(f"Invalid latency distribution: {spec}")
+
+def _per_endpoint(specs, parse, default):
+    """Split [ENDPOINT=]VALUE options into a default and per-endpoint overrides"""
+    overrides = {}
+    for spec in specs or []:
+        endpoint, separator, value = spec.rpartition('=')
+        if separator:
+            overrides[endpoint] = parse(value)
+        else:
+            default = parse(value)
+    return default, overrides
+
+def _timestamp_ms(played_at):
+    return played_at_ms({'played_at': played_at})
+
+class MockSpotify:
+    """Request handling, fault injection and counters of the mock API"""
+
+    def __init__(self, dataset, latency='fixed:0', rate_429='0', retry_after=1, seed=None, rate_limit=None):
+        self.steps = load_dataset(dataset)
+        if self.steps is None:
+            raise ValueError(f"Dataset not found: {dataset}")
+        self.latency, self.endpoint_latency = _per_endpoint(
+            latency if isinstance(latency, list) else [latency], parse_latency, parse_latency('fixed:0'))
+        self.rate_429, self.endpoint_rate_429 = _per_endpoint(
+            rate_429 if isinstance(rate_429, list) else [rate_429], float, 0.0)
+        self.retry_after = retry_after
+        # Requests per second served before answering 429, like Spotify's rolling window
+        self.rate_limit = rate_limit
+        self._window = collections.deque()
+        self.rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _record(self, endpoint, status, elapsed):
+        with self._lock:
+            entry = self._stats.setdefault(endpoint, {"calls": 0, "total_seconds": 0.0, "statuses": {}})
+            entry["calls"] += 1
+            entry["total_seconds"] = round(entry["total_seconds"] + elapsed, 6)
+            entry["statuses"][str(status)] = entry["statuses"].get(str(status), 0) + 1
+
+    def stats(self):
+        """Return per-endpoint call counts and statuses"""
+        with self._lock:
+            return {endpoint: dict(entry, statuses=dict(entry["statuses"])) for endpoint, entry in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def _draw(self, endpoint):
+        # Latency and 429 decision for one request
+        with self._lock:
+            delay = self.endpoint_latency.get(endpoint, self.latency)(self.rng)
+            throttled = self.rng.random() < self.endpoint_rate_429.get(endpoint, self.rate_429)
+            if self.rate_limit:
+                now = time.monotonic()
+                while self._window and self._window[0] <= now - 1:
+                    self._window.popleft()
+                if len(self._window) >= self.rate_limit:
+                    throttled = True
+                else:
+                    self._window.append(now)
+        return delay, throttled
+
+    def _paged(self, data, query, default_limit=20):
+        data = data or {"items": []}
+        limit = int(query.get('limit', default_limit))
+        offset = int(query.get('offset', 0))
+        items = data.get('items', [])
+        return dict(data, items=items[offset:offset + limit], limit=limit, offset=offset, total=len(items))
+
+    def _recently_played(self, query):
+        data = self.steps.get('recently_played') or {"items": []}
+        items = [item for item in data.get('items', []) if item.get('played_at')]
+        if query.get('after'):
+            items = [item for item in items if _timestamp_ms(item['played_at']) > int(query['after'])]
+        elif query.get('before'):
+            items = [item for item in items if _timestamp_ms(item['played_at']) < int(query['before'])]
+        items = items[:int(query.get('limit', 20))]
+        cursors = None
+        if items:
+            played = [_timestamp_ms(item['played_at']) for item in items]
+            cursors = {"after": str(max(played)), "before": str(min(played))}
+        return dict(data, items=items, limit=int(query.get('limit', 20)), cursors=cursors)
+
+    def _saved_tracks(self, query):
+        saved = self.steps.get('saved_tracks')
+        if saved is None:
+            # The sample datasets have no saved tracks; use the long-term top tracks
+            top_tracks = self.steps.get('top_tracks_long') or {"items": []}
+            saved = {"items": [{"added_at": "2024-01-01T00:00:00Z", "track": track}
+                               for track in top_tracks.get('items', [])]}
+        return self._paged(saved, query)
+
+    def _audio_features(self, query):
+        ids = [track_id for track_id in query.get('ids', '').split(',') if track_id]
+        if not ids or len(ids) > 100:
+            return 400, {"error": {"status": 400, "message": "invalid request"}}
+        return 200, {"audio_features": [synthetic_features(track_id) for track_id in ids]}
+
+    def route(self, path, query):
+        """Return (endpoint, status, body) for a GET request"""
+        # spotipy asks for some paths with a trailing slash ("me/")
+        path = path.rstrip('/')
+        if path == '/v1/me':
+            return 'me', 200, self.steps.get('current_user')
+        if path in ('/v1/me/top/artists', '/v1/me/top/tracks'):
+            kind = path.rsplit('/', 1)[1]
+            time_range = query.get('time_range', 'medium_term')
+            step = f"top_{kind}_{time_range.split('_')[0]}"
+            return f"me/top/{kind}", 200, self._paged(self.steps.get(step), query)
+        if path == '/v1/me/player/recently-played':
+            return 'me/player/recently-played', 200, self._recently_played(query)
+        if path == '/v1/me/tracks':
+            return 'me/tracks', 200, self._saved_tracks(query)
+        if path == '/v1/audio-features':
+            status, body = self._audio_features(query)
+            return 'audio-features', status, body
+        return 'unknown', 404, {"error": {"status": 404, "message": "Service not found"}}
+
+    def handle(self, path, query, headers):
+        """Return (status, extra headers, body) for a GET request, after the simulated latency"""
+        started = time.perf_counter()
+        endpoint, status, body = self.route(path, query)
+        extra_headers = {}
+        if not headers.get('Authorization', '').startswith('Bearer '):
+            status, body = 401, {"error": {"status": 401, "message": "No token provided"}}
+        else:
+            delay, throttled = self._draw(endpoint)
+            time.sleep(delay)
+            if throttled:
+                status, body = 429, {"error": {"status": 429, "message": "API rate limit exceeded"}}
+                extra_headers['Retry-After'] = str(self.retry_after)
+        self._record(endpoint, status, time.perf_counter() - started)
+        return status, extra_headers, body
+
+class MockSpotifyHandler(BaseHTTPRequestHandler):
+    """HTTP front end of a MockSpotify (set as the server's `mock` attribute)"""
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/__stats':
+            return self._send(200, self.server.mock.stats())
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        status, headers, body = self.server.mock.handle(url.path, query, self.headers)
+        self._send(status, body, headers)
+
+    def do_POST(self):
+        if urlsplit(self.path).path == '/__reset':
+            self.server.mock.reset()
+            return self._send(200, {"reset": True})
+        self._send(404, {"error": {"status": 404, "message": "Service not found"}})
+
+    def log_message(self, format, *args):
+        # Keep load tests quiet
+        pass
+
+def serve(mock, host='127.0.0.1', port=DEFAULT_PORT):
+    """Create a threading HTTP server for a MockSpotify; call serve_forever() on it"""
+    server = ThreadingHTTPServer((host, port), MockSpotifyHandler)
+    server.daemon_threads = True
+    server.mock = mock
+    return server
+
+def start_in_thread(mock, host='127.0.0.1', port=0):
+    """Start a mock server on a background thread; returns (server, base_url)"""
+    server = serve(mock, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Spotify Web API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--dataset', default=None, help="dataset to serve (default: first sample in data/)")
+    parser.add_argument('--latency', action='append', default=[],
+                        help="[ENDPOINT=]DIST latency in ms: fixed:MS, uniform:LOW,HIGH, normal:MEAN,SD, "
+                             "lognormal:MEDIAN,SIGMA or exp:MEAN (repeatable)")
+    parser.add_argument('--rate-429', action='append', default=[],
+                        help="[ENDPOINT=]P share of requests answered with 429 (repeatable)")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument('--rate-limit', type=int, default=None,
+                        help="requests per second served before answering 429 (rolling one-second window)")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    dataset = args.dataset or sample_datasets()[0]
+    mock = MockSpotify(dataset, args.latency, args.rate_429, args.retry_after, args.seed, args.rate_limit)
+    server = serve(mock, args.host, args.port)
+    print(f"Mock Spotify API serving {dataset} at http://{args.host}:{server.server_address[1]}/v1", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,281 @@
+"""
+Compact in-memory model of the track and artist steps of a dataset.
+
+The raw Spotify objects carry far more than the slides use (available
+markets, external URLs, URIs, ...). The /user routes instead read a model
+holding only the projected fields, in __slots__ records with interned
+strings. Equal albums, tracks and artists are stored once per dataset, so a
+track in several top lists and in recently played is a single object.
+
+A dataset's model is decoded once per file version (see load_model) and
+projected per request into the same JSON the filter_* functions in
+analytics.py have always produced.
+"""
+import os
+import sys
+import json
+
+import dataset_store
+from cache import LRUCache
+from metrics import timed
+
+# Fields a fields= projection can select, in response order; "album" also
+# takes sub-fields ("album.images")
+TRACK_FIELDS = ['name', 'id', 'popularity', 'artists', 'album', 'duration_ms', 'played_at']
+ALBUM_FIELDS = ['name', 'images']
+ARTIST_FIELDS = ['name', 'popularity', 'images', 'genres', 'total_followers']
+# recently_played items have always been returned without the track id
+RECENTLY_PLAYED_FIELDS = [field for field in TRACK_FIELDS if field != 'id']
+NESTED_FIELDS = {'album': ALBUM_FIELDS}
+
+# Steps held in the model and whether their items wrap the track ({"track": ..., "played_at": ...})
+TRACK_STEPS = {
+    'recently_played': True, 'saved_tracks': True,
+    'top_tracks_short': False, 'top_tracks_medium': False, 'top_tracks_long': False
+}
+ARTIST_STEPS = ['top_artists_short', 'top_artists_medium', 'top_artists_long']
+
+# Decoded models by dataset path; each entry is (version, {step: Page})
+model_cache = LRUCache(maxsize=int(os.getenv('DATASET_CACHE_SIZE', 8)))
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+class Album:
+    __slots__ = ('name', 'images')
+
+    def __init__(self, name, images):
+        self.name = name
+        self.images = images
+
+class Track:
+    __slots__ = ('id', 'name', 'popularity', 'artists', 'album', 'duration_ms')
+
+    def __init__(self, id, name, popularity, artists, album, duration_ms):
+        self.id = id
+        self.name = name
+        self.popularity = popularity
+        self.artists = artists
+        self.album = album
+        self.duration_ms = duration_ms
+
+class Artist:
+    __slots__ = ('name', 'popularity', 'images', 'genres', 'total_followers')
+
+    def __init__(self, name, popularity, images, genres, total_followers):
+        self.name = name
+        self.popularity = popularity
+        self.images = images
+        self.genres = genres
+        self.total_followers = total_followers
+
+class Page:
+    """
+    One list step: its records, the played_at of each item (None when no
+    item has one) and the step's other top-level keys (href, limit, total...)
+    """
+    __slots__ = ('items', 'played_at', 'meta')
+
+    def __init__(self, items, played_at, meta):
+        self.items = items
+        self.played_at = played_at
+        self.meta = meta
+
+class Decoder:
+    """Decodes raw steps of one dataset, sharing equal albums, tracks and artists"""
+
+    def __init__(self):
+        self._shared = {}
+
+    def _share(self, key, build):
+        record = self._shared.get(key)
+        if record is None:
+            record = self._shared[key] = build()
+        return record
+
+    def album(self, data):
+        images = data.get('images', [])
+        key = ('album', data.get('id'), data.get('name'), tuple(image.get('url') for image in images or ()))
+        return self._share(key, lambda: Album(_intern(data.get('name')), images))
+
+    def track(self, data):
+        album = self.album(data.get('album', {}))
+        artists = tuple(_intern(artist.get('name')) for artist in data.get('artists', []))
+        key = ('track', data.get('id'), data.get('name'), data.get('popularity'), artists, id(album),
+               data.get('duration_ms'))
+        return self._share(key, lambda: Track(_intern(data.get('id')), _intern(data.get('name')),
+                                              data.get('popularity'), artists, album, data.get('duration_ms')))
+
+    def artist(self, data):
+        images = data.get('images')
+        genres = data.get('genres')
+        if genres is not None:
+            genres = [_intern(genre) for genre in genres]
+        total_followers = (data.get('followers') or {}).get('total')
+        key = ('artist', data.get('id'), data.get('name'), data.get('popularity'),
+               None if genres is None else tuple(genres), total_followers,
+               None if images is None else tuple(image.get('url') for image in images))
+        return self._share(key, lambda: Artist(_intern(data.get('name')), data.get('popularity'), images,
+                                               genres, total_followers))
+
+    def _page(self, data, items, played_at):
+        meta = dict(data)
+        # Keep the position of "items" so projected responses keep the key order
+        meta['items'] = None
+        if not any(value is not None for value in played_at):
+            played_at = None
+        return Page(tuple(items), played_at, meta)
+
+    def tracks(self, data, nested):
+        """Decode a track list step (nested: items are {"track": ..., "played_at": ...})"""
+        raw_items = data.get('items', [])
+        if nested:
+            items = [self.track(item.get('track', {})) for item in raw_items]
+        else:
+            items = [self.track(item) for item in raw_items]
+        return self._page(data, items, [item.get('played_at') for item in raw_items])
+
+    def artists(self, data):
+        """Decode an artist list step"""
+        raw_items = data.get('items', [])
+        return self._page(data, [self.artist(item) for item in raw_items], [None] * len(raw_items))
+
+def parse_fields(fields, allowed, nested=NESTED_FIELDS):
+    """
+    Parse a comma-separated fields= parameter ("name,artists,album.images")
+    into [(field, sub-fields or None)] in response order. No fields selects
+    every allowed field; unknown fields raise ValueError.
+    """
+    if not fields:
+        return [(field, nested.get(field)) for field in allowed]
+    requested = {}
+    for name in fields.split(','):
+        field, _, subfield = name.strip().partition('.')
+        if field not in allowed or (subfield and subfield not in nested.get(field, ())):
+            raise ValueError(f"Unknown field: {name.strip()}")
+        if subfield and requested.get(field, ()) is not None:
+            requested.setdefault(field, set()).add(subfield)
+        else:
+            requested[field] = None
+    return [(field, [sub for sub in nested[field] if sub in requested[field]]
+             if requested[field] is not None else nested.get(field))
+            for field in allowed if field in requested]
+
+def _project_track(track, played_at, fields):
+    projected = {}
+    for field, subfields in fields:
+        if field == 'artists':
+            projected[field] = list(track.artists)
+        elif field == 'album':
+            projected[field] = {subfield: getattr(track.album, subfield) for subfield in subfields}
+        elif field == 'played_at':
+            projected[field] = played_at
+        else:
+            projected[field] = getattr(track, field)
+    return projected
+
+# Field lists of the responses without fields=, which are built with dict literals
+DEFAULT_TRACK_FIELDS = parse_fields(None, TRACK_FIELDS)
+DEFAULT_RECENTLY_PLAYED_FIELDS = parse_fields(None, RECENTLY_PLAYED_FIELDS)
+DEFAULT_ARTIST_FIELDS = parse_fields(None, ARTIST_FIELDS)
+
+def _full_track(track, played_at):
+    return {
+        'name': track.name,
+        'id': track.id,
+        'popularity': track.popularity,
+        'artists': list(track.artists),
+        'album': {'name': track.album.name, 'images': track.album.images},
+        'duration_ms': track.duration_ms,
+        'played_at': played_at
+    }
+
+def _full_played_track(track, played_at):
+    return {
+        'name': track.name,
+        'popularity': track.popularity,
+        'artists': list(track.artists),
+        'album': {'name': track.album.name, 'images': track.album.images},
+        'duration_ms': track.duration_ms,
+        'played_at': played_at
+    }
+
+@timed('project_tracks')
+def project_tracks(page, limit, fields):
+    """Response for the first `limit` tracks of a page, each as {"track": {fields}}"""
+    played_at = page.played_at or (None,) * len(page.items)
+    if fields == DEFAULT_TRACK_FIELDS:
+        project = _full_track
+    elif fields == DEFAULT_RECENTLY_PLAYED_FIELDS:
+        project = _full_played_track
+    else:
+        project = lambda track, played: _project_track(track, played, fields)
+    result = dict(page.meta)
+    result['items'] = [{'track': project(track, played)} for track, played in zip(page.items[:limit], played_at)]
+    return result
+
+@timed('project_artists')
+def project_artists(page, limit, fields):
+    """Response for the first `limit` artists of a page"""
+    result = dict(page.meta)
+    if fields == DEFAULT_ARTIST_FIELDS:
+        result['items'] = [{
+            'name': artist.name,
+            'popularity': artist.popularity,
+            'images': artist.images,
+            'genres': artist.genres,
+            'total_followers': artist.total_followers
+        } for artist in page.items[:limit]]
+    else:
+        result['items'] = [{field: getattr(artist, field) for field, _ in fields} for artist in page.items[:limit]]
+    return result
+
+@timed('model_decode')
+def decode_steps(steps):
+    """Decode the track and artist steps of a {step: data} dictionary into {step: Page}"""
+    decoder = Decoder()
+    pages = {}
+    for step, data in steps.items():
+        if data is None:
+            continue
+        if step in TRACK_STEPS:
+            pages[step] = decoder.tracks(data, TRACK_STEPS[step])
+        elif step in ARTIST_STEPS:
+            pages[step] = decoder.artists(data)
+    return pages
+
+@timed('model_read')
+def _read_model_steps(filename, version):
+    # Only the model steps are decoded; the raw objects are dropped after decoding
+    wanted = list(TRACK_STEPS) + ARTIST_STEPS
+    index = dataset_store.load_index(filename, version)
+    if index is not None:
+        return {step: dataset_store.read_entry(filename, *index[step]).get('data')
+                for step in wanted if step in index}
+    with open(filename, 'r') as f:
+        data = json.load(f)
+    steps = {}
+    for entry in data:
+        if entry.get('step') in wanted:
+            steps.setdefault(entry.get('step'), entry.get('data'))
+    return steps
+
+def load_model(filename):
+    """Return the {step: Page} model of a dataset file, or None if it is missing"""
+    if not filename:
+        return None
+    version = dataset_store.file_version(filename)
+    if version is None:
+        return None
+    key = os.path.abspath(filename)
+    cached = model_cache.get(key, validate=lambda entry: entry[0] == version)
+    if cached is not None:
+        return cached[1]
+    pages = decode_steps(_read_model_steps(filename, version))
+    model_cache.set(key, (version, pages))
+    return pages
+
+def load_page(filename, step):
+    """Return one step of a dataset's model, or None if the file or step is missing"""
+    model = load_model(filename)
+    return model.get(step) if model is not None else None
@@ -0,0 +1,299 @@
+"""
+Scheduling of outbound Spotify calls.
+
+Every call made through spotify_client (sync or async) first takes a token
+from one process-wide token bucket, refilled at SPOTIFY_RATE_LIMIT calls per
+second up to SPOTIFY_BURST, so concurrent requests no longer reach Spotify
+as uncoordinated bursts. When Spotify answers 429, the Retry-After pause
+applies to the whole bucket, not just to the call that got it.
+
+Calls belong to one of two lanes. Interactive calls (made while serving a
+request, the default) are always served first; background calls (such as
+the startup warm-up, marked with `with background():`) only get a token
+while no interactive call is waiting for one.
+
+BatchCoalescer merges the audio-feature lookups of concurrent requests:
+ids requested within SPOTIFY_COALESCE_WINDOW_MS of each other share
+batches of up to 50, and an id already queued or in flight is not requested
+again, so each unique id is fetched once per window. Each lane queues its
+ids separately and its batches are sent in that lane, so an interactive
+lookup never waits behind a background batch; an id an interactive caller
+asks for while it is still queued in the background lane moves to the
+interactive queue.
+
+The ratelimit and backoff packages are not used. ratelimit (2.2.1) limits
+calls to one decorated function per fixed window. It has no lanes, no
+coroutine support, and no way to pause every caller on a Retry-After.
+backoff (1.11.1) waits according to its own generator: its expo, fibo and
+constant waits cannot follow a response's Retry-After, and its waits
+apply to one call, not to the shared bucket. spotify_client keeps its own
+retry loop for that reason.
+"""
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+# Calls per second (0 disables the rate limit) and the burst allowed above it
+SPOTIFY_RATE_LIMIT = float(os.getenv('SPOTIFY_RATE_LIMIT', 10))
+SPOTIFY_BURST = int(os.getenv('SPOTIFY_BURST', 20))
+# How long the first id of a batch waits for other requests' ids to join it
+SPOTIFY_COALESCE_WINDOW_MS = float(os.getenv('SPOTIFY_COALESCE_WINDOW_MS', 10))
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+LANES = (INTERACTIVE, BACKGROUND)
+
+_lane = contextvars.ContextVar('spotify_lane', default=INTERACTIVE)
+
+@contextmanager
+def background():
+    """Run the Spotify calls made inside the block in the background lane"""
+    token = _lane.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+def current_lane():
+    return _lane.get()
+
+class OutboundScheduler:
+    """Token bucket with an interactive and a background lane"""
+
+    def __init__(self, rate=SPOTIFY_RATE_LIMIT, burst=SPOTIFY_BURST):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = {lane: 0 for lane in LANES}
+        self._lock = threading.Lock()
+        self._stats = {lane: {"calls": 0, "waited": 0, "wait_seconds": 0.0} for lane in LANES}
+        self.pauses = 0
+
+    def _take(self, lane):
+        # Take a token for lane; returns 0, or the seconds to wait before trying again
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if not self.rate:
+                return 0.0
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if lane == BACKGROUND and self._waiting[INTERACTIVE]:
+                return 1 / self.rate
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def _enter(self, lane):
+        with self._lock:
+            self._waiting[lane] += 1
+
+    def _leave(self, lane, waited):
+        with self._lock:
+            self._waiting[lane] -= 1
+            entry = self._stats[lane]
+            entry["calls"] += 1
+            if waited > 0:
+                entry["waited"] += 1
+                entry["wait_seconds"] += waited
+
+    def acquire(self, lane=None):
+        """Block until a call in lane (default: the current lane) may be made"""
+        lane = lane or current_lane()
+        started = time.monotonic()
+        waited = False
+        self._enter(lane)
+        try:
+            while True:
+                delay = self._take(lane)
+                if not delay:
+                    break
+                time.sleep(delay)
+                waited = True
+        finally:
+            self._leave(lane, time.monotonic() - started if waited else 0.0)
+
+    async def acquire_async(self, lane=None):
+        """acquire for the event loop"""
+        lane = lane or current_lane()
+        started = time.monotonic()
+        waited = False
+        self._enter(lane)
+        try:
+            while True:
+                delay = self._take(lane)
+                if not delay:
+                    break
+                await asyncio.sleep(delay)
+                waited = True
+        finally:
+            self._leave(lane, time.monotonic() - started if waited else 0.0)
+
+    def pause(self, seconds):
+        """Hold every call back for `seconds` (Spotify's Retry-After)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.pauses += 1
+
+    def stats(self):
+        """Return per-lane call counts and time spent waiting for a token"""
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "pauses": self.pauses,
+                "lanes": {
+                    lane: dict(entry, wait_seconds=round(entry["wait_seconds"], 4), waiting=self._waiting[lane])
+                    for lane, entry in self._stats.items()
+                }
+            }
+
+class BatchCoalescer:
+    """
+    Shares batched lookups between concurrent callers.
+
+    fetch_batch(ids) and fetch_batch_async(ids) take up to batch_size ids and
+    return their results in the same order.
+    """
+
+    def __init__(self, fetch_batch, fetch_batch_async=None, batch_size=50, window=SPOTIFY_COALESCE_WINDOW_MS / 1000):
+        self.fetch_batch = fetch_batch
+        self.fetch_batch_async = fetch_batch_async
+        self.batch_size = batch_size
+        self.window = window
+        self._lock = threading.Lock()
+        self._futures = {}
+        # Ids waiting for a batch, per lane, in request order (dicts as ordered sets)
+        self._queued = {lane: {} for lane in LANES}
+        self._flush_pending = {lane: False for lane in LANES}
+        self._tasks = set()
+        self.requested_ids = 0
+        self.shared_ids = 0
+        self.upgraded_ids = 0
+        self.batches = 0
+
+    def _claim(self, ids, lane):
+        """
+        Queue the ids nobody has asked for yet in lane's queue. Returns (a
+        future per id, the full batches this caller must send, whether it
+        must send the rest of lane's queue after the window).
+        """
+        futures = []
+        full = []
+        with self._lock:
+            queue = self._queued[lane]
+            for item in ids:
+                self.requested_ids += 1
+                future = self._futures.get(item)
+                if future is None:
+                    future = self._futures[item] = Future()
+                    queue[item] = None
+                else:
+                    self.shared_ids += 1
+                    if lane == INTERACTIVE and item in self._queued[BACKGROUND]:
+                        # Not sent yet: send it with the interactive batch instead
+                        del self._queued[BACKGROUND][item]
+                        queue[item] = None
+                        self.upgraded_ids += 1
+                if len(queue) >= self.batch_size:
+                    full.append(list(queue))
+                    queue.clear()
+                futures.append(future)
+            leader = bool(queue) and not self._flush_pending[lane]
+            if leader:
+                self._flush_pending[lane] = True
+        return futures, full, leader
+
+    def _take_queued(self, lane):
+        with self._lock:
+            queued = list(self._queued[lane])
+            self._queued[lane].clear()
+            self._flush_pending[lane] = False
+        return [queued[i:i+self.batch_size] for i in range(0, len(queued), self.batch_size)]
+
+    def _started(self, batch):
+        with self._lock:
+            self.batches += 1
+            return [self._futures[item] for item in batch]
+
+    def _finish(self, batch, futures, results=None, error=None):
+        with self._lock:
+            for item in batch:
+                self._futures.pop(item, None)
+        # Ids missing from a short result get None
+        results = list(results or [])[:len(futures)]
+        for future, value in zip(futures, results + [None] * (len(futures) - len(results))):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(value)
+
+    def _run(self, batch):
+        futures = self._started(batch)
+        try:
+            results = self.fetch_batch(batch)
+        except Exception as e:
+            self._finish(batch, futures, error=e)
+        else:
+            self._finish(batch, futures, results)
+
+    async def _run_async(self, batch):
+        futures = self._started(batch)
+        try:
+            results = await self.fetch_batch_async(batch)
+        except Exception as e:
+            self._finish(batch, futures, error=e)
+        else:
+            self._finish(batch, futures, results)
+
+    def fetch(self, ids):
+        """Return the results for unique ids, in order, sharing batches with concurrent callers"""
+        lane = current_lane()
+        futures, full, leader = self._claim(ids, lane)
+        for batch in full:
+            self._run(batch)
+        if leader:
+            time.sleep(self.window)
+            for batch in self._take_queued(lane):
+                self._run(batch)
+        return [future.result() for future in futures]
+
+    async def _flush_async(self, lane):
+        await asyncio.sleep(self.window)
+        await asyncio.gather(*(self._run_async(batch) for batch in self._take_queued(lane)))
+
+    def _spawn(self, coroutine):
+        # Batches run as tasks of their own so a cancelled caller cannot strand the others
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def fetch_async(self, ids):
+        """fetch for the event loop"""
+        lane = current_lane()
+        futures, full, leader = self._claim(ids, lane)
+        # Tasks copy the caller's context, so their calls are made in its lane
+        for batch in full:
+            self._spawn(self._run_async(batch))
+        if leader:
+            self._spawn(self._flush_async(lane))
+        # shield: a cancelled caller must not cancel the futures other callers share
+        return [await asyncio.shield(asyncio.wrap_future(future)) for future in futures]
+
+    def stats(self):
+        """Return the ids requested, those shared or moved to the interactive queue, and the batches sent"""
+        with self._lock:
+            return {"requested_ids": self.requested_ids, "shared_ids": self.shared_ids,
+                    "upgraded_ids": self.upgraded_ids, "batches": self.batches}
+
+spotify_scheduler = OutboundScheduler()
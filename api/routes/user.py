@@ -2,12 +2,24 @@ from flask import Blueprint, jsonify, request as flask_request
 import os
 import json
 from utils import get_from_file
+from models import (
+    load_page, parse_fields, project_tracks, project_artists,
+    TRACK_FIELDS, ARTIST_FIELDS, RECENTLY_PLAYED_FIELDS
+)
+import conditional
+from singleflight import single_flight
+import compression
 
 # Create a Blueprint for user routes
 user_bp = Blueprint('user', __name__)
+# gzip responses for clients that accept it (installed first: the encoding is part of the ETag)
+compression.install(user_bp)
+# Answer repeat requests for an unchanged dataset with 304 Not Modified
+conditional.install(user_bp)
 
 # 1. Get current user profile
 @user_bp.route("/profile", methods=["GET"])
+@single_flight
 def get_user_profile():
     username = flask_request.args.get('username')
     filename = flask_request.args.get('filename')
@@ -20,6 +32,7 @@ def get_user_profile():
 
 # 2. Recently played tracks (customizable limit)
 @user_bp.route("/recently_played", methods=["GET"])
+@single_flight
 def get_recently_played():
     username = flask_request.args.get('username')
     filename = flask_request.args.get('filename')
@@ -28,35 +41,18 @@ def get_recently_played():
         return jsonify({"error": "Missing username or filename"}), 400
     if not (1 <= limit <= 50):
         return jsonify({"error": "Limit must be between 1 and 50"}), 400
-    result = get_from_file(f"data/{filename}", "recently_played")
+    try:
+        fields = parse_fields(flask_request.args.get('fields'), RECENTLY_PLAYED_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    result = load_page(f"data/{filename}", "recently_played")
     if result is None:
         return jsonify({"error": "Data not found or file missing"}), 404
-    # result['items'] is the list of tracks
-    result_copy = dict(result)
-    # Filter out only the fields we want from each track
-    filtered_items = []
-    for item in result_copy.get('items', []):
-        track = item.get('track', {})
-        album_data = track.get('album', {})
-        filtered_track = {
-            'name': track.get('name'),
-            'popularity': track.get('popularity'),
-            'artists': [artist.get('name') for artist in track.get('artists', [])],
-            'album': {
-                'name': album_data.get('name'),
-                'images': album_data.get('images', [])
-            },
-            'duration_ms': track.get('duration_ms'),
-            'played_at': item.get('played_at')
-        }
-        filtered_items.append({'track': filtered_track})
-    
-    result_copy['items'] = filtered_items
-    result_copy['items'] = result_copy.get('items', [])[:limit]
-    return jsonify(result_copy)
+    return jsonify(project_tracks(result, limit, fields))
 
 # 3. Top artists (customizable term and limit)
 @user_bp.route("/top_artists", methods=["GET"])
+@single_flight
 def get_top_artists():
     username = flask_request.args.get('username')
     filename = flask_request.args.get('filename')
@@ -68,27 +64,19 @@ def get_top_artists():
         return jsonify({"error": "Invalid time_range"}), 400
     if not (1 <= limit <= 50):
         return jsonify({"error": "Limit must be between 1 and 50"}), 400
+    try:
+        fields = parse_fields(flask_request.args.get('fields'), ARTIST_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     step = f"top_artists_{time_range.split('_')[0]}" if time_range != 'long_term' else "top_artists_long"
-    result = get_from_file(f"data/{filename}", step)
+    result = load_page(f"data/{filename}", step)
     if result is None:
         return jsonify({"error": "Data not found or file missing"}), 404
-    result_copy = dict(result)
-    filtered_item = []
-    for item in result_copy.get('items', []):
-        filtered_artist = {
-            'name': item.get('name'),
-            'popularity': item.get('popularity'),
-            'images': item.get('images'),
-            'genres': item.get('genres'),
-            'total_followers': item.get('followers').get('total')
-        }
-        filtered_item.append(filtered_artist)
-    result_copy['items'] = filtered_item
-    result_copy['items'] = result_copy.get('items', [])[:limit]
-    return jsonify(result_copy)
+    return jsonify(project_artists(result, limit, fields))
 
 # 4. Top tracks (customizable term and limit)
 @user_bp.route("/top_tracks", methods=["GET"])
+@single_flight
 def get_top_tracks():
     username = flask_request.args.get('username')
     filename = flask_request.args.get('filename')
@@ -100,34 +88,19 @@ def get_top_tracks():
         return jsonify({"error": "Invalid time_range"}), 400
     if not (1 <= limit <= 50):
         return jsonify({"error": "Limit must be between 1 and 50"}), 400
+    try:
+        fields = parse_fields(flask_request.args.get('fields'), TRACK_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     step = f"top_tracks_{time_range.split('_')[0]}" if time_range != 'long_term' else "top_tracks_long"
-    result = get_from_file(f"data/{filename}", step)
+    result = load_page(f"data/{filename}", step)
     if result is None:
         return jsonify({"error": "Data not found or file missing"}), 404
-    result_copy = dict(result)
-    filtered_items = []
-    for item in result_copy.get('items', []):
-        album_data = item.get('album', {})
-        filtered_track = {
-            'name': item.get('name'),
-            'id': item.get('id'),
-            'popularity': item.get('popularity'),
-            'artists': [artist.get('name') for artist in item.get('artists', [])],
-            'album': {
-                'name': album_data.get('name'),
-                'images': album_data.get('images', [])
-            },
-            'duration_ms': item.get('duration_ms'),
-            'played_at': item.get('played_at')
-        }
-        filtered_items.append({'track': filtered_track})
-    
-    result_copy['items'] = filtered_items
-    result_copy['items'] = result_copy.get('items', [])[:limit]
-    return jsonify(result_copy)
+    return jsonify(project_tracks(result, limit, fields))
 
 # 5. Saved tracks (customizable limit)
 @user_bp.route("/saved_tracks", methods=["GET"])
+@single_flight
 def get_saved_tracks():
     username = flask_request.args.get('username')
     filename = flask_request.args.get('filename')
@@ -136,28 +109,11 @@ def get_saved_tracks():
         return jsonify({"error": "Missing username or filename"}), 400
     if not (1 <= limit <= 50):
         return jsonify({"error": "Limit must be between 1 and 50"}), 400
-    result = get_from_file(f"data/{filename}", "saved_tracks")
+    try:
+        fields = parse_fields(flask_request.args.get('fields'), TRACK_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    result = load_page(f"data/{filename}", "saved_tracks")
     if result is None:
         return jsonify({"error": "Data not found or file missing"}), 404
-    filtered_items = []
-    result_copy = dict(result)
-    for item in result_copy.get('items', []):
-        track = item.get('track', {})
-        album_data = track.get('album', {})
-        filtered_track = {
-            'name': track.get('name'),
-            'id': track.get('id'),
-            'popularity': track.get('popularity'),
-            'artists': [artist.get('name') for artist in track.get('artists', [])],
-            'album': {
-                'name': album_data.get('name'),
-                'images': album_data.get('images', [])
-            },
-            'duration_ms': track.get('duration_ms'),
-            'played_at': item.get('played_at')
-        }
-        filtered_items.append({'track': filtered_track})
-    
-    result_copy['items'] = filtered_items
-    result_copy['items'] = result_copy.get('items', [])[:limit]
-    return jsonify(result_copy)
\ No newline at end of file
+    return jsonify(project_tracks(result, limit, fields))
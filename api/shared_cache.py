@@ -0,0 +1,209 @@
+"""
+Optional Redis tier shared by every worker process.
+
+The in-process caches (dataset_cache, model_cache, materialized_cache and the
+audio feature store's memory LRU) are per worker, so each worker of a
+multi-process deployment starts cold and repeats the same work. With
+REDIS_URL set, audio features, materialized analysis results and (with
+SHARED_CACHE_STEPS=1) parsed dataset steps are also stored in Redis, behind
+those in-process caches (which stay the L1): a worker that misses locally
+reads what another worker has already fetched or parsed.
+
+Keys carry the cache format and, for dataset data, the dataset's
+(mtime_ns, size) version, so a changed dataset is never served from old
+entries; these simply expire after SHARED_CACHE_TTL. Batch lookups (audio
+features by track id) are a single MGET and batch stores a single pipeline.
+Redis errors are counted and treated as misses, so the tier never fails a
+request, and after one Redis is skipped for SHARED_CACHE_RETRY seconds
+rather than slowing every request down by a timeout.
+
+REDIS_URL=memory:// uses MemoryRedis, an in-process stand-in for tests and
+benchmarks.
+"""
+import os
+import json
+import time
+import threading
+
+REDIS_URL = os.getenv('REDIS_URL')
+# Seconds before shared dataset steps and analysis results expire (0: never)
+SHARED_CACHE_TTL = int(os.getenv('SHARED_CACHE_TTL', 24 * 3600))
+SHARED_CACHE_PREFIX = os.getenv('SHARED_CACHE_PREFIX', 'wrapped')
+# Socket timeout of Redis calls, in seconds
+SHARED_CACHE_TIMEOUT = float(os.getenv('SHARED_CACHE_TIMEOUT', 0.5))
+# Seconds Redis is left alone after a failed call
+SHARED_CACHE_RETRY = float(os.getenv('SHARED_CACHE_RETRY', 30))
+# Set SHARED_CACHE_STEPS=1 to share parsed dataset steps too (see step_cache)
+SHARED_CACHE_STEPS = os.getenv('SHARED_CACHE_STEPS', '0') == '1'
+# Part of every key; bump it when the stored layout changes
+CACHE_FORMAT = 1
+
+# Returned by get() for keys that are not stored (None is a valid cached value)
+MISSING = object()
+
+class MemoryRedis:
+    """In-process stand-in for the few Redis commands SharedCache uses"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        # Caller holds the lock
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return entry[0] if entry is not None else None
+
+    def mget(self, keys):
+        with self._lock:
+            return [entry[0] if entry is not None else None for entry in map(self._live, keys)]
+
+    def set(self, key, value, ex=None):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def ping(self):
+        return True
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+        return True
+
+    def pipeline(self, transaction=True):
+        return _MemoryPipeline(self)
+
+class _MemoryPipeline:
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def set(self, key, value, ex=None):
+        self._commands.append(lambda: self._client.set(key, value, ex=ex))
+        return self
+
+    def execute(self):
+        results = [command() for command in self._commands]
+        self._commands = []
+        return results
+
+def make_client(url):
+    """Return a Redis client for a URL (memory:// for MemoryRedis), or None without one"""
+    if not url:
+        return None
+    if url.startswith('memory://'):
+        return MemoryRedis()
+    import redis
+    return redis.Redis.from_url(url, socket_timeout=SHARED_CACHE_TIMEOUT, socket_connect_timeout=SHARED_CACHE_TIMEOUT)
+
+class SharedCache:
+    """JSON values in Redis under versioned keys; without a client every lookup misses"""
+
+    def __init__(self, client=None, prefix=SHARED_CACHE_PREFIX, ttl=SHARED_CACHE_TTL, retry=SHARED_CACHE_RETRY):
+        self.client = client
+        self.prefix = f"{prefix}:{CACHE_FORMAT}"
+        self.ttl = ttl
+        self.retry = retry
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.errors = 0
+
+    @property
+    def enabled(self):
+        return self.client is not None
+
+    def key(self, kind, *parts):
+        return ':'.join([self.prefix, kind, *map(str, parts)])
+
+    def dataset_key(self, kind, filename, version, *parts):
+        """Key for data derived from one version of a dataset file"""
+        return self.key(kind, filename, *version, *parts)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def _available(self):
+        if self.client is None:
+            return False
+        with self._lock:
+            return time.monotonic() >= self._down_until
+
+    def _failed(self, action, error):
+        with self._lock:
+            self.errors += 1
+            self._down_until = time.monotonic() + self.retry
+        print(f"Shared cache {action} failed:", str(error))
+
+    def get(self, key, default=MISSING):
+        """Return the value stored under key, or default"""
+        return self.get_many([key], default)[0]
+
+    def get_many(self, keys, default=MISSING):
+        """Return the values stored under keys (default for missing ones) with one MGET"""
+        if not keys or not self._available():
+            return [default] * len(keys)
+        try:
+            raw = self.client.mget(keys)
+        except Exception as e:
+            self._failed("read", e)
+            return [default] * len(keys)
+        values = [default if value is None else json.loads(value) for value in raw]
+        found = sum(value is not None for value in raw)
+        self._count('hits', found)
+        self._count('misses', len(keys) - found)
+        return values
+
+    def set(self, key, value, ttl=None):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, values, ttl=None):
+        """Store {key: value} with one pipeline; ttl defaults to the cache's (0: no expiry)"""
+        if not values or not self._available():
+            return
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for key, value in values.items():
+                pipeline.set(key, json.dumps(value), ex=ttl or None)
+            pipeline.execute()
+        except Exception as e:
+            self._failed("write", e)
+            return
+        self._count('sets', len(values))
+
+    def stats(self):
+        """Return hit/miss/set/error counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "sets": self.sets,
+                "errors": self.errors,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+shared_cache = SharedCache(make_client(REDIS_URL))
+# Parsed dataset steps are only shared on request: every worker still needs the
+# dataset file for its version, and decoding the steps from Redis is no faster
+# than parsing that file (each step is decoded separately)
+step_cache = SharedCache(shared_cache.client if SHARED_CACHE_STEPS else None)
@@ -0,0 +1,128 @@
+"""
+Single-flight collapsing of identical in-flight requests.
+
+A reload of the Shiny app sends the same analysis requests several times at
+once, and each used to parse the dataset and call Spotify on its own. With
+single flight, the first request for a route and query computes the
+response; identical requests that arrive while it is running wait for it
+and get a copy of its response instead of computing their own. Nothing is
+kept once the first request finishes, so this is not a cache: a request
+that arrives afterwards computes again (and is usually answered from the
+dataset and audio-feature caches).
+
+Requests are identical when they have the same endpoint, the same query
+parameters, in any order, and the same version of the dataset they name: a
+request that arrives after /login rewrote the dataset does not get the
+response computed from the previous one. What is shared is the view's response before the
+after_request hooks, so each request still gets its own ETag, gzip encoding
+and CORS headers.
+"""
+import os
+import asyncio
+import threading
+from functools import wraps
+from concurrent.futures import Future
+from flask import current_app, request
+
+from dataset_store import file_version
+
+# Set SINGLE_FLIGHT=0 to compute every request on its own
+SINGLE_FLIGHT = os.getenv('SINGLE_FLIGHT', '1') == '1'
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers with the same key share its result"""
+
+    def __init__(self, enabled=SINGLE_FLIGHT):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {}
+        self._tasks = set()
+
+    def _join(self, key, name):
+        # Returns (future, whether the caller must run the call)
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            entry = self._stats.setdefault(name, {"executed": 0, "collapsed": 0})
+            entry["executed" if leader else "collapsed"] += 1
+        return future, leader
+
+    def _settle(self, key, future, result=None, error=None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, function, name=None):
+        """Return function(), or the result of the identical call already running"""
+        if not self.enabled:
+            return function()
+        future, leader = self._join(key, name)
+        if not leader:
+            return future.result()
+        try:
+            result = function()
+        except BaseException as e:
+            self._settle(key, future, error=e)
+            raise
+        self._settle(key, future, result)
+        return result
+
+    async def do_async(self, key, coroutine_function, name=None):
+        """do for the event loop: returns await coroutine_function() or the running call's result"""
+        if not self.enabled:
+            return await coroutine_function()
+        future, leader = self._join(key, name)
+        if leader:
+            # A task of its own, so a cancelled first caller does not fail the others
+            task = asyncio.ensure_future(coroutine_function())
+            self._tasks.add(task)
+            task.add_done_callback(lambda task: self._finish_task(key, future, task))
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def _finish_task(self, key, future, task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            self._settle(key, future, error=asyncio.CancelledError())
+        elif task.exception() is not None:
+            self._settle(key, future, error=task.exception())
+        else:
+            self._settle(key, future, task.result())
+
+    def stats(self):
+        """Return per-endpoint counts of computed and collapsed requests"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "in_flight": len(self._calls),
+                "collapsed": sum(entry["collapsed"] for entry in self._stats.values()),
+                "endpoints": {name: dict(entry) for name, entry in self._stats.items()}
+            }
+
+flights = SingleFlight()
+
+def request_key(endpoint, query_items):
+    """Single-flight key of a request: its endpoint, query parameters in any order and dataset version"""
+    query_items = tuple(sorted(query_items))
+    filename = dict(query_items).get('filename')
+    return (endpoint, query_items, file_version(f"data/{filename}") if filename else None)
+
+def single_flight(view):
+    """Collapse identical concurrent requests to a Flask view into one call"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request_key(request.endpoint, request.args.items(multi=True))
+
+        def respond():
+            # Waiters get their own copy of the response: hooks after the view modify it
+            response = current_app.make_response(view(*args, **kwargs))
+            return response.get_data(), response.status_code, list(response.headers.items())
+
+        body, status, headers = flights.do(key, respond, request.endpoint)
+        return current_app.response_class(body, status=status, headers=headers)
+    return wrapper
@@ -0,0 +1,221 @@
+"""
+Shared HTTP client for outbound Spotify Web API calls.
+
+One pooled requests.Session is reused for every call, so connections (and
+their TLS handshakes) are kept alive between requests. Calls get connect/read
+timeouts and are retried with exponential backoff on 429 and 5xx responses,
+honouring Retry-After when Spotify sends it. Per-endpoint latency and status
+counts are recorded and available from stats(). Every attempt first waits
+for the outbound scheduler (outbound.py), and a 429 pauses the scheduler for
+its Retry-After.
+
+AsyncSpotifyClient is the aiohttp equivalent used by the async server
+(async_server.py), with the same retry policy and statistics.
+"""
+import os
+import time
+import asyncio
+import threading
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+from outbound import spotify_scheduler
+import metrics
+
+load_dotenv()
+
+SPOTIFY_API_BASE = os.getenv('SPOTIFY_API_BASE', 'https://api.spotify.com/v1')
+SPOTIFY_POOL_SIZE = int(os.getenv('SPOTIFY_POOL_SIZE', 10))
+SPOTIFY_CONNECT_TIMEOUT = float(os.getenv('SPOTIFY_CONNECT_TIMEOUT', 3.05))
+SPOTIFY_READ_TIMEOUT = float(os.getenv('SPOTIFY_READ_TIMEOUT', 10))
+SPOTIFY_MAX_RETRIES = int(os.getenv('SPOTIFY_MAX_RETRIES', 3))
+SPOTIFY_BACKOFF_FACTOR = float(os.getenv('SPOTIFY_BACKOFF_FACTOR', 0.5))
+# Longest Retry-After we are willing to sleep for inside a request
+SPOTIFY_MAX_RETRY_AFTER = float(os.getenv('SPOTIFY_MAX_RETRY_AFTER', 10))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+SPOTIFY_SECONDS = metrics.Histogram('wrapped_spotify_request_duration_seconds',
+                                    'Latency of outbound Spotify calls, per endpoint', ['endpoint'])
+SPOTIFY_REQUESTS = metrics.Counter('wrapped_spotify_requests_total',
+                                   'Outbound Spotify calls per endpoint and status (every attempt)', ['endpoint', 'status'])
+
+class _InstrumentedClient:
+    """Retry policy and per-endpoint statistics shared by the sync and async clients"""
+
+    def __init__(self, token=None, base_url=SPOTIFY_API_BASE, pool_size=SPOTIFY_POOL_SIZE,
+                 connect_timeout=SPOTIFY_CONNECT_TIMEOUT, read_timeout=SPOTIFY_READ_TIMEOUT,
+                 max_retries=SPOTIFY_MAX_RETRIES, backoff_factor=SPOTIFY_BACKOFF_FACTOR,
+                 scheduler=spotify_scheduler):
+        self.token = token if token is not None else os.getenv('token')
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.scheduler = scheduler
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _record(self, endpoint, status, elapsed):
+        SPOTIFY_SECONDS.observe(elapsed, endpoint)
+        SPOTIFY_REQUESTS.inc(endpoint, str(status))
+        with self._lock:
+            entry = self._stats.setdefault(endpoint, {
+                "calls": 0, "retries": 0, "total_seconds": 0.0, "max_seconds": 0.0, "statuses": {}
+            })
+            entry["calls"] += 1
+            entry["total_seconds"] += elapsed
+            entry["max_seconds"] = max(entry["max_seconds"], elapsed)
+            entry["statuses"][str(status)] = entry["statuses"].get(str(status), 0) + 1
+
+    def _retry_delay(self, response, attempt):
+        # Retry-After is in seconds; otherwise back off exponentially
+        if response is not None and response.headers.get('Retry-After'):
+            try:
+                delay = min(float(response.headers['Retry-After']), SPOTIFY_MAX_RETRY_AFTER)
+            except ValueError:
+                pass
+            else:
+                # Spotify throttles the app, not the call: hold every call back
+                self.scheduler.pause(delay)
+                return delay
+        return self.backoff_factor * (2 ** attempt)
+
+    def _count_retry(self, endpoint):
+        with self._lock:
+            self._stats[endpoint]["retries"] += 1
+
+    def stats(self):
+        """Return per-endpoint call counts, statuses and latency"""
+        with self._lock:
+            return {
+                endpoint: dict(
+                    entry,
+                    statuses=dict(entry["statuses"]),
+                    avg_seconds=round(entry["total_seconds"] / entry["calls"], 4) if entry["calls"] else 0.0
+                )
+                for endpoint, entry in self._stats.items()
+            }
+
+class SpotifyClient(_InstrumentedClient):
+    """Pooled, instrumented client for the Spotify Web API"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({"user-agent": "Mozilla/5.0"})
+
+    def get(self, endpoint, params=None):
+        """
+        GET {base_url}/{endpoint} and return the decoded JSON body.
+
+        Raises requests.HTTPError for error responses that are still failing
+        after the retries, and requests.RequestException for network errors.
+        """
+        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        headers = {"authorization": f"Bearer {self.token}"}
+        attempt = 0
+        while True:
+            self.scheduler.acquire()
+            started = time.perf_counter()
+            response = None
+            try:
+                response = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+                status = response.status_code
+            except (requests.ConnectionError, requests.Timeout):
+                status = 'error'
+                if attempt >= self.max_retries:
+                    self._record(endpoint, status, time.perf_counter() - started)
+                    raise
+            self._record(endpoint, status, time.perf_counter() - started)
+            if status != 'error' and (status not in RETRY_STATUSES or attempt >= self.max_retries):
+                response.raise_for_status()
+                return response.json()
+            self._count_retry(endpoint)
+            time.sleep(self._retry_delay(response, attempt))
+            attempt += 1
+
+class AsyncSpotifyClient(_InstrumentedClient):
+    """
+    aiohttp counterpart of SpotifyClient for use on an event loop.
+
+    The session (and its connection pool) is created on first use, on the
+    running loop; call close() before the loop shuts down.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = None
+
+    def _session(self):
+        if self.session is None or self.session.closed:
+            connect_timeout, read_timeout = self.timeout
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout),
+                headers={"user-agent": "Mozilla/5.0"}
+            )
+        return self.session
+
+    async def get(self, endpoint, params=None):
+        """
+        GET {base_url}/{endpoint} and return the decoded JSON body.
+
+        Raises aiohttp.ClientResponseError for error responses that are still
+        failing after the retries, and aiohttp.ClientError or
+        asyncio.TimeoutError for network errors.
+        """
+        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        headers = {"authorization": f"Bearer {self.token}"}
+        attempt = 0
+        while True:
+            await self.scheduler.acquire_async()
+            started = time.perf_counter()
+            try:
+                async with self._session().get(url, params=params, headers=headers) as response:
+                    status = response.status
+                    if status not in RETRY_STATUSES or attempt >= self.max_retries:
+                        self._record(endpoint, status, time.perf_counter() - started)
+                        response.raise_for_status()
+                        return await response.json()
+                    delay = self._retry_delay(response, attempt)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                status = 'error'
+                delay = self._retry_delay(None, attempt)
+                if attempt >= self.max_retries:
+                    self._record(endpoint, status, time.perf_counter() - started)
+                    raise
+            self._record(endpoint, status, time.perf_counter() - started)
+            self._count_retry(endpoint)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+def upstream_error(error):
+    """
+    Return (body, status) of the Spotify error response behind a failed call,
+    or None for other errors. The body is Spotify's own JSON error when it is
+    available, else one of the same shape ({"error": {"status", "message"}}).
+    """
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        response = error.response
+        try:
+            return response.json(), response.status_code
+        except ValueError:
+            return {"error": {"status": response.status_code, "message": response.reason}}, response.status_code
+    if isinstance(error, aiohttp.ClientResponseError):
+        return {"error": {"status": error.status, "message": error.message}}, error.status
+    return None
+
+spotify_client = SpotifyClient()
+async_spotify_client = AsyncSpotifyClient()
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Routes read datasets from data/ relative to the api directory
+os.chdir(API_DIR)
+sys.path.insert(0, API_DIR)
+# The test client must not warm the caches (or call Spotify) in the background
+os.environ["WARMUP"] = "0"
+
+@pytest.fixture(scope="session")
+def client():
+    from main import app
+    return app.test_client()
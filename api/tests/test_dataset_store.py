@@ -0,0 +1,55 @@
+import json
+import os
+
+import dataset_store
+from dataset_store import StepWriter, recover_partial, load_metadata
+
+def _killed_writer(filename, steps):
+    # A writer whose process died after these appends, before close()
+    writer = StepWriter(filename)
+    for step, data, fetched_at in steps:
+        writer.append(step, data, fetched_at)
+    writer._file.close()
+    return writer
+
+def _steps(filename):
+    with open(filename) as f:
+        return {entry["step"]: entry["data"] for entry in json.load(f)}
+
+def test_recover_partial_commits_completed_steps(tmp_path):
+    filename = str(tmp_path / "u_spotify.json")
+    with StepWriter(filename) as writer:
+        writer.append("current_user", {"id": "u"}, 100)
+        writer.append("top_tracks_short", {"old": 1}, 100)
+        writer.append("saved_tracks", {"old": 2}, 100)
+    _killed_writer(filename, [("current_user", {"id": "u"}, 200), ("top_tracks_short", {"new": 1}, 300)])
+
+    assert sorted(recover_partial(filename)) == ["current_user", "top_tracks_short"]
+    # Steps the partial file does not hold are kept from the current dataset
+    assert _steps(filename) == {"current_user": {"id": "u"}, "top_tracks_short": {"new": 1},
+                                "saved_tracks": {"old": 2}}
+    meta = load_metadata(filename)
+    assert meta["top_tracks_short"]["fetched_at"] == 300
+    assert meta["saved_tracks"]["fetched_at"] == 100
+    assert sorted(os.listdir(tmp_path)) == ["u_spotify.json", "u_spotify.json.idx"]
+    assert recover_partial(filename) == []
+
+def test_recover_partial_drops_torn_entry(tmp_path):
+    filename = str(tmp_path / "u_spotify.json")
+    writer = _killed_writer(filename, [("current_user", {"id": "u"}, 200)])
+    # Killed while appending a second entry, before the part index was rewritten
+    with open(writer.tmp_path, "r+b") as f:
+        f.seek(writer._end)
+        f.write(b',\n{"step": "saved_tr')
+    os.remove(dataset_store.index_path(writer.tmp_path))
+
+    assert recover_partial(filename) == ["current_user"]
+    assert _steps(filename) == {"current_user": {"id": "u"}}
+    # Without metadata the step counts as stale
+    assert load_metadata(filename)["current_user"]["fetched_at"] == 0
+
+def test_recover_partial_without_steps(tmp_path):
+    filename = str(tmp_path / "u_spotify.json")
+    _killed_writer(filename, [])
+    assert recover_partial(filename) == []
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+import data.get_data as get_data
+from dataset_store import StepWriter
+from mock_spotify import MockSpotify, start_in_thread
+from benchmarks.datasets import sample_datasets
+
+@pytest.fixture
+def login(tmp_path, monkeypatch):
+    """Run logins against the mock API, writing datasets under a temporary data/"""
+    server, base = start_in_thread(MockSpotify(sample_datasets()[0]))
+    (tmp_path / "data").mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(get_data, "SPOTIFY_API_BASE", base)
+    monkeypatch.setattr(get_data, "access_token", "mock")
+    monkeypatch.setattr(get_data, "RECENTLY_PLAYED_HISTORY", False)
+    yield get_data.fetch_spotify_data_sequence
+    server.shutdown()
+    server.server_close()
+
+def _steps(filename):
+    with open(filename) as f:
+        return {entry["step"] for entry in json.load(f)}
+
+def test_failed_login_keeps_previous_steps(login, monkeypatch):
+    result = login()
+    filename = f"data/{result['json_file']}"
+    before = _steps(filename)
+
+    # Every step is refetched, and writing the second fetched step fails
+    append = StepWriter.append
+    calls = []
+
+    def failing_append(self, step, data, fetched_at=None):
+        calls.append(step)
+        if len(calls) == 3:
+            raise RuntimeError("disk full")
+        return append(self, step, data, fetched_at)
+
+    monkeypatch.setattr(StepWriter, "append", failing_append)
+    result = login(force=True)
+
+    assert result["rewritten"]
+    assert result["kept"]
+    assert _steps(filename) == before
@@ -0,0 +1,13 @@
+import pytest
+
+from history import played_at_ms
+
+@pytest.mark.parametrize("played_at, expected", [
+    ("2024-01-01T00:00:00Z", 1704067200000),
+    ("2024-01-01T00:00:00.78Z", 1704067200780),
+    ("2024-01-01T00:00:00.781Z", 1704067200781),
+    ("2024-01-01T00:00:00.781234Z", 1704067200781),
+    ("2024-01-01T01:00:00.5+01:00", 1704067200500),
+])
+def test_played_at_ms(played_at, expected):
+    assert played_at_ms({"played_at": played_at}) == expected
@@ -0,0 +1,6 @@
+from models import Decoder
+
+def test_artist_without_followers():
+    artist = Decoder().artist({"name": "Artist", "genres": ["pop"]})
+    assert artist.name == "Artist"
+    assert artist.total_followers is None
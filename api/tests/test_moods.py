@@ -0,0 +1,59 @@
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from analytics import mood_distribution
+from utils import classify_mood, classify_moods, mood_feature_array
+
+def _features(rng):
+    features = {
+        "valence": rng.random(), "energy": rng.random(), "acousticness": rng.random(),
+        "danceability": rng.random(), "tempo": rng.uniform(60, 180), "instrumentalness": rng.random(),
+        "mode": rng.choice([0, 1]), "loudness": rng.uniform(-25, 0)
+    }
+    # Optional features fall back to classify_mood's defaults
+    for key in ("instrumentalness", "mode", "loudness"):
+        if rng.random() < 0.2:
+            del features[key]
+    return features
+
+def test_classify_moods_matches_classify_mood():
+    rng = random.Random(0)
+    features_list = [_features(rng) for _ in range(500)]
+    labels, counts = classify_moods(mood_feature_array(features_list))
+    expected = [classify_mood(features) for features in features_list]
+    assert labels == expected
+    # Same counts, in the same order of first appearance
+    assert list(counts.items()) == list(Counter(expected).items())
+
+def test_mood_distribution_skips_null_features_in_both_paths():
+    rng = random.Random(1)
+    items = [{"track": {"id": f"t{i}"}, "played_at": "2024-01-01T00:00:00Z"} for i in range(20)]
+    features = {f"t{i}": _features(rng) for i in range(20)}
+    # Spotify returns null for tracks without audio features
+    features["t3"] = None
+    features["t7"] = None
+    loop = mood_distribution({"items": items}, features)
+    vectorized = mood_distribution({"items": items}, features, vectorized=True)
+    assert vectorized == loop
+    assert loop["total_tracks"] == 18
+
+@pytest.mark.parametrize("broken, error", [
+    (None, TypeError),
+    ({"energy": 0.5, "acousticness": 0.5, "danceability": 0.5, "tempo": 120}, KeyError),
+    ({"valence": None, "energy": 0.5, "acousticness": 0.5, "danceability": 0.5, "tempo": 120}, TypeError),
+])
+def test_null_or_incomplete_features_raise_in_both(broken, error):
+    features_list = [_features(random.Random(2)), broken]
+    with pytest.raises(error):
+        [classify_mood(features) for features in features_list]
+    with pytest.raises(error):
+        classify_moods(mood_feature_array(features_list))
+
+def test_classify_moods_rejects_missing_required_values():
+    features = mood_feature_array([_features(random.Random(3))])
+    features[0, 1] = np.nan
+    with pytest.raises(ValueError):
+        classify_moods(features)
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+import time
+
+from outbound import BatchCoalescer, background, current_lane
+
+WINDOW = 0.2
+
+def _coalescer(calls):
+    def fetch(batch):
+        calls.append((current_lane(), list(batch)))
+        time.sleep(0.05)
+        return [id.upper() for id in batch]
+
+    async def fetch_async(batch):
+        calls.append((current_lane(), list(batch)))
+        await asyncio.sleep(0.05)
+        return [id.upper() for id in batch]
+
+    return BatchCoalescer(fetch, fetch_async, batch_size=3, window=WINDOW)
+
+def test_interactive_caller_upgrades_queued_background_ids():
+    calls = []
+    coalescer = _coalescer(calls)
+    results = {}
+
+    def warm():
+        with background():
+            results["background"] = coalescer.fetch(["a", "b", "c", "d", "e"])
+
+    def request():
+        # d and e are waiting in the background queue by now
+        time.sleep(WINDOW / 4)
+        results["interactive"] = coalescer.fetch(["d", "e", "x"])
+
+    threads = [threading.Thread(target=warm), threading.Thread(target=request)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {"background": ["A", "B", "C", "D", "E"], "interactive": ["D", "E", "X"]}
+    # The full batch goes out at once; the rest leaves with the interactive lane
+    assert calls == [("background", ["a", "b", "c"]), ("interactive", ["d", "e", "x"])]
+    assert coalescer.stats() == {"requested_ids": 8, "shared_ids": 2, "upgraded_ids": 2, "batches": 2}
+
+def test_interactive_caller_upgrades_queued_background_ids_async():
+    calls = []
+    coalescer = _coalescer(calls)
+
+    async def warm():
+        with background():
+            return await coalescer.fetch_async(["p", "q", "r", "s"])
+
+    async def request():
+        await asyncio.sleep(WINDOW / 4)
+        return await coalescer.fetch_async(["s", "y"])
+
+    async def main():
+        return await asyncio.gather(warm(), request())
+
+    assert asyncio.run(main()) == [["P", "Q", "R", "S"], ["S", "Y"]]
+    assert calls == [("background", ["p", "q", "r"]), ("interactive", ["s", "y"])]
+    assert coalescer.stats()["upgraded_ids"] == 1
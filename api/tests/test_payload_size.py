@@ -0,0 +1,64 @@
+import gzip
+import glob
+import json
+import os
+
+import pytest
+
+from dataset_store import scan_entries
+
+DATASETS = sorted(os.path.basename(path) for path in glob.glob("data/*_spotify.json"))
+# Route and the dataset step it serves
+ROUTES = {
+    "/user/top_tracks?time_range=short_term": "top_tracks_short",
+    "/user/top_tracks?time_range=medium_term": "top_tracks_medium",
+    "/user/top_tracks?time_range=long_term": "top_tracks_long",
+    "/user/saved_tracks?": "saved_tracks",
+    "/user/recently_played?": "recently_played",
+}
+# Only the steps each dataset has (not every sample login fetched saved_tracks)
+CASES = [(route, filename) for filename in DATASETS
+         for route, step in ROUTES.items()
+         if step in {entry_step for entry_step, _, _ in scan_entries(f"data/{filename}")}]
+FIELDS = "name,artists,album.name"
+
+def _get(client, route, filename, fields=None, gzip_encoding=False):
+    url = f"{route}&username={filename.split('_')[0]}&filename={filename}"
+    if fields:
+        url += f"&fields={fields}"
+    headers = {"Accept-Encoding": "gzip" if gzip_encoding else "identity"}
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200
+    return response
+
+def test_datasets_present():
+    assert DATASETS
+
+@pytest.mark.parametrize("route, filename", CASES)
+def test_fields_shrink_body(client, route, filename):
+    full = _get(client, route, filename)
+    projected = _get(client, route, filename, fields=FIELDS)
+    assert "Content-Encoding" not in projected.headers
+    assert len(projected.get_data()) < len(full.get_data())
+    # Every item keeps exactly the requested fields
+    for item in projected.get_json()["items"]:
+        track = item["track"]
+        assert set(track) == {"name", "artists", "album"}
+        assert set(track["album"]) == {"name"}
+
+@pytest.mark.parametrize("route, filename", CASES)
+def test_gzip_shrinks_body(client, route, filename):
+    full = _get(client, route, filename)
+    compressed = _get(client, route, filename, gzip_encoding=True)
+    assert "Content-Encoding" not in full.headers
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert len(compressed.get_data()) < len(full.get_data())
+    assert json.loads(gzip.decompress(compressed.get_data())) == full.get_json()
+
+@pytest.mark.parametrize("route, filename", CASES)
+def test_fields_and_gzip_smallest(client, route, filename):
+    full = _get(client, route, filename)
+    projected = _get(client, route, filename, fields=FIELDS)
+    both = _get(client, route, filename, fields=FIELDS, gzip_encoding=True)
+    assert both.headers["Content-Encoding"] == "gzip"
+    assert len(both.get_data()) < len(projected.get_data()) < len(full.get_data())
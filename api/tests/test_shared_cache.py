@@ -0,0 +1,52 @@
+import time
+
+from shared_cache import MISSING, MemoryRedis, SharedCache, make_client
+
+def test_make_client():
+    assert make_client(None) is None
+    assert isinstance(make_client("memory://"), MemoryRedis)
+
+def test_round_trip_and_counters():
+    cache = SharedCache(MemoryRedis(), prefix="test")
+    key = cache.dataset_key("steps", "u_spotify.json", (1, 2), "top_tracks_short")
+    assert key == "test:1:steps:u_spotify.json:1:2:top_tracks_short"
+
+    assert cache.get(key) is MISSING
+    cache.set_many({key: {"items": [1]}, cache.key("none"): None})
+    assert cache.get_many([key, cache.key("none"), cache.key("other")], default="default") == [
+        {"items": [1]}, None, "default"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["sets"], stats["errors"]) == (2, 2, 2, 0)
+
+def test_entries_expire():
+    client = MemoryRedis()
+    cache = SharedCache(client, prefix="test", ttl=1)
+    cache.set(cache.key("a"), 1)
+    # Move the stored expiry into the past
+    value, _ = client._data[cache.key("a")]
+    client._data[cache.key("a")] = (value, time.monotonic() - 1)
+    assert cache.get(cache.key("a")) is MISSING
+
+def test_without_client_every_lookup_misses():
+    cache = SharedCache(None)
+    cache.set(cache.key("a"), 1)
+    assert not cache.enabled
+    assert cache.get(cache.key("a")) is MISSING
+
+class FailingRedis(MemoryRedis):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def mget(self, keys):
+        self.calls += 1
+        raise ConnectionError("down")
+
+def test_errors_are_misses_and_back_off():
+    client = FailingRedis()
+    cache = SharedCache(client, prefix="test", retry=60)
+    assert cache.get(cache.key("a"), default=None) is None
+    # Redis is left alone until the retry delay has passed
+    assert cache.get(cache.key("a"), default=None) is None
+    assert client.calls == 1
+    assert cache.stats()["errors"] == 1
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight, request_key
+
+def test_concurrent_calls_share_one_result():
+    flights = SingleFlight(enabled=True)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("key", compute, "view")))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flights.do("key", compute, "view")))
+                 for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    # Followers block on the leader's call
+    while flights.stats()["endpoints"]["view"]["collapsed"] < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert flights.stats()["endpoints"] == {"view": {"executed": 1, "collapsed": 3}}
+    assert flights.stats()["in_flight"] == 0
+
+def test_concurrent_coroutines_share_one_result():
+    flights = SingleFlight(enabled=True)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    async def main():
+        return await asyncio.gather(*[flights.do_async("key", compute, "view") for _ in range(4)])
+
+    assert asyncio.run(main()) == ["result"] * 4
+    assert len(calls) == 1
+
+def test_error_reaches_every_caller_and_is_not_kept():
+    flights = SingleFlight(enabled=True)
+
+    def fail():
+        raise ValueError("upstream")
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            flights.do("key", fail)
+    assert flights.stats()["in_flight"] == 0
+
+def test_request_key_includes_dataset_version(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    dataset = tmp_path / "data" / "u_spotify.json"
+    dataset.write_text("[]")
+    query = [("username", "u"), ("filename", "u_spotify.json")]
+
+    key = request_key("user.top_tracks", query)
+    # Parameter order does not matter
+    assert request_key("user.top_tracks", list(reversed(query))) == key
+    # A rewritten dataset is a different request
+    os.utime(dataset, ns=(1, 1))
+    assert request_key("user.top_tracks", query) != key
@@ -0,0 +1,28 @@
+import requests
+
+from audio_features import audio_feature_store
+
+def _http_error(status, body):
+    response = requests.Response()
+    response.status_code = status
+    response._content = body
+    response.reason = "Unauthorized"
+    return requests.HTTPError(response=response)
+
+def test_upstream_error_keeps_spotify_status_and_body(client, monkeypatch):
+    def get_features(track_ids):
+        raise _http_error(401, b'{"error": {"status": 401, "message": "The access token expired"}}')
+
+    monkeypatch.setattr(audio_feature_store, "get_features", get_features)
+    response = client.get("/analysis/track_features?ids=upstream401")
+    assert response.status_code == 401
+    assert response.get_json() == {"error": {"status": 401, "message": "The access token expired"}}
+
+def test_other_errors_answer_500(client, monkeypatch):
+    def get_features(track_ids):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(audio_feature_store, "get_features", get_features)
+    response = client.get("/analysis/track_features?ids=locked500")
+    assert response.status_code == 500
+    assert response.get_json() == {"error": "database is locked"}
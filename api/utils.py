@@ -1,6 +1,20 @@
 import os
 import json
 from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+from cache import LRUCache
+from shared_cache import step_cache, MISSING
+import dataset_store
+from metrics import STAGE_SECONDS, timed
+
+# Parsed datasets kept in memory, keyed by absolute path.
+# Each entry is (version, {step: data}, complete) where version is (mtime_ns, size)
+# and complete tells whether every step of the file has been decoded.
+DATASET_CACHE_SIZE = int(os.getenv('DATASET_CACHE_SIZE', 8))
+dataset_cache = LRUCache(maxsize=DATASET_CACHE_SIZE)
 
 def verify_and_load_file(filename):
     """Load and verify a JSON file"""
@@ -9,15 +23,91 @@ def verify_and_load_file(filename):
     with open(filename, 'r') as f:
         return json.load(f)
 
+def dataset_version(filename):
+    """Return the (mtime_ns, size) version of a dataset file, or None if it is missing"""
+    return dataset_store.file_version(filename)
+
+def _cached_dataset(filename, version):
+    """Return the cache entry for a dataset if it matches the file's current version"""
+    return dataset_cache.get(os.path.abspath(filename), validate=lambda entry: entry[0] == version)
+
+def load_dataset(filename):
+    """
+    Load a dataset file as a {step: data} dictionary.
+
+    Parsed datasets are cached by path and only re-parsed when the file's
+    mtime or size changes.
+    """
+    if not filename:
+        return None
+    version = dataset_version(filename)
+    if version is None:
+        return None
+    cached = _cached_dataset(filename, version)
+    if cached is not None and cached[2]:
+        return cached[1]
+    steps = _shared_steps(filename, version)
+    if steps is None:
+        with STAGE_SECONDS.time('dataset_parse'):
+            data = verify_and_load_file(filename)
+            if data is None:
+                return None
+            steps = {}
+            for entry in data:
+                # Keep the first entry for a step, matching the old linear scan
+                steps.setdefault(entry.get('step'), entry.get('data'))
+        if step_cache.enabled:
+            shared = {step_cache.dataset_key('step', filename, version, step): value for step, value in steps.items()}
+            # The step names, in file order, tell other workers which keys make up the dataset
+            shared[step_cache.dataset_key('steps', filename, version)] = list(steps)
+            step_cache.set_many(shared)
+    dataset_cache.set(os.path.abspath(filename), (version, steps, True))
+    return steps
+
+def _shared_steps(filename, version):
+    """Return every step of a dataset from the shared cache, or None unless all are there"""
+    if not step_cache.enabled:
+        return None
+    names = step_cache.get(step_cache.dataset_key('steps', filename, version))
+    if names is MISSING:
+        return None
+    values = step_cache.get_many([step_cache.dataset_key('step', filename, version, step) for step in names])
+    if any(value is MISSING for value in values):
+        return None
+    return dict(zip(names, values))
+
 def get_from_file(filename, step):
-    """Get data from a specific step in the JSON file"""
-    data = verify_and_load_file(filename)
-    if data is None:
+    """
+    Get data from a specific step in the JSON file.
+
+    When the file has an up-to-date sidecar index only the requested step is
+    decoded; otherwise the whole file is parsed (see dataset_store).
+    """
+    if not filename:
         return None
-    for entry in data:
-        if entry.get('step') == step:
-            return entry.get('data')
-    return None
+    version = dataset_version(filename)
+    if version is None:
+        return None
+    cached = _cached_dataset(filename, version)
+    if cached is not None and (cached[2] or step in cached[1]):
+        return cached[1].get(step)
+    index = dataset_store.load_index(filename, version)
+    if index is None:
+        steps = load_dataset(filename)
+        return steps.get(step) if steps is not None else None
+    if cached is None:
+        cached = (version, {}, False)
+        dataset_cache.set(os.path.abspath(filename), cached)
+    if step not in index:
+        return None
+    key = step_cache.dataset_key('step', filename, version, step)
+    data = step_cache.get(key)
+    if data is MISSING:
+        with STAGE_SECONDS.time('dataset_step_read'):
+            data = dataset_store.read_entry(filename, *index[step]).get('data')
+        step_cache.set(key, data)
+    cached[1][step] = data
+    return data
 
 def classify_mood(features):
     """
@@ -93,6 +183,509 @@ def classify_mood(features):
             return 'Atmospheric'  # Instrumental moderate tracks
         return 'Chill'
 
+# Columns of the feature arrays taken by classify_moods, and the defaults
+# classify_mood uses for the optional ones (NaN marks a required feature)
+MOOD_FEATURE_COLUMNS = ['valence', 'energy', 'acousticness', 'danceability', 'tempo',
+                        'instrumentalness', 'mode', 'loudness']
+MOOD_FEATURE_DEFAULTS = [np.nan, np.nan, np.nan, np.nan, np.nan, 0, 1, -10]
+# The required features come first
+MOOD_REQUIRED_FEATURES = int(np.isnan(MOOD_FEATURE_DEFAULTS).sum())
+
+def mood_feature_array(features_list):
+    """
+    Build the (tracks x MOOD_FEATURE_COLUMNS) array classify_moods takes from
+    a list of audio features dicts. Like classify_mood, it raises KeyError for
+    a missing required feature and TypeError for a None feature set or a None
+    required feature; None optional features become NaN.
+    """
+    columns = []
+    for column, (key, default) in enumerate(zip(MOOD_FEATURE_COLUMNS, MOOD_FEATURE_DEFAULTS)):
+        if column < MOOD_REQUIRED_FEATURES:
+            values = [features[key] for features in features_list]
+            if None in values:
+                raise TypeError(f"audio feature {key} is None")
+        else:
+            values = [features.get(key, default) for features in features_list]
+        columns.append(values)
+    return np.array(columns, dtype=float).reshape(len(MOOD_FEATURE_COLUMNS), len(features_list)).T
+
+def classify_moods(features):
+    """
+    Classify the moods of many tracks at once.
+
+    features is a (tracks x MOOD_FEATURE_COLUMNS) array, see
+    mood_feature_array; histories of several users can be classified in one
+    call by stacking their arrays. The rules of classify_mood are applied as
+    vectorized masks in the same order, so every track gets the label
+    classify_mood would give it. A track missing a required feature (NaN)
+    raises ValueError, as classify_mood cannot label it either.
+
+    Returns (labels, counts): the list of mood labels and a Counter of them
+    in order of first appearance.
+    """
+    if np.isnan(features[:, :MOOD_REQUIRED_FEATURES]).any():
+        raise ValueError("Required audio features are missing")
+    valence, energy, acousticness, danceability, tempo, instrumentalness, mode, loudness = features.T
+
+    happy = (valence > 0.65) & (energy > 0.55) & (mode == 1)
+    sad = (valence < 0.4) & (energy < 0.45) & ((mode == 0) | (acousticness > 0.4))
+    energetic = energy > 0.75
+    calm = (acousticness > 0.65) & (energy < 0.55) & (tempo < 100)
+    # np.select picks the first matching rule, like the if/elif chain
+    rules = [
+        (happy & (danceability > 0.7), 'Euphoric'),
+        (happy, 'Happy'),
+        (sad & (acousticness > 0.7), 'Melancholic'),
+        (sad, 'Sad'),
+        (energetic & (danceability > 0.65), 'Energetic'),
+        (energetic & (valence < 0.4), 'Intense'),
+        (energetic, 'Upbeat'),
+        (calm & (instrumentalness > 0.5), 'Ambient'),
+        (calm, 'Calm'),
+        ((valence < 0.4) & (energy > 0.6) & (loudness > -8), 'Angsty'),
+        ((valence < 0.3) & (mode == 0) & (0.4 < energy) & (energy < 0.7), 'Dark'),
+        ((0.4 <= valence) & (valence <= 0.6) & (energy < 0.5) & (acousticness > 0.4), 'Sentimental'),
+        ((0.4 <= valence) & (valence <= 0.7) & (0.4 <= acousticness) & (acousticness <= 0.7) & (energy < 0.65),
+         'Nostalgic'),
+        ((danceability > 0.6) & (energy < 0.6), 'Groovy'),
+        (instrumentalness > 0.5, 'Atmospheric')
+    ]
+    moods = [mood for _, mood in rules] + ['Chill']
+    codes = np.select([mask for mask, _ in rules], range(len(rules)), len(rules))
+    labels = [moods[code] for code in codes.tolist()]
+    # Count in order of first appearance, like Counter(labels) would
+    counts = np.bincount(codes, minlength=len(moods))
+    _, first_seen = np.unique(codes, return_index=True)
+    return labels, Counter({moods[codes[index]]: int(counts[codes[index]]) for index in np.sort(first_seen)})
+
+# Genre knowledge base used by predict_personality, built once at import.
+# Enhanced genre-trait mapping with cultural context
+GENRE_TRAITS = {
+    # Western Pop & Mainstream
+    "pop": {"traits": [45, 55, 75, 65, 60], "cultural_weight": 1.0, "complexity": 0.3},
+    "dance pop": {"traits": [50, 45, 80, 60, 65], "cultural_weight": 1.0, "complexity": 0.4},
+    "indie pop": {"traits": [65, 50, 60, 70, 50], "cultural_weight": 0.8, "complexity": 0.6},
+    "synth pop": {"traits": [60, 55, 65, 60, 55], "cultural_weight": 0.9, "complexity": 0.5},
+    "dream pop": {"traits": [70, 45, 40, 75, 45], "cultural_weight": 0.7, "complexity": 0.7},
+    "art pop": {"traits": [80, 50, 50, 65, 50], "cultural_weight": 0.6, "complexity": 0.8},
+    "hyperpop": {"traits": [85, 35, 70, 55, 45], "cultural_weight": 0.5, "complexity": 0.9},
+    
+    # Rock & Alternative
+    "rock": {"traits": [60, 50, 60, 50, 55], "cultural_weight": 1.0, "complexity": 0.5},
+    "alternative rock": {"traits": [70, 45, 55, 60, 50], "cultural_weight": 0.8, "complexity": 0.6},
+    "indie rock": {"traits": [75, 45, 50, 65, 45], "cultural_weight": 0.7, "complexity": 0.7},
+    "classic rock": {"traits": [55, 60, 55, 50, 60], "cultural_weight": 1.0, "complexity": 0.4},
+    "hard rock": {"traits": [60, 45, 70, 40, 60], "cultural_weight": 0.9, "complexity": 0.5},
+    "punk": {"traits": [70, 30, 65, 40, 50], "cultural_weight": 0.8, "complexity": 0.6},
+    "metal": {"traits": [65, 55, 60, 40, 55], "cultural_weight": 0.8, "complexity": 0.6},
+    "progressive rock": {"traits": [80, 70, 50, 55, 60], "cultural_weight": 0.7, "complexity": 0.9},
+    "post-rock": {"traits": [85, 60, 35, 70, 65], "cultural_weight": 0.6, "complexity": 0.8},
+    
+    # Electronic & EDM
+    "electronic": {"traits": [65, 55, 70, 50, 60], "cultural_weight": 0.9, "complexity": 0.6},
+    "edm": {"traits": [60, 50, 80, 55, 65], "cultural_weight": 1.0, "complexity": 0.4},
+    "house": {"traits": [60, 55, 75, 60, 65], "cultural_weight": 0.9, "complexity": 0.5},
+    "techno": {"traits": [65, 60, 70, 45, 60], "cultural_weight": 0.8, "complexity": 0.6},
+    "dubstep": {"traits": [70, 45, 75, 40, 55], "cultural_weight": 0.8, "complexity": 0.7},
+    "ambient": {"traits": [80, 60, 30, 65, 70], "cultural_weight": 0.6, "complexity": 0.8},
+    "downtempo": {"traits": [75, 55, 35, 70, 75], "cultural_weight": 0.7, "complexity": 0.7},
+    "drum and bass": {"traits": [70, 50, 75, 45, 60], "cultural_weight": 0.8, "complexity": 0.7},
+    "trance": {"traits": [65, 55, 65, 55, 70], "cultural_weight": 0.8, "complexity": 0.6},
+    
+    # Hip Hop & R&B
+    "hip hop": {"traits": [60, 45, 70, 50, 60], "cultural_weight": 1.0, "complexity": 0.5},
+    "rap": {"traits": [65, 40, 75, 45, 60], "cultural_weight": 1.0, "complexity": 0.4},
+    "trap": {"traits": [55, 35, 70, 40, 50], "cultural_weight": 0.9, "complexity": 0.4},
+    "r&b": {"traits": [55, 50, 65, 70, 55], "cultural_weight": 1.0, "complexity": 0.5},
+    "neo soul": {"traits": [70, 55, 55, 75, 60], "cultural_weight": 0.8, "complexity": 0.7},
+    "conscious hip hop": {"traits": [75, 60, 60, 70, 65], "cultural_weight": 0.7, "complexity": 0.8},
+    
+    # Jazz & Classical
+    "jazz": {"traits": [75, 65, 50, 60, 65], "cultural_weight": 0.8, "complexity": 0.8},
+    "classical": {"traits": [70, 75, 40, 65, 70], "cultural_weight": 0.7, "complexity": 0.9},
+    "neo-classical": {"traits": [75, 70, 45, 65, 65], "cultural_weight": 0.6, "complexity": 0.8},
+    "contemporary jazz": {"traits": [80, 60, 55, 65, 70], "cultural_weight": 0.7, "complexity": 0.8},
+    "bebop": {"traits": [85, 70, 50, 60, 65], "cultural_weight": 0.6, "complexity": 0.9},
+    
+    # Folk & Acoustic
+    "folk": {"traits": [65, 60, 40, 75, 60], "cultural_weight": 0.8, "complexity": 0.6},
+    "country": {"traits": [45, 65, 60, 70, 65], "cultural_weight": 1.0, "complexity": 0.4},
+    "singer-songwriter": {"traits": [70, 55, 45, 75, 50], "cultural_weight": 0.8, "complexity": 0.7},
+    "acoustic": {"traits": [60, 55, 40, 70, 65], "cultural_weight": 0.8, "complexity": 0.5},
+    "indie folk": {"traits": [75, 50, 45, 80, 55], "cultural_weight": 0.7, "complexity": 0.7},
+    
+    # World Music & Cultural
+    "k-pop": {"traits": [50, 60, 75, 65, 55], "cultural_weight": 0.9, "complexity": 0.5},
+    "j-pop": {"traits": [55, 65, 70, 70, 60], "cultural_weight": 0.9, "complexity": 0.5},
+    "v-pop": {"traits": [52, 58, 72, 68, 58], "cultural_weight": 0.9, "complexity": 0.5},
+    "latin": {"traits": [60, 50, 80, 70, 65], "cultural_weight": 0.9, "complexity": 0.6},
+    "reggae": {"traits": [60, 40, 65, 75, 70], "cultural_weight": 0.8, "complexity": 0.6},
+    "afrobeat": {"traits": [65, 50, 75, 65, 60], "cultural_weight": 0.8, "complexity": 0.7},
+    "bollywood": {"traits": [55, 55, 80, 70, 60], "cultural_weight": 0.9, "complexity": 0.6},
+    "bossa nova": {"traits": [70, 60, 50, 80, 75], "cultural_weight": 0.7, "complexity": 0.7},
+    
+    # Regional Specific
+    "vietnam indie": {"traits": [72, 52, 58, 75, 55], "cultural_weight": 0.8, "complexity": 0.7},
+    "vietnamese hip hop": {"traits": [62, 45, 68, 58, 60], "cultural_weight": 0.8, "complexity": 0.6},
+    "vietnamese lo-fi": {"traits": [78, 50, 35, 80, 70], "cultural_weight": 0.7, "complexity": 0.8},
+    "vinahouse": {"traits": [58, 45, 78, 60, 65], "cultural_weight": 0.9, "complexity": 0.5},
+    "soft pop": {"traits": [60, 60, 55, 75, 65], "cultural_weight": 0.8, "complexity": 0.4},
+    
+    # Experimental & Niche
+    "experimental": {"traits": [90, 45, 40, 50, 45], "cultural_weight": 0.4, "complexity": 0.95},
+    "noise": {"traits": [85, 30, 50, 35, 40], "cultural_weight": 0.3, "complexity": 0.9},
+    "shoegaze": {"traits": [75, 40, 35, 65, 45], "cultural_weight": 0.5, "complexity": 0.8},
+    "post-punk": {"traits": [80, 45, 55, 50, 50], "cultural_weight": 0.6, "complexity": 0.8},
+    "lo-fi": {"traits": [70, 45, 30, 75, 65], "cultural_weight": 0.7, "complexity": 0.7},
+    
+    # Default fallback
+    "unknown": {"traits": [50, 50, 50, 50, 50], "cultural_weight": 1.0, "complexity": 0.5}
+}
+
+# Genre synonyms and fuzzy matching
+GENRE_SYNONYMS = {
+    "hiphop": "hip hop",
+    "rnb": "r&b",
+    "jpop": "j-pop",
+    "kpop": "k-pop",
+    "vpop": "v-pop",
+    "edm": "electronic",
+    "dnb": "drum and bass",
+    "dub": "dubstep",
+    "indie": "indie rock",
+    "alternative": "alternative rock",
+    "singer songwriter": "singer-songwriter",
+    "vietnam": "vietnamese",
+    "vietnamese": "vietnam"
+}
+
+# Inverted index from word to the known genres containing it, in GENRE_TRAITS
+# order. A partial match only scores above zero when the input shares a word
+# with the genre, so these are the only candidates worth checking.
+GENRE_WORD_INDEX = {}
+for _position, _genre in enumerate(GENRE_TRAITS):
+    for _word in set(_genre.split()):
+        GENRE_WORD_INDEX.setdefault(_word, []).append((_position, _genre))
+
+@lru_cache(maxsize=4096)
+def fuzzy_match_genre(input_genre):
+    """Advanced genre matching with fuzzy logic and cultural context"""
+    input_lower = input_genre.lower().strip()
+    
+    # Direct match
+    if input_lower in GENRE_TRAITS:
+        return input_lower, 1.0
+        
+    # Synonym match
+    if input_lower in GENRE_SYNONYMS:
+        return GENRE_SYNONYMS[input_lower], 1.0
+        
+    # Partial matching with scoring
+    best_match = "unknown"
+    best_score = 0.0
+    
+    input_words = set(input_lower.split())
+    candidates = sorted({candidate for word in input_words for candidate in GENRE_WORD_INDEX.get(word, ())})
+    for _, genre in candidates:
+        # Check if input contains genre or vice versa
+        if genre in input_lower or input_lower in genre:
+            overlap = len(input_words & set(genre.split()))
+            total_words = len(input_words | set(genre.split()))
+            score = overlap / total_words if total_words > 0 else 0
+            
+            if score > best_score:
+                best_score = score
+                best_match = genre
+                
+    # Also check for cultural/regional indicators
+    if "vietnam" in input_lower or "viet" in input_lower:
+        if "indie" in input_lower:
+            return "vietnam indie", 0.9
+        elif "hip hop" in input_lower or "rap" in input_lower:
+            return "vietnamese hip hop", 0.9
+        elif "lo-fi" in input_lower or "lofi" in input_lower:
+            return "vietnamese lo-fi", 0.9
+            
+    return best_match, max(best_score, 0.3)  # Minimum confidence for partial matches
+
+# Vectorized trait scoring. Known genres are the rows of GENRE_TABLE (in
+# GENRE_TRAITS order): the five trait scores, the complexity and a constant 1
+# that accumulates the total weight. A user's genres become a vector of
+# weights over the gathered table rows, so their trait, complexity and weight
+# sums are one vector-matrix product, and many users are scored at once by
+# stacking their vectors into a (users x genres) weight matrix.
+#
+# The product is taken with np.einsum rather than a BLAS matmul or np.sum:
+# einsum adds the genres in list order, like the per-genre loops this
+# replaced, while BLAS and pairwise sums reorder the additions and the
+# last-bit differences flip rounding and threshold ties (e.g. a complexity
+# of exactly 0.7). Track statistics are summed in order with cumsum.
+TRAIT_NAMES = ["openness", "conscientiousness", "extraversion", "agreeableness", "emotional_stability"]
+GENRE_NAMES = list(GENRE_TRAITS)
+GENRE_POSITIONS = {genre: position for position, genre in enumerate(GENRE_NAMES)}
+GENRE_TABLE = np.array([GENRE_TRAITS[genre]["traits"] + [GENRE_TRAITS[genre]["complexity"], 1]
+                        for genre in GENRE_NAMES], dtype=float)
+
+# Audio feature columns used by the personality analysis
+AUDIO_FEATURE_COLUMNS = ['valence', 'energy', 'danceability', 'acousticness', 'instrumentalness',
+                         'tempo', 'loudness', 'speechiness', 'duration_ms', 'time_signature']
+AUDIO_COLUMN = {key: column for column, key in enumerate(AUDIO_FEATURE_COLUMNS)}
+# Values used in place of missing features where the analysis has a default
+AUDIO_FEATURE_DEFAULTS = np.array([0.5, 0, 0, 0, 0, 0, -10, 0, 0, 4], dtype=float)
+
+def _ordered_sum(values, axis):
+    """Sum along an axis adding elements in order, like a Python loop does"""
+    return np.cumsum(values, axis=axis).take(-1, axis=axis)
+
+def _padded(rows_per_user, width, fill):
+    """
+    Stack per-user lists of rows into a (users x max_rows x width) array.
+
+    Returns the array, padded with fill, and a (users x max_rows) mask of the
+    real rows.
+    """
+    lengths = [len(rows) for rows in rows_per_user]
+    slots = max(lengths + [1])
+    padding = [[fill] * width]
+    padded = np.array([list(rows) + padding * (slots - len(rows)) for rows in rows_per_user],
+                      dtype=float).reshape(len(rows_per_user), slots, width)
+    return padded, np.arange(slots) < np.array(lengths, dtype=int)[:, None]
+
+def _genre_region(matched_genre):
+    """Return the cultural region of a known genre, or None"""
+    if "k-" in matched_genre or "korean" in matched_genre:
+        return "korean"
+    elif "j-" in matched_genre or "japanese" in matched_genre:
+        return "japanese"
+    elif "vietnam" in matched_genre or "v-" in matched_genre:
+        return "vietnamese"
+    elif "latin" in matched_genre or "spanish" in matched_genre:
+        return "latin"
+    elif matched_genre in ["folk", "country", "blues", "rock", "pop"]:
+        return "western"
+    elif matched_genre in ["afrobeat", "reggae"]:
+        return "african"
+    return None
+
+# Cultural region of each known genre (None for genres without one)
+GENRE_REGIONS = {genre: _genre_region(genre) for genre in GENRE_NAMES}
+
+def score_genres(users_top_genres):
+    """
+    Score the (genre, weight) lists of many users at once.
+
+    Returns (scores, matched_genres, confidence_factors, cultural_regions):
+    scores is a (users x 7) array of the weighted sums of the five traits, the
+    complexity and the weights themselves; the others are per-user lists.
+    Each genre's weight is decayed by position (5% per place) and scaled by
+    the matched genre's cultural weight and the match confidence.
+    """
+    positions = []
+    weights = []
+    matched_genres = []
+    confidence_factors = []
+    cultural_regions = []
+    for top_genres in users_top_genres:
+        matches = [fuzzy_match_genre(genre) for genre, _ in top_genres]
+        positions.append([GENRE_POSITIONS[matched_genre] for matched_genre, _ in matches])
+        weights.append([float(weight) * (1.0 - (i * 0.05)) * GENRE_TRAITS[matched_genre]["cultural_weight"]
+                        * match_confidence
+                        for i, ((matched_genre, match_confidence), (_, weight)) in enumerate(zip(matches, top_genres))])
+        matched_genres.append([matched_genre for matched_genre, _ in matches])
+        confidence_factors.append([match_confidence for _, match_confidence in matches])
+        cultural_regions.append({GENRE_REGIONS[matched_genre] for matched_genre, _ in matches} - {None})
+
+    slots = max([len(user_weights) for user_weights in weights] + [1])
+    # Padding has weight 0 (on the first genre's row), so it adds nothing to the sums
+    weight_matrix = np.array([user_weights + [0.0] * (slots - len(user_weights)) for user_weights in weights])
+    rows = GENRE_TABLE[[user_positions + [0] * (slots - len(user_positions)) for user_positions in positions]]
+    scores = np.einsum('ug,ugt->ut', weight_matrix, rows)
+    return scores, matched_genres, confidence_factors, cultural_regions
+
+def audio_feature_stats(users_audio_features):
+    """
+    Column-wise audio feature statistics for many users at once.
+
+    Returns one dict per user (None without audio features). Averages skip
+    missing values; avg_danceability, avg_loudness and avg_valence substitute
+    0, -10 and 0.5 for them and divide by the number of entries including
+    empty ones.
+    """
+    if not any(users_audio_features):
+        return [None] * len(users_audio_features)
+    rows = [[list(map(f.get, AUDIO_FEATURE_COLUMNS)) for f in audio_features if f] if audio_features else []
+            for audio_features in users_audio_features]
+    # Missing and None values become NaN
+    features, tracks = _padded(rows, len(AUDIO_FEATURE_COLUMNS), np.nan)
+    present = features == features
+    values = np.where(present, features, 0.0)
+    # Missing values replaced by their defaults; padding rows stay 0
+    defaulted = np.where(present, features, AUDIO_FEATURE_DEFAULTS) * tracks[:, :, None]
+
+    def column(key):
+        return defaulted[:, :, AUDIO_COLUMN[key]]
+
+    duration = AUDIO_COLUMN['duration_ms']
+    # Complex music tends to have: low speechiness, high instrumentalness, unusual time signatures
+    complexity = ((1 - column('speechiness')) * 0.3 + column('instrumentalness') * 0.4
+                  + (column('time_signature') / 7) * 0.3) * tracks
+    # Every per-user sum comes from a single accumulation over the tracks
+    sums = _ordered_sum(np.concatenate([values, present, np.stack([
+        values[:, :, duration] != 0, complexity, tracks,
+        column('danceability'), column('loudness'), column('valence')
+    ], axis=-1)], axis=-1), axis=1)
+    width = len(AUDIO_FEATURE_COLUMNS)
+    counts = sums[:, width:2 * width]
+    averages = sums[:, :width] / np.maximum(counts, 1)
+
+    valence = AUDIO_COLUMN['valence']
+    emotional_range = (np.where(present[:, :, valence], values[:, :, valence], -np.inf).max(axis=1)
+                       - np.where(present[:, :, valence], values[:, :, valence], np.inf).min(axis=1))
+    energy = AUDIO_COLUMN['energy']
+    # float_power goes through pow() like Python's ** does; ** 2 on arrays multiplies
+    deviations = np.float_power((values[:, :, energy] - averages[:, energy:energy + 1]) * present[:, :, energy], 2)
+    energy_variance = _ordered_sum(deviations, axis=1) / np.maximum(counts[:, energy], 1)
+
+    stats = []
+    for audio_features, user_sums, user_counts, user_averages, user_range, user_variance in zip(
+            users_audio_features, sums.tolist(), counts.tolist(), averages.tolist(),
+            emotional_range.tolist(), energy_variance.tolist()):
+        if not audio_features:
+            stats.append(None)
+            continue
+        duration_count, complexity_sum, track_count, danceability_sum, loudness_sum, valence_sum = user_sums[2 * width:]
+        stats.append({
+            "averages": {key: average if count else 0
+                         for key, average, count in zip(AUDIO_FEATURE_COLUMNS, user_averages, user_counts)},
+            "avg_duration": user_sums[duration] / duration_count if duration_count else 180000,  # 3 min default
+            "avg_complexity": complexity_sum / track_count if track_count else 0.3,
+            "emotional_range": user_range if user_counts[valence] > 1 else 0,
+            "energy_variance": user_variance if user_counts[energy] > 1 else 0,
+            "avg_danceability": danceability_sum / len(audio_features),
+            "avg_loudness": loudness_sum / len(audio_features),
+            "avg_valence": valence_sum / len(audio_features)
+        })
+    return stats
+
+def track_popularity_stats(users_track_popularity_data):
+    """
+    Popularity, duration, explicitness and release year statistics of many
+    users' top tracks at once.
+
+    Returns one dict per user (None without track data).
+    """
+    if not any(users_track_popularity_data):
+        return [None] * len(users_track_popularity_data)
+    rows = []
+    for track_popularity_data in users_track_popularity_data:
+        user_rows = []
+        for track in track_popularity_data or []:
+            popularity = track.get('popularity', 0)
+            duration = track.get('duration_ms') or 0
+            release_date = track.get('release_date', '')
+            year = None
+            if release_date and len(release_date) >= 4:
+                try:
+                    year = int(release_date[:4])
+                except ValueError:
+                    pass
+            # Columns are the summed quantities: popularity, track, mainstream, niche,
+            # duration, has duration, explicit, year, has year
+            user_rows.append((popularity, 1, popularity > 70, popularity < 30, duration, duration != 0,
+                              bool(track.get('explicit', False)), year or 0, year is not None))
+        rows.append(user_rows)
+    tracks_array, _ = _padded(rows, 9, 0)
+    sums = _ordered_sum(tracks_array, axis=1)
+    track_counts, year_counts = sums[:, 1], sums[:, 8]
+    avg_popularity = sums[:, 0] / np.maximum(track_counts, 1)
+    avg_year = sums[:, 7] / np.maximum(year_counts, 1)
+    # Padding rows and tracks without a year are masked out by their 0 count column;
+    # float_power goes through pow() like Python's ** does; ** 2 on arrays multiplies
+    variances = _ordered_sum(np.float_power(np.stack([
+        (tracks_array[:, :, 0] - avg_popularity[:, None]) * tracks_array[:, :, 1],
+        (tracks_array[:, :, 7] - avg_year[:, None]) * tracks_array[:, :, 8]
+    ], axis=-1), 2), axis=1)
+
+    current_year = 2024
+    stats = []
+    for (popularity_sum, track_count, mainstream_count, niche_count, duration_sum, duration_count,
+         explicit_count, year_sum, year_count), (popularity_variance, year_variance) in zip(
+            sums.tolist(), variances.tolist()):
+        if not track_count:
+            stats.append(None)
+            continue
+        stats.append({
+            "avg_popularity": popularity_sum / track_count,
+            "popularity_variance": popularity_variance / track_count,
+            "mainstream_ratio": mainstream_count / track_count,
+            "niche_ratio": niche_count / track_count,
+            "avg_track_duration": duration_sum / duration_count if duration_count else 180000,
+            "explicit_ratio": explicit_count / track_count,
+            "year_variance": year_variance / year_count if year_count else 0,
+            # 0-1 scale; defaults to somewhat recent
+            "recency_preference": (year_sum / year_count - 1950) / (current_year - 1950) if year_count else 0.8
+        })
+    return stats
+
+# Trait descriptions by score level, used by predict_personality
+TRAIT_DESCRIPTIONS = {
+    "openness": {
+        "high": "intellectually curious and creatively adventurous",
+        "medium": "balanced between traditional and innovative approaches", 
+        "low": "practical and preferring established methods"
+    },
+    "conscientiousness": {
+        "high": "highly organized and goal-oriented",
+        "medium": "flexibly structured with adaptive planning",
+        "low": "spontaneous and preferring flexible approaches"
+    },
+    "extraversion": {
+        "high": "energetically social and outwardly focused",
+        "medium": "socially balanced with both outgoing and introspective tendencies",
+        "low": "reflectively introspective and preferring intimate connections"
+    },
+    "agreeableness": {
+        "high": "highly empathetic and cooperation-focused",
+        "medium": "diplomatically balanced between empathy and assertion",
+        "low": "analytically objective and logic-focused"
+    },
+    "emotional_stability": {
+        "high": "emotionally resilient and stress-resistant",
+        "medium": "emotionally responsive yet stable",
+        "low": "emotionally sensitive and deeply feeling"
+    }
+}
+
+# Trait-specific contextual additions based on musical analysis
+TRAIT_CONTEXTS = {
+    "openness": {
+        "high_diversity": "with a strong appetite for musical exploration and genre experimentation",
+        "high_complexity": "drawn to sophisticated and avant-garde musical expressions",
+        "high_cultural": "showing deep appreciation for global musical traditions"
+    },
+    "conscientiousness": {
+        "high_diversity": "with methodical exploration of different musical styles",
+        "high_complexity": "appreciating structured and technically complex compositions",
+        "high_cultural": "systematically engaging with diverse cultural music forms"
+    },
+    "extraversion": {
+        "high_diversity": "energized by a wide range of social and danceable music",
+        "high_complexity": "enjoying both mainstream hits and sophisticated musical arrangements",
+        "high_cultural": "connecting through music across different cultural communities"
+    },
+    "agreeableness": {
+        "high_diversity": "finding harmony and connection through diverse musical experiences",
+        "high_complexity": "appreciating both accessible melodies and nuanced emotional expressions",
+        "high_cultural": "embracing music as a bridge between different cultures and perspectives"
+    },
+    "emotional_stability": {
+        "high_diversity": "maintaining emotional balance through varied musical moods and styles",
+        "high_complexity": "comfortable with both challenging and soothing musical experiences",
+        "high_cultural": "finding emotional resonance in music from different cultural backgrounds"
+    }
+}
+
+@timed('predict_personality')
 def predict_personality(top_genres, audio_features=None, track_popularity_data=None):
     """
     Advanced personality prediction based on music genres and audio features with sophisticated analysis.
@@ -116,210 +709,45 @@ def predict_personality(top_genres, audio_features=None, track_popularity_data=N
     
     Returns a comprehensive personality analysis dictionary.
     """
-    import re
-    from collections import defaultdict
-    
-    # Enhanced genre-trait mapping with cultural context
-    genre_traits = {
-        # Western Pop & Mainstream
-        "pop": {"traits": [45, 55, 75, 65, 60], "cultural_weight": 1.0, "complexity": 0.3},
-        "dance pop": {"traits": [50, 45, 80, 60, 65], "cultural_weight": 1.0, "complexity": 0.4},
-        "indie pop": {"traits": [65, 50, 60, 70, 50], "cultural_weight": 0.8, "complexity": 0.6},
-        "synth pop": {"traits": [60, 55, 65, 60, 55], "cultural_weight": 0.9, "complexity": 0.5},
-        "dream pop": {"traits": [70, 45, 40, 75, 45], "cultural_weight": 0.7, "complexity": 0.7},
-        "art pop": {"traits": [80, 50, 50, 65, 50], "cultural_weight": 0.6, "complexity": 0.8},
-        "hyperpop": {"traits": [85, 35, 70, 55, 45], "cultural_weight": 0.5, "complexity": 0.9},
-        
-        # Rock & Alternative
-        "rock": {"traits": [60, 50, 60, 50, 55], "cultural_weight": 1.0, "complexity": 0.5},
-        "alternative rock": {"traits": [70, 45, 55, 60, 50], "cultural_weight": 0.8, "complexity": 0.6},
-        "indie rock": {"traits": [75, 45, 50, 65, 45], "cultural_weight": 0.7, "complexity": 0.7},
-        "classic rock": {"traits": [55, 60, 55, 50, 60], "cultural_weight": 1.0, "complexity": 0.4},
-        "hard rock": {"traits": [60, 45, 70, 40, 60], "cultural_weight": 0.9, "complexity": 0.5},
-        "punk": {"traits": [70, 30, 65, 40, 50], "cultural_weight": 0.8, "complexity": 0.6},
-        "metal": {"traits": [65, 55, 60, 40, 55], "cultural_weight": 0.8, "complexity": 0.6},
-        "progressive rock": {"traits": [80, 70, 50, 55, 60], "cultural_weight": 0.7, "complexity": 0.9},
-        "post-rock": {"traits": [85, 60, 35, 70, 65], "cultural_weight": 0.6, "complexity": 0.8},
-        
-        # Electronic & EDM
-        "electronic": {"traits": [65, 55, 70, 50, 60], "cultural_weight": 0.9, "complexity": 0.6},
-        "edm": {"traits": [60, 50, 80, 55, 65], "cultural_weight": 1.0, "complexity": 0.4},
-        "house": {"traits": [60, 55, 75, 60, 65], "cultural_weight": 0.9, "complexity": 0.5},
-        "techno": {"traits": [65, 60, 70, 45, 60], "cultural_weight": 0.8, "complexity": 0.6},
-        "dubstep": {"traits": [70, 45, 75, 40, 55], "cultural_weight": 0.8, "complexity": 0.7},
-        "ambient": {"traits": [80, 60, 30, 65, 70], "cultural_weight": 0.6, "complexity": 0.8},
-        "downtempo": {"traits": [75, 55, 35, 70, 75], "cultural_weight": 0.7, "complexity": 0.7},
-        "drum and bass": {"traits": [70, 50, 75, 45, 60], "cultural_weight": 0.8, "complexity": 0.7},
-        "trance": {"traits": [65, 55, 65, 55, 70], "cultural_weight": 0.8, "complexity": 0.6},
-        
-        # Hip Hop & R&B
-        "hip hop": {"traits": [60, 45, 70, 50, 60], "cultural_weight": 1.0, "complexity": 0.5},
-        "rap": {"traits": [65, 40, 75, 45, 60], "cultural_weight": 1.0, "complexity": 0.4},
-        "trap": {"traits": [55, 35, 70, 40, 50], "cultural_weight": 0.9, "complexity": 0.4},
-        "r&b": {"traits": [55, 50, 65, 70, 55], "cultural_weight": 1.0, "complexity": 0.5},
-        "neo soul": {"traits": [70, 55, 55, 75, 60], "cultural_weight": 0.8, "complexity": 0.7},
-        "conscious hip hop": {"traits": [75, 60, 60, 70, 65], "cultural_weight": 0.7, "complexity": 0.8},
-        
-        # Jazz & Classical
-        "jazz": {"traits": [75, 65, 50, 60, 65], "cultural_weight": 0.8, "complexity": 0.8},
-        "classical": {"traits": [70, 75, 40, 65, 70], "cultural_weight": 0.7, "complexity": 0.9},
-        "neo-classical": {"traits": [75, 70, 45, 65, 65], "cultural_weight": 0.6, "complexity": 0.8},
-        "contemporary jazz": {"traits": [80, 60, 55, 65, 70], "cultural_weight": 0.7, "complexity": 0.8},
-        "bebop": {"traits": [85, 70, 50, 60, 65], "cultural_weight": 0.6, "complexity": 0.9},
-        
-        # Folk & Acoustic
-        "folk": {"traits": [65, 60, 40, 75, 60], "cultural_weight": 0.8, "complexity": 0.6},
-        "country": {"traits": [45, 65, 60, 70, 65], "cultural_weight": 1.0, "complexity": 0.4},
-        "singer-songwriter": {"traits": [70, 55, 45, 75, 50], "cultural_weight": 0.8, "complexity": 0.7},
-        "acoustic": {"traits": [60, 55, 40, 70, 65], "cultural_weight": 0.8, "complexity": 0.5},
-        "indie folk": {"traits": [75, 50, 45, 80, 55], "cultural_weight": 0.7, "complexity": 0.7},
-        
-        # World Music & Cultural
-        "k-pop": {"traits": [50, 60, 75, 65, 55], "cultural_weight": 0.9, "complexity": 0.5},
-        "j-pop": {"traits": [55, 65, 70, 70, 60], "cultural_weight": 0.9, "complexity": 0.5},
-        "v-pop": {"traits": [52, 58, 72, 68, 58], "cultural_weight": 0.9, "complexity": 0.5},
-        "latin": {"traits": [60, 50, 80, 70, 65], "cultural_weight": 0.9, "complexity": 0.6},
-        "reggae": {"traits": [60, 40, 65, 75, 70], "cultural_weight": 0.8, "complexity": 0.6},
-        "afrobeat": {"traits": [65, 50, 75, 65, 60], "cultural_weight": 0.8, "complexity": 0.7},
-        "bollywood": {"traits": [55, 55, 80, 70, 60], "cultural_weight": 0.9, "complexity": 0.6},
-        "bossa nova": {"traits": [70, 60, 50, 80, 75], "cultural_weight": 0.7, "complexity": 0.7},
-        
-        # Regional Specific
-        "vietnam indie": {"traits": [72, 52, 58, 75, 55], "cultural_weight": 0.8, "complexity": 0.7},
-        "vietnamese hip hop": {"traits": [62, 45, 68, 58, 60], "cultural_weight": 0.8, "complexity": 0.6},
-        "vietnamese lo-fi": {"traits": [78, 50, 35, 80, 70], "cultural_weight": 0.7, "complexity": 0.8},
-        "vinahouse": {"traits": [58, 45, 78, 60, 65], "cultural_weight": 0.9, "complexity": 0.5},
-        "soft pop": {"traits": [60, 60, 55, 75, 65], "cultural_weight": 0.8, "complexity": 0.4},
-        
-        # Experimental & Niche
-        "experimental": {"traits": [90, 45, 40, 50, 45], "cultural_weight": 0.4, "complexity": 0.95},
-        "noise": {"traits": [85, 30, 50, 35, 40], "cultural_weight": 0.3, "complexity": 0.9},
-        "shoegaze": {"traits": [75, 40, 35, 65, 45], "cultural_weight": 0.5, "complexity": 0.8},
-        "post-punk": {"traits": [80, 45, 55, 50, 50], "cultural_weight": 0.6, "complexity": 0.8},
-        "lo-fi": {"traits": [70, 45, 30, 75, 65], "cultural_weight": 0.7, "complexity": 0.7},
-        
-        # Default fallback
-        "unknown": {"traits": [50, 50, 50, 50, 50], "cultural_weight": 1.0, "complexity": 0.5}
-    }
-    
-    # Genre synonyms and fuzzy matching
-    genre_synonyms = {
-        "hiphop": "hip hop",
-        "rnb": "r&b",
-        "jpop": "j-pop",
-        "kpop": "k-pop",
-        "vpop": "v-pop",
-        "edm": "electronic",
-        "dnb": "drum and bass",
-        "dub": "dubstep",
-        "indie": "indie rock",
-        "alternative": "alternative rock",
-        "singer songwriter": "singer-songwriter",
-        "vietnam": "vietnamese",
-        "vietnamese": "vietnam"
-    }
-    
-    def fuzzy_match_genre(input_genre):
-        """Advanced genre matching with fuzzy logic and cultural context"""
-        input_lower = input_genre.lower().strip()
-        
-        # Direct match
-        if input_lower in genre_traits:
-            return input_lower, 1.0
-            
-        # Synonym match
-        if input_lower in genre_synonyms:
-            return genre_synonyms[input_lower], 1.0
-            
-        # Partial matching with scoring
-        best_match = "unknown"
-        best_score = 0.0
-        
-        for genre in genre_traits.keys():
-            # Check if input contains genre or vice versa
-            if genre in input_lower or input_lower in genre:
-                overlap = len(set(input_lower.split()) & set(genre.split()))
-                total_words = len(set(input_lower.split()) | set(genre.split()))
-                score = overlap / total_words if total_words > 0 else 0
-                
-                if score > best_score:
-                    best_score = score
-                    best_match = genre
-                    
-        # Also check for cultural/regional indicators
-        if "vietnam" in input_lower or "viet" in input_lower:
-            if "indie" in input_lower:
-                return "vietnam indie", 0.9
-            elif "hip hop" in input_lower or "rap" in input_lower:
-                return "vietnamese hip hop", 0.9
-            elif "lo-fi" in input_lower or "lofi" in input_lower:
-                return "vietnamese lo-fi", 0.9
-                
-        return best_match, max(best_score, 0.3)  # Minimum confidence for partial matches
-    
-    # Advanced trait calculation
-    traits = {
-        "openness": 0, 
-        "conscientiousness": 0, 
-        "extraversion": 0, 
-        "agreeableness": 0, 
-        "emotional_stability": 0
-    }
+    return _predict_personalities([(top_genres, audio_features, track_popularity_data)])[0]
+
+@timed('predict_personality_batch')
+def predict_personality_batch(users):
+    """
+    Predict the personalities of many users at once.
+
+    users is a list of (top_genres, audio_features, track_popularity_data)
+    tuples, as taken by predict_personality, and the result is the list of
+    their predictions. The users' genres, audio features and track data are
+    stacked into arrays so their statistics are computed in one pass; the
+    rest of the analysis runs per user.
+    """
+    return _predict_personalities(users)
+
+def _predict_personalities(users):
+    """Score a batch of users; predict_personality is a batch of one"""
+    scores, matched_genres, confidence_factors, cultural_regions = score_genres(
+        [top_genres for top_genres, _, _ in users])
+    audio_stats = audio_feature_stats([audio_features for _, audio_features, _ in users])
+    popularity_stats = track_popularity_stats([track_popularity_data for _, _, track_popularity_data in users])
+    scores = scores.tolist()
+    return [
+        _personality_from_scores(top_genres, audio_features, track_popularity_data, scores[user],
+                                 matched_genres[user], confidence_factors[user], cultural_regions[user],
+                                 audio_stats[user], popularity_stats[user])
+        for user, (top_genres, audio_features, track_popularity_data) in enumerate(users)
+    ]
+
+def _personality_from_scores(top_genres, audio_features, track_popularity_data, genre_scores,
+                             matched_genres, confidence_factors, cultural_regions, audio_stats, popularity_stats):
+    """Finish a personality prediction from a user's genre scores and track statistics"""
+    traits = dict(zip(TRAIT_NAMES, genre_scores[:5]))
+    complexity_score = genre_scores[5] if matched_genres else 0
+    total_weight = genre_scores[6]
     
     # Additional metrics
     genre_diversity = 0
     cultural_diversity = 0
-    complexity_score = 0
-    confidence_factors = []
-    matched_genres = []
-    total_weight = 0
-    cultural_regions = set()
-    
-    # Process each genre with advanced weighting
-    for i, (genre, weight) in enumerate(top_genres):
-        matched_genre, match_confidence = fuzzy_match_genre(genre)
-        genre_info = genre_traits[matched_genre]
-        
-        # Position-based weight decay (top genres matter more)
-        position_weight = 1.0 - (i * 0.05)  # 5% decay per position
-        
-        # Cultural context weighting
-        cultural_weight = genre_info["cultural_weight"]
-        
-        # Complexity contribution
-        complexity_contribution = genre_info["complexity"]
-        
-        # Final weight calculation
-        final_weight = weight * position_weight * cultural_weight * match_confidence
-        
-        # Add to traits
-        trait_values = genre_info["traits"]
-        traits["openness"] += trait_values[0] * final_weight
-        traits["conscientiousness"] += trait_values[1] * final_weight
-        traits["extraversion"] += trait_values[2] * final_weight
-        traits["agreeableness"] += trait_values[3] * final_weight
-        traits["emotional_stability"] += trait_values[4] * final_weight
-        
-        total_weight += final_weight
-        complexity_score += complexity_contribution * final_weight
-        
-        # Track diversity metrics
-        matched_genres.append(matched_genre)
-        confidence_factors.append(match_confidence)
-        
-        # Cultural diversity tracking
-        if "k-" in matched_genre or "korean" in matched_genre:
-            cultural_regions.add("korean")
-        elif "j-" in matched_genre or "japanese" in matched_genre:
-            cultural_regions.add("japanese")
-        elif "vietnam" in matched_genre or "v-" in matched_genre:
-            cultural_regions.add("vietnamese")
-        elif "latin" in matched_genre or "spanish" in matched_genre:
-            cultural_regions.add("latin")
-        elif matched_genre in ["folk", "country", "blues", "rock", "pop"]:
-            cultural_regions.add("western")
-        elif matched_genre in ["afrobeat", "reggae"]:
-            cultural_regions.add("african")
     
     # Analyze audio features if provided
     audio_features_impact = {
@@ -333,14 +761,8 @@ def predict_personality(top_genres, audio_features=None, track_popularity_data=N
     audio_weight = 0
     
     if audio_features and len(audio_features) > 0:
-        # Calculate average audio features
-        avg_features = {}
-        feature_keys = ['valence', 'energy', 'danceability', 'acousticness', 
-                       'instrumentalness', 'tempo', 'loudness', 'speechiness']
-        
-        for key in feature_keys:
-            values = [f.get(key, 0) for f in audio_features if f and f.get(key) is not None]
-            avg_features[key] = sum(values) / len(values) if values else 0
+        # Average audio features, computed column-wise (see audio_feature_stats)
+        avg_features = audio_stats["averages"]
         
         # Map audio features to personality traits
         # High valence (positive music) -> higher agreeableness, extraversion
@@ -419,36 +841,11 @@ def predict_personality(top_genres, audio_features=None, track_popularity_data=N
     }
     
     if audio_features and len(audio_features) > 0:
-        # Calculate advanced musical sophistication metrics
-        track_durations = [f.get('duration_ms', 0) for f in audio_features if f and f.get('duration_ms')]
-        avg_duration = sum(track_durations) / len(track_durations) if track_durations else 180000  # 3 min default
-        
-        # Musical complexity analysis
-        complexity_indicators = []
-        for f in audio_features:
-            if f:
-                # Complex music tends to have: low speechiness, variable tempo, high instrumentalness
-                complexity = (
-                    (1 - f.get('speechiness', 0)) * 0.3 +  # Less vocal = more complex
-                    f.get('instrumentalness', 0) * 0.4 +     # More instrumental = more complex
-                    (f.get('time_signature', 4) / 7) * 0.3   # Unusual time signatures = more complex
-                )
-                complexity_indicators.append(complexity)
-        
-        avg_complexity = sum(complexity_indicators) / len(complexity_indicators) if complexity_indicators else 0.3
-        
-        # Emotional range analysis (valence variance)
-        valences = [f.get('valence', 0.5) for f in audio_features if f and f.get('valence') is not None]
-        emotional_range = 0
-        if len(valences) > 1:
-            emotional_range = max(valences) - min(valences)
-        
-        # Energy consistency analysis
-        energies = [f.get('energy', 0.5) for f in audio_features if f and f.get('energy') is not None]
-        energy_variance = 0
-        if len(energies) > 1:
-            avg_energy = sum(energies) / len(energies)
-            energy_variance = sum((e - avg_energy) ** 2 for e in energies) / len(energies)
+        # Advanced musical sophistication metrics (see audio_feature_stats)
+        avg_duration = audio_stats["avg_duration"]
+        avg_complexity = audio_stats["avg_complexity"]
+        emotional_range = audio_stats["emotional_range"]
+        energy_variance = audio_stats["energy_variance"]
         
         # Apply sophisticated adjustments
         
@@ -467,8 +864,8 @@ def predict_personality(top_genres, audio_features=None, track_popularity_data=N
             secondary_adjustments["conscientiousness"] += 5
         
         # EXTRAVERSION: Confirmed by social, energetic music characteristics
-        avg_danceability = sum(f.get('danceability', 0) for f in audio_features if f) / len(audio_features)
-        avg_loudness = sum(f.get('loudness', -10) for f in audio_features if f) / len(audio_features)
+        avg_danceability = audio_stats["avg_danceability"]
+        avg_loudness = audio_stats["avg_loudness"]
         
         if avg_danceability > 0.7:
             secondary_adjustments["extraversion"] += 6
@@ -476,7 +873,7 @@ def predict_personality(top_genres, audio_features=None, track_popularity_data=N
             secondary_adjustments["extraversion"] += 4
         
         # AGREEABLENESS: Harmonious, positive music preferences
-        avg_valence = sum(f.get('valence', 0.5) for f in audio_features if f) / len(audio_features)
+        avg_valence = audio_stats["avg_valence"]
         if avg_valence > 0.65:
             secondary_adjustments["agreeableness"] += 8
         if avg_complexity < 0.4:  # Accessible, non-challenging music
@@ -514,44 +911,15 @@ def predict_personality(top_genres, audio_features=None, track_popularity_data=N
     
     # Analyze track popularity patterns and temporal data
     if track_popularity_data and len(track_popularity_data) > 0:
-        popularities = [track.get('popularity', 0) for track in track_popularity_data]
-        avg_popularity = sum(popularities) / len(popularities)
-        popularity_variance = sum((p - avg_popularity) ** 2 for p in popularities) / len(popularities)
-        
-        # Mainstream vs niche preference analysis
-        mainstream_count = sum(1 for p in popularities if p > 70)  # Very popular tracks
-        niche_count = sum(1 for p in popularities if p < 30)       # Less popular tracks
-        
-        mainstream_ratio = mainstream_count / len(popularities)
-        niche_ratio = niche_count / len(popularities)
-        
-        # Track duration patterns
-        durations = [track.get('duration_ms', 0) for track in track_popularity_data if track.get('duration_ms')]
-        avg_track_duration = sum(durations) / len(durations) if durations else 180000
-        
-        # Explicit content preference
-        explicit_count = sum(1 for track in track_popularity_data if track.get('explicit', False))
-        explicit_ratio = explicit_count / len(track_popularity_data)
-        
-        # Release date analysis (preference for newer vs older music)
-        current_year = 2024
-        release_years = []
-        for track in track_popularity_data:
-            release_date = track.get('release_date', '')
-            if release_date and len(release_date) >= 4:
-                try:
-                    year = int(release_date[:4])
-                    release_years.append(year)
-                except:
-                    pass
-        
-        if release_years:
-            avg_release_year = sum(release_years) / len(release_years)
-            year_variance = sum((y - avg_release_year) ** 2 for y in release_years) / len(release_years)
-            recency_preference = (avg_release_year - 1950) / (current_year - 1950)  # 0-1 scale
-        else:
-            year_variance = 0
-            recency_preference = 0.8  # Default to somewhat recent
+        # Popularity, duration, explicitness and release year statistics (see track_popularity_stats)
+        avg_popularity = popularity_stats["avg_popularity"]
+        popularity_variance = popularity_stats["popularity_variance"]
+        mainstream_ratio = popularity_stats["mainstream_ratio"]
+        niche_ratio = popularity_stats["niche_ratio"]
+        avg_track_duration = popularity_stats["avg_track_duration"]
+        explicit_ratio = popularity_stats["explicit_ratio"]
+        year_variance = popularity_stats["year_variance"]
+        recency_preference = popularity_stats["recency_preference"]
         
         # Apply popularity-based adjustments
         
@@ -680,68 +1048,11 @@ def predict_personality(top_genres, audio_features=None, track_popularity_data=N
     # Generate advanced descriptions
     def generate_dynamic_description(trait_name, score, context):
         """Generate contextual descriptions based on multiple factors"""
-        base_descriptions = {
-            "openness": {
-                "high": "intellectually curious and creatively adventurous",
-                "medium": "balanced between traditional and innovative approaches", 
-                "low": "practical and preferring established methods"
-            },
-            "conscientiousness": {
-                "high": "highly organized and goal-oriented",
-                "medium": "flexibly structured with adaptive planning",
-                "low": "spontaneous and preferring flexible approaches"
-            },
-            "extraversion": {
-                "high": "energetically social and outwardly focused",
-                "medium": "socially balanced with both outgoing and introspective tendencies",
-                "low": "reflectively introspective and preferring intimate connections"
-            },
-            "agreeableness": {
-                "high": "highly empathetic and cooperation-focused",
-                "medium": "diplomatically balanced between empathy and assertion",
-                "low": "analytically objective and logic-focused"
-            },
-            "emotional_stability": {
-                "high": "emotionally resilient and stress-resistant",
-                "medium": "emotionally responsive yet stable",
-                "low": "emotionally sensitive and deeply feeling"
-            }
-        }
-        
-        # Trait-specific contextual additions based on musical analysis
-        trait_specific_contexts = {
-            "openness": {
-                "high_diversity": "with a strong appetite for musical exploration and genre experimentation",
-                "high_complexity": "drawn to sophisticated and avant-garde musical expressions",
-                "high_cultural": "showing deep appreciation for global musical traditions"
-            },
-            "conscientiousness": {
-                "high_diversity": "with methodical exploration of different musical styles",
-                "high_complexity": "appreciating structured and technically complex compositions",
-                "high_cultural": "systematically engaging with diverse cultural music forms"
-            },
-            "extraversion": {
-                "high_diversity": "energized by a wide range of social and danceable music",
-                "high_complexity": "enjoying both mainstream hits and sophisticated musical arrangements",
-                "high_cultural": "connecting through music across different cultural communities"
-            },
-            "agreeableness": {
-                "high_diversity": "finding harmony and connection through diverse musical experiences",
-                "high_complexity": "appreciating both accessible melodies and nuanced emotional expressions",
-                "high_cultural": "embracing music as a bridge between different cultures and perspectives"
-            },
-            "emotional_stability": {
-                "high_diversity": "maintaining emotional balance through varied musical moods and styles",
-                "high_complexity": "comfortable with both challenging and soothing musical experiences",
-                "high_cultural": "finding emotional resonance in music from different cultural backgrounds"
-            }
-        }
-        
         level = "high" if score >= 65 else "medium" if score >= 45 else "low"
-        base_desc = base_descriptions[trait_name][level]
+        base_desc = TRAIT_DESCRIPTIONS[trait_name][level]
         
         # Add trait-specific contextual modifier (only one per trait to avoid repetition)
-        trait_contexts = trait_specific_contexts.get(trait_name, {})
+        trait_contexts = TRAIT_CONTEXTS.get(trait_name, {})
         contextual_addition = None
         
         # Priority: complexity > cultural > diversity (to avoid multiple modifiers)
@@ -786,13 +1097,9 @@ def predict_personality(top_genres, audio_features=None, track_popularity_data=N
     
     # Prepare audio features summary
     audio_features_summary = None
-    if audio_features and len(audio_features) > 0:
-        avg_features = {}
+    if audio_stats is not None:
         feature_keys = ['valence', 'energy', 'danceability', 'acousticness', 'instrumentalness', 'tempo']
-        for key in feature_keys:
-            values = [f.get(key, 0) for f in audio_features if f and f.get(key) is not None]
-            avg_features[key] = round(sum(values) / len(values), 3) if values else 0
-        audio_features_summary = avg_features
+        audio_features_summary = {key: round(audio_stats["averages"][key], 3) for key in feature_keys}
     
     return {
         "scores": traits,
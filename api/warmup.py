@@ -0,0 +1,185 @@
+"""
+Startup warm-up of the dataset caches.
+
+After a restart every cache is empty, so the first requests for each user
+pay for parsing the dataset, decoding the track/artist model, matching
+genres and fetching audio features. start() does that work on a background
+thread instead: it finds every *_spotify.json dataset in data/ (most recently
+written first) and, for each one,
+
+- loads its materialized results and its track/artist model (models.py),
+- and, when it has no valid materialized results, parses the raw steps,
+  matches every artist genre (fuzzy_match_genre) and loads the audio
+  features of its tracks into the memory layer of the audio feature store
+  (fetching those missing from SQLite from Spotify, in the background lane
+  of the outbound scheduler).
+
+Datasets are warmed until the memory they hold reaches WARMUP_MEMORY_BUDGET_MB
+or the dataset caches are full; the rest are loaded on first request as
+before. status() reports the progress, and /ready answers 503 until warm-up
+has finished.
+"""
+import os
+import sys
+import glob
+import time
+import threading
+
+from utils import DATASET_CACHE_SIZE, load_dataset, fuzzy_match_genre, dataset_cache
+from models import TRACK_STEPS, ARTIST_STEPS, load_model, model_cache
+from materialize import load_materialized, materialized_cache
+from audio_features import audio_feature_store
+from outbound import background
+
+# Set WARMUP=0 to start cold (the app is then ready at once)
+WARMUP = os.getenv('WARMUP', '1') == '1'
+WARMUP_DIRECTORY = os.getenv('WARMUP_DIRECTORY', 'data')
+# Memory the warmed datasets may hold, as measured by deep_size
+WARMUP_MEMORY_BUDGET_MB = float(os.getenv('WARMUP_MEMORY_BUDGET_MB', 256))
+# Set WARMUP_AUDIO_FEATURES=0 to skip audio features (and the Spotify calls for missing ones)
+WARMUP_AUDIO_FEATURES = os.getenv('WARMUP_AUDIO_FEATURES', '1') == '1'
+
+_lock = threading.Lock()
+_thread = None
+_status = {
+    "state": "pending",
+    "datasets": 0,
+    "warmed": 0,
+    "current": None,
+    "skipped": [],
+    "errors": {},
+    "memory_bytes": 0,
+    "budget_bytes": int(WARMUP_MEMORY_BUDGET_MB * 1024 * 1024),
+    "duration_seconds": None
+}
+
+def deep_size(obj):
+    """Approximate memory held by an object and everything it references, in bytes"""
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(type(item), '__slots__'):
+            stack.extend(getattr(item, name) for name in type(item).__slots__ if hasattr(item, name))
+    return size
+
+def discover(directory=WARMUP_DIRECTORY):
+    """Return the datasets in a directory, most recently written first"""
+    return sorted(glob.glob(os.path.join(directory, '*_spotify.json')), key=os.path.getmtime, reverse=True)
+
+def _track_ids(steps):
+    track_ids = []
+    for step, nested in TRACK_STEPS.items():
+        for item in (steps.get(step) or {}).get('items', []):
+            track = item.get('track', {}) if nested else item
+            if track.get('id'):
+                track_ids.append(track['id'])
+    return track_ids
+
+def warm_dataset(filename):
+    """Load one dataset into the caches; returns the memory it holds there, in bytes"""
+    materialized = load_materialized(filename)
+    size = deep_size(materialized) + deep_size(load_model(filename))
+    if materialized is None:
+        # Live analyses: raw steps, genre matches and audio features
+        steps = load_dataset(filename) or {}
+        size += deep_size(steps)
+        for step in ARTIST_STEPS:
+            for artist in (steps.get(step) or {}).get('items', []):
+                for genre in artist.get('genres', []):
+                    fuzzy_match_genre(genre)
+        if WARMUP_AUDIO_FEATURES:
+            try:
+                audio_feature_store.get_many(_track_ids(steps))
+            except Exception as e:
+                # The dataset stays warm; missing features are fetched on first request
+                with _lock:
+                    _status["errors"][os.path.basename(filename)] = f"Audio features: {e}"
+    return size
+
+def _evict(filename):
+    key = os.path.abspath(filename)
+    for cache in (dataset_cache, model_cache, materialized_cache):
+        cache.pop(key)
+
+def _update(**changes):
+    with _lock:
+        _status.update(changes)
+
+def run(directory=WARMUP_DIRECTORY):
+    """Warm the caches with the datasets in a directory, within the memory budget"""
+    started = time.perf_counter()
+    used = 0
+    warmed = 0
+    datasets = []
+    try:
+        datasets = discover(directory)
+        _update(state="running", datasets=len(datasets))
+        for filename in datasets:
+            name = os.path.basename(filename)
+            if warmed >= DATASET_CACHE_SIZE:
+                # Further datasets would only evict the ones already warmed
+                with _lock:
+                    _status["skipped"].append(name)
+                continue
+            _update(current=name)
+            try:
+                # Requests being served get Spotify's rate limit first
+                with background():
+                    size = warm_dataset(filename)
+            except Exception as e:
+                _evict(filename)
+                with _lock:
+                    _status["errors"][name] = str(e)
+                continue
+            if used + size > _status["budget_bytes"]:
+                _evict(filename)
+                with _lock:
+                    _status["skipped"].append(name)
+                continue
+            used += size
+            warmed += 1
+            _update(warmed=warmed, memory_bytes=used)
+    finally:
+        # A failed warm-up must not keep the app out of service
+        duration = round(time.perf_counter() - started, 3)
+        _update(state="done", current=None, duration_seconds=duration)
+        print(f"Warm-up: {warmed} of {len(datasets)} datasets ({used / 1024 / 1024:.1f} MiB) in {duration} s")
+
+def start(directory=WARMUP_DIRECTORY):
+    """
+    Start warm-up on a background thread (or mark the app ready at once with
+    WARMUP=0). Only the first call does anything; the server entry points
+    call it, not the import of main.
+    """
+    global _thread
+    with _lock:
+        if _status["state"] != "pending" or _thread is not None:
+            return _thread
+        if not WARMUP:
+            _status["state"] = "disabled"
+            return None
+        _thread = threading.Thread(target=run, args=(directory,), name="warmup", daemon=True)
+        _thread.start()
+    return _thread
+
+def ready():
+    """True once warm-up has finished or is disabled"""
+    with _lock:
+        return _status["state"] in ("done", "disabled")
+
+def status():
+    """Return warm-up progress: state, readiness, dataset counts, memory used and duration"""
+    with _lock:
+        return dict(_status, ready=_status["state"] in ("done", "disabled"),
+                    skipped=list(_status["skipped"]), errors=dict(_status["errors"]))